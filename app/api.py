@@ -0,0 +1,448 @@
+import argparse
+import asyncio
+import base64
+import contextlib
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+from app.decode import open_video
+from app.detections import Detections, filter_detections
+from app.draw_box import draw_boxes
+from app.metrics import METRICS
+from app.result_cache import RAW_CONFIDENCE, RAW_IOU, RAW_MAX_DET
+
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+MAX_VIDEO_BYTES = 2 * 1024 * 1024 * 1024
+JPEG_QUALITY = 85
+
+class Overloaded(Exception):
+    pass
+
+class InferenceBatcher:
+    # Gom các yêu cầu đồng thời thành một lần gọi model: đợi tối đa max_wait giây hoặc đủ
+    # max_batch ảnh. Model chạy trên thread pool (`workers` batch cùng lúc; để 1 nếu backend
+    # không an toàn đa luồng). Model luôn chạy với ngưỡng "thô" rồi lọc lại theo ngưỡng của
+    # từng yêu cầu, nên các yêu cầu khác ngưỡng vẫn chung được một batch.
+    def __init__(self, model, max_batch=8, max_wait=0.01, workers=1, max_queue=64):
+        self.model = model
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max_wait
+        self.workers = max(1, int(workers))
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="api-inference")
+        self.requests = 0
+        self.rejected = 0
+        self.batches = 0
+        self.batched_images = 0
+        self.in_flight = 0
+        self._queue = None
+        self._slots = None
+        self._task = None
+        self._loop = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.workers)
+        self._task = asyncio.create_task(self._collect())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown(wait=True)
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def detect_raw(self, image, limit=True):
+        if limit and self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded(f"Hàng đợi đầy ({self.queue_depth} ảnh)")
+        self.requests += 1
+        future = self._loop.create_future()
+        await self._queue.put((image, future))
+        return await future
+
+    async def detect(self, image, confidence_threshold, iou_threshold):
+        raw = await self.detect_raw(image)
+        return filter_detections(raw, confidence_threshold, iou_threshold)
+
+    def detect_sync(self, image, confidence_threshold, iou_threshold):
+        # Gọi từ luồng khác (vd. job video) qua cùng hàng đợi để mọi lần gọi model đi qua batcher.
+        # Mỗi job chỉ chờ một frame một lúc nên không bị giới hạn max_queue.
+        raw = asyncio.run_coroutine_threadsafe(self.detect_raw(image, limit=False), self._loop).result()
+        return filter_detections(raw, confidence_threshold, iou_threshold)
+
+    async def _collect(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._slots.acquire()
+            asyncio.create_task(self._run(batch))
+
+    async def _run(self, batch):
+        self.in_flight += len(batch)
+        try:
+            results = await self._loop.run_in_executor(self.executor, self._infer, [image for image, _ in batch])
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.in_flight -= len(batch)
+            self.batches += 1
+            self.batched_images += len(batch)
+            self._slots.release()
+
+    def _infer(self, images):
+        source = images[0] if len(images) == 1 else images
+        with METRICS.timer('inference'):
+            results = self.model(source, conf=RAW_CONFIDENCE, iou=RAW_IOU, max_det=RAW_MAX_DET, verbose=False)
+        return [Detections.from_results(result) for result in results]
+
+class BatchedModel:
+    # Giao diện giống model (model(frame, conf=..., iou=...)) nhưng chuyển yêu cầu vào batcher,
+    # để dùng lại analyze_video cho job video
+    def __init__(self, batcher):
+        self.batcher = batcher
+
+    def __call__(self, source, conf=0.25, iou=0.7, **kwargs):
+        images = source if isinstance(source, (list, tuple)) else [source]
+        return [self.batcher.detect_sync(image, conf, iou) for image in images]
+
+class VideoJobs:
+    # Job video chạy nền (tối đa max_jobs cùng lúc), theo dõi tiến độ qua GET /videos/{id}.
+    # Job đã xong/lỗi được giữ job_ttl giây để lấy kết quả, và không quá max_finished job.
+    # Quá max_pending job đang chờ (mỗi job giữ một file tạm) thì job mới bị từ chối (Overloaded).
+    def __init__(self, batcher, max_jobs=2, job_ttl=3600.0, max_finished=1000, max_pending=8):
+        self.batcher = batcher
+        self.executor = ThreadPoolExecutor(max_jobs, thread_name_prefix="api-video")
+        self.job_ttl = job_ttl
+        self.max_finished = max_finished
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    def _evict_locked(self, now):
+        finished = sorted((job['finished_at'], job_id) for job_id, job in self.jobs.items()
+                          if job['status'] in ('done', 'failed'))
+        excess = len(finished) - self.max_finished
+        for index, (finished_at, job_id) in enumerate(finished):
+            if index < excess or now - finished_at > self.job_ttl:
+                del self.jobs[job_id]
+
+    def check_capacity(self):
+        # Kiểm tra trước khi nhận file để không ghi ra đĩa video sẽ bị từ chối
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise Overloaded("Quá nhiều job video đang chờ, vui lòng thử lại sau")
+
+    def submit(self, path, confidence_threshold, iou_threshold, skip_frames=3, track=False, filename=None):
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise Overloaded("Quá nhiều job video đang chờ, vui lòng thử lại sau")
+            self.pending += 1
+            self._evict_locked(time.time())
+            self.jobs[job_id] = {'id': job_id, 'status': 'queued', 'filename': filename, 'frames': 0,
+                                 'total_frames': 0, 'progress': 0.0, 'created_at': time.time()}
+        self.executor.submit(self._run, job_id, path, confidence_threshold, iou_threshold, skip_frames, track)
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            self._evict_locked(time.time())
+            job = self.jobs.get(job_id)
+            return None if job is None else dict(job)
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self.jobs[job_id].update(fields)
+
+    def _run(self, job_id, path, confidence_threshold, iou_threshold, skip_frames, track):
+        from app.processing import analyze_video, summarize_video_stats
+        from app.tracker import IouTracker
+
+        with self._lock:
+            self.pending -= 1
+        try:
+            cap = open_video(path)
+            if not cap.isOpened():
+                raise ValueError("Không mở được video")
+            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            self._update(job_id, status='running', total_frames=total_frames, started_at=time.time())
+
+            # Job chỉ trả thống kê: không vẽ box lên frame
+            def on_frame(frame_count, annotated_frame):
+                progress = min(frame_count / total_frames, 1.0) if total_frames > 0 else 0.0
+                self._update(job_id, frames=frame_count, progress=progress)
+
+            stats = analyze_video(cap, BatchedModel(self.batcher), confidence_threshold, iou_threshold,
+                                  skip_frames, on_frame=on_frame, tracker=IouTracker() if track else None,
+                                  annotate=False)
+            self._update(job_id, status='done', progress=1.0, finished_at=time.time(),
+                         summary={key: float(value) for key, value in summarize_video_stats(stats).items()})
+        except Exception as e:
+            self._update(job_id, status='failed', error=str(e), finished_at=time.time())
+        finally:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def counts(self):
+        with self._lock:
+            statuses = [job['status'] for job in self.jobs.values()]
+        return {status: statuses.count(status) for status in ('queued', 'running', 'done', 'failed')}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+def detections_to_json(results):
+    boxes = results.boxes
+    return [
+        {'class': results.names[int(cls_id)], 'confidence': round(float(conf), 4),
+         'box': [round(float(value), 1) for value in xyxy]}
+        for xyxy, conf, cls_id in zip(boxes.xyxy, boxes.conf, boxes.cls)
+    ]
+
+def _float_param(request, name, default):
+    try:
+        return float(request.query_params.get(name, default))
+    except ValueError:
+        raise ValueError(f"Tham số {name} không hợp lệ")
+
+def _threshold_params(request):
+    # Model chạy với ngưỡng thô RAW_CONFIDENCE rồi mới lọc, nên conf thấp hơn không có tác dụng;
+    # NaN không thoả mọi phép so sánh nên cũng bị từ chối
+    confidence_threshold = _float_param(request, "conf", 0.5)
+    iou_threshold = _float_param(request, "iou", 0.4)
+    if not RAW_CONFIDENCE <= confidence_threshold <= 1:
+        raise ValueError(f"Tham số conf phải trong khoảng [{RAW_CONFIDENCE}, 1]")
+    if not 0 < iou_threshold <= 1:
+        raise ValueError("Tham số iou phải trong khoảng (0, 1]")
+    return confidence_threshold, iou_threshold
+
+def _flag_param(request, name):
+    return request.query_params.get(name, "").lower() in ("1", "true", "yes")
+
+async def _read_body(request, limit):
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+def _annotate(image, results, annotate):
+    annotated, stats = draw_boxes(image, results)
+    encoded = None
+    if annotate:
+        ok, buffer = cv2.imencode(".jpg", annotated, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        encoded = base64.b64encode(buffer).decode() if ok else None
+    return stats, encoded
+
+async def detect_image(request):
+    # POST /detect?conf=0.5&iou=0.4&annotate=1, thân request là file ảnh (jpg/png)
+    try:
+        confidence_threshold, iou_threshold = _threshold_params(request)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+    body = await _read_body(request, MAX_IMAGE_BYTES)
+    if body is None:
+        return JSONResponse({'error': "Ảnh quá lớn"}, status_code=413)
+    image = await asyncio.to_thread(cv2.imdecode, np.frombuffer(body, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return JSONResponse({'error': "Không đọc được ảnh"}, status_code=400)
+
+    batcher = request.app.state.batcher
+    start = time.perf_counter()
+    try:
+        results = await batcher.detect(image, confidence_threshold, iou_threshold)
+    except Overloaded as e:
+        return JSONResponse({'error': str(e)}, status_code=503, headers={'Retry-After': '1'})
+    latency = time.perf_counter() - start
+
+    stats, encoded = await asyncio.to_thread(_annotate, image, results, _flag_param(request, "annotate"))
+    total = stats['helmet'] + stats['no_helmet']
+    response = {
+        'detections': detections_to_json(results),
+        'stats': {'total': total, 'helmet': stats['helmet'], 'no_helmet': stats['no_helmet'],
+                  'safety_rate': (stats['helmet'] / total * 100) if total > 0 else 0},
+        'latency_ms': round(latency * 1000, 2),
+    }
+    if encoded is not None:
+        response['image_jpeg_base64'] = encoded
+    return JSONResponse(response)
+
+async def submit_video(request):
+    # POST /videos?filename=x.mp4&conf=0.5&iou=0.4&skip_frames=3&track=1, thân request là file video
+    try:
+        confidence_threshold, iou_threshold = _threshold_params(request)
+        skip_frames = max(1, int(_float_param(request, "skip_frames", 3)))
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    try:
+        request.app.state.jobs.check_capacity()
+    except Overloaded as e:
+        return JSONResponse({'error': str(e)}, status_code=503, headers={'Retry-After': '30'})
+
+    filename = request.query_params.get("filename", "video.mp4")
+    suffix = os.path.splitext(filename)[1].lower() or ".mp4"
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    size = 0
+    try:
+        # Ghi thẳng từng khối ra file tạm, không giữ cả video trong bộ nhớ
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > MAX_VIDEO_BYTES:
+                    raise OverflowError
+                await asyncio.to_thread(f.write, chunk)
+    except OverflowError:
+        os.remove(path)
+        return JSONResponse({'error': "Video quá lớn"}, status_code=413)
+    except Exception:
+        os.remove(path)
+        raise
+
+    try:
+        job_id = request.app.state.jobs.submit(path, confidence_threshold, iou_threshold, skip_frames,
+                                               _flag_param(request, "track"), filename)
+    except Overloaded as e:
+        os.remove(path)
+        return JSONResponse({'error': str(e)}, status_code=503, headers={'Retry-After': '30'})
+    return JSONResponse({'id': job_id, 'status_url': f"/videos/{job_id}"}, status_code=202)
+
+async def video_status(request):
+    job = request.app.state.jobs.get(request.path_params['job_id'])
+    if job is None:
+        return JSONResponse({'error': "Không tìm thấy job"}, status_code=404)
+    return JSONResponse(job)
+
+def _batcher_gauges(batcher):
+    return {
+        'queue_depth': batcher.queue_depth,
+        'in_flight': batcher.in_flight,
+        'requests': batcher.requests,
+        'rejected': batcher.rejected,
+        'batches': batcher.batches,
+        'avg_batch_size': batcher.batched_images / batcher.batches if batcher.batches else 0,
+    }
+
+async def metrics(request):
+    batcher = request.app.state.batcher
+    response = _batcher_gauges(batcher)
+    response.update(video_jobs=request.app.state.jobs.counts(),
+                    video_jobs_rejected=request.app.state.jobs.rejected,
+                    model_variant=getattr(batcher.model, 'variant', None),
+                    pipeline=METRICS.snapshot())
+    return JSONResponse(response)
+
+async def prometheus_metrics(request):
+    # GET /metrics/prometheus: thời gian từng bước, bộ đếm frame và trạng thái hàng đợi cho Prometheus
+    gauges = _batcher_gauges(request.app.state.batcher)
+    gauges.update({f"video_jobs_{status}": count for status, count in request.app.state.jobs.counts().items()})
+    gauges['video_jobs_rejected'] = request.app.state.jobs.rejected
+    return PlainTextResponse(METRICS.prometheus(gauges), media_type="text/plain; version=0.0.4")
+
+async def health(request):
+    return JSONResponse({'status': 'ok'})
+
+def create_app(model=None, max_batch=8, max_wait=0.01, workers=1, max_queue=64, max_video_jobs=2,
+               job_ttl=3600.0, backend=None, max_pending_videos=8):
+    # model=None: tải model theo cấu hình (load_model.build_default_model) khi ứng dụng khởi động
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        nonlocal model
+        if model is None:
+            from app.load_model import MODEL_BACKEND, build_default_model
+            model = await asyncio.to_thread(build_default_model, backend or MODEL_BACKEND)
+        app.state.batcher = InferenceBatcher(model, max_batch, max_wait, workers, max_queue)
+        await app.state.batcher.start()
+        app.state.jobs = VideoJobs(app.state.batcher, max_video_jobs, job_ttl, max_pending=max_pending_videos)
+        try:
+            yield
+        finally:
+            await asyncio.to_thread(app.state.jobs.shutdown)
+            await app.state.batcher.stop()
+
+    return Starlette(routes=[
+        Route("/health", health),
+        Route("/metrics", metrics),
+        Route("/metrics/prometheus", prometheus_metrics),
+        Route("/detect", detect_image, methods=["POST"]),
+        Route("/videos", submit_video, methods=["POST"]),
+        Route("/videos/{job_id}", video_status),
+    ], lifespan=lifespan)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP API nhận diện mũ bảo hiểm")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--weights", default=None, help="Đường dẫn model (mặc định: theo HELMET_MODEL_VARIANT)")
+    parser.add_argument("--backend", default=None, help="Backend suy luận")
+    parser.add_argument("--stub", action="store_true", help="Dùng model giả của benchmark (không cần weights)")
+    parser.add_argument("--max-batch", type=int, default=8, help="Số ảnh tối đa gom trong một lần gọi model")
+    parser.add_argument("--max-wait", type=float, default=0.01, help="Thời gian chờ gom batch (giây)")
+    parser.add_argument("--workers", type=int, default=1, help="Số batch chạy đồng thời")
+    parser.add_argument("--max-queue", type=int, default=64, help="Số ảnh chờ tối đa trước khi trả 503")
+    parser.add_argument("--max-video-jobs", type=int, default=2, help="Số job video chạy đồng thời")
+    parser.add_argument("--max-pending-videos", type=int, default=8,
+                        help="Số job video chờ tối đa trước khi trả 503")
+    parser.add_argument("--job-ttl", type=float, default=3600.0,
+                        help="Số giây giữ kết quả job video đã xong trước khi xoá")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    import uvicorn
+
+    args = parse_args(argv)
+    model = None
+    if args.stub:
+        from app.benchmark import StubModel
+        model = StubModel(latency=0.02)
+    elif args.weights:
+        from app.load_model import MODEL_BACKEND, build_model
+        model = build_model(args.weights, args.backend or MODEL_BACKEND)
+
+    # Không chỉ định --weights: model theo HELMET_MODEL_VARIANT, tải khi ứng dụng khởi động
+    app = create_app(model, args.max_batch, args.max_wait, args.workers, args.max_queue, args.max_video_jobs,
+                     args.job_ttl, args.backend, args.max_pending_videos)
+    uvicorn.run(app, host=args.host, port=args.port)
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
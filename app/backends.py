@@ -0,0 +1,171 @@
+import ast
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from app.detections import Detections, batched_nms
+
+class UltralyticsBackend:
+    # Hành vi mặc định: ultralytics.YOLO tự lo tiền xử lý, suy luận và hậu xử lý
+    name = "ultralytics"
+
+    def __init__(self, model_path, input_size=None):
+        from ultralytics import YOLO
+        self.model = YOLO(model_path, task="detect")
+        self.input_size = input_size  # cạnh ảnh input (imgsz); None: theo model
+
+    @property
+    def names(self):
+        return self.model.names
+
+    def __call__(self, source, **kwargs):
+        if self.input_size is not None:
+            kwargs.setdefault('imgsz', self.input_size)
+        return self.model(source, **kwargs)
+
+class OnnxRuntimeBackend:
+    # Gọi thẳng onnxruntime: tự cấu hình session, dùng bộ đệm vào/ra cấp phát sẵn (IO binding),
+    # letterbox và NMS bằng NumPy. Trả về Detections mà draw_boxes dùng được trực tiếp.
+    name = "onnxruntime"
+
+    GRAPH_OPTIMIZATION_LEVELS = {
+        "disable": "ORT_DISABLE_ALL",
+        "basic": "ORT_ENABLE_BASIC",
+        "extended": "ORT_ENABLE_EXTENDED",
+        "all": "ORT_ENABLE_ALL",
+    }
+
+    def __init__(self, model_path, intra_op_threads=0, inter_op_threads=0, graph_optimization="all",
+                 providers=None, max_batch=8, input_size=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads  # 0 = để onnxruntime tự chọn
+        options.inter_op_num_threads = inter_op_threads
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = getattr(
+            ort.GraphOptimizationLevel, self.GRAPH_OPTIMIZATION_LEVELS[graph_optimization])
+
+        self.session = ort.InferenceSession(model_path, sess_options=options,
+                                            providers=providers or ["CPUExecutionProvider"])
+        self.names = self._read_names(self.session)
+
+        model_input = self.session.get_inputs()[0]
+        model_output = self.session.get_outputs()[0]
+        self.input_name = model_input.name
+        self.output_name = model_output.name
+
+        # input_size (cạnh ảnh input) chỉ đổi được với model xuất kích thước động (export dynamic=True)
+        batch, _, height, width = model_input.shape
+        if input_size is not None and isinstance(height, int) and (height, width) != (input_size, input_size):
+            raise ValueError(f"Model có kích thước input cố định {height}x{width}, không chạy được ở {input_size}")
+        self.input_size = (height if isinstance(height, int) else input_size or 640,
+                           width if isinstance(width, int) else input_size or 640)
+        self.static_batch = isinstance(batch, int)
+        self.max_batch = batch if self.static_batch else max(1, int(max_batch))
+
+        # Bộ đệm cấp phát một lần, tái sử dụng cho mọi lần gọi
+        self._input = np.zeros((self.max_batch, 3, *self.input_size), dtype=np.float32)
+        self._canvas = np.full((*self.input_size, 3), 114, dtype=np.uint8)
+        self._lock = threading.Lock()
+
+        self._binding = None
+        if self.static_batch and all(isinstance(dim, int) for dim in model_output.shape):
+            self._output = np.empty(model_output.shape, dtype=np.float32)
+            self._binding = self.session.io_binding()
+            self._binding.bind_ortvalue_input(self.input_name, ort.OrtValue.ortvalue_from_numpy(self._input))
+            self._binding.bind_ortvalue_output(self.output_name, ort.OrtValue.ortvalue_from_numpy(self._output))
+
+    @staticmethod
+    def _read_names(session):
+        # Model xuất từ ultralytics lưu tên lớp trong metadata, ví dụ "{0: 'helmet', 1: 'no_helmet'}"
+        metadata = session.get_modelmeta().custom_metadata_map
+        if "names" in metadata:
+            return ast.literal_eval(metadata["names"])
+        num_classes = session.get_outputs()[0].shape[1] - 4
+        return {i: str(i) for i in range(num_classes)}
+
+    def letterbox(self, image, index):
+        # Thu nhỏ giữ tỉ lệ rồi đặt vào giữa khung input (viền 114), ghi thẳng vào bộ đệm input
+        input_h, input_w = self.input_size
+        h0, w0 = image.shape[:2]
+        ratio = min(input_h / h0, input_w / w0)
+        new_w, new_h = int(round(w0 * ratio)), int(round(h0 * ratio))
+        left = int(round((input_w - new_w) / 2 - 0.1))
+        top = int(round((input_h - new_h) / 2 - 0.1))
+
+        self._canvas.fill(114)
+        self._canvas[top:top + new_h, left:left + new_w] = cv2.resize(
+            image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        # BGR HWC uint8 -> RGB CHW float32 [0, 1]
+        np.multiply(self._canvas[..., ::-1].transpose(2, 0, 1), 1 / 255.0,
+                    out=self._input[index], casting="unsafe")
+        return ratio, left, top
+
+    def _run(self, count):
+        if self._binding is not None and count == self.max_batch:
+            self.session.run_with_iobinding(self._binding)
+            return self._output
+        return self.session.run([self.output_name], {self.input_name: self._input[:count]})[0]
+
+    def postprocess(self, prediction, confidence_threshold, iou_threshold, max_det, letterbox_info, orig_shape):
+        # prediction: (4 + số lớp, số anchor) gồm cx, cy, w, h và điểm từng lớp
+        if prediction.shape[0] > prediction.shape[1]:
+            prediction = prediction.T
+        class_scores = prediction[4:]
+        cls = class_scores.argmax(axis=0)
+        conf = class_scores[cls, np.arange(class_scores.shape[1])]
+        candidates = np.flatnonzero(conf > confidence_threshold)
+
+        cx, cy, w, h = prediction[:4, candidates]
+        xyxy = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+        keep = batched_nms(xyxy, conf[candidates], cls[candidates], iou_threshold)[:max_det]
+
+        # Đưa toạ độ về ảnh gốc
+        ratio, left, top = letterbox_info
+        xyxy = (xyxy[keep] - np.array([left, top, left, top], dtype=np.float32)) / ratio
+        xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, orig_shape[1])
+        xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, orig_shape[0])
+        return xyxy, conf[candidates][keep], cls[candidates][keep]
+
+    def __call__(self, source, conf=0.25, iou=0.7, max_det=300, verbose=False, **kwargs):
+        images = source if isinstance(source, (list, tuple)) else [source]
+        results = []
+
+        with self._lock:
+            for start in range(0, len(images), self.max_batch):
+                chunk = images[start:start + self.max_batch]
+
+                t0 = time.perf_counter()
+                letterbox_info = [self.letterbox(image, i) for i, image in enumerate(chunk)]
+                t1 = time.perf_counter()
+                # Model batch tĩnh: phần trống của bộ đệm vẫn được chạy nhưng bỏ qua kết quả
+                output = self._run(len(chunk) if not self.static_batch else self.max_batch)
+                t2 = time.perf_counter()
+
+                for i, image in enumerate(chunk):
+                    xyxy, scores, cls = self.postprocess(output[i], conf, iou, max_det,
+                                                         letterbox_info[i], image.shape[:2])
+                    results.append(Detections(xyxy, scores, cls, self.names, image.shape[:2]))
+                t3 = time.perf_counter()
+
+                speed = {
+                    'preprocess': (t1 - t0) * 1000 / len(chunk),
+                    'inference': (t2 - t1) * 1000 / len(chunk),
+                    'postprocess': (t3 - t2) * 1000 / len(chunk),
+                }
+                for result in results[start:]:
+                    result.speed = speed
+        return results
+
+BACKENDS = {
+    UltralyticsBackend.name: UltralyticsBackend,
+    OnnxRuntimeBackend.name: OnnxRuntimeBackend,
+}
+
+def create_backend(name, model_path, **options):
+    if name not in BACKENDS:
+        raise ValueError(f"Backend không hợp lệ: {name} (hỗ trợ: {', '.join(BACKENDS)})")
+    return BACKENDS[name](model_path, **options)
@@ -0,0 +1,246 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from app.decode import open_video
+from app.detections import Detections
+from app.draw_box import draw_boxes
+from app.metrics import METRICS
+
+class StubModel:
+    # Model giả: sinh box ngẫu nhiên nhưng tái lập được, cho phép benchmark không cần weights
+    names = {0: 'helmet', 1: 'no_helmet'}
+
+    def __init__(self, boxes_per_frame=20, latency=0.0, seed=0):
+        self.boxes_per_frame = boxes_per_frame
+        self.latency = latency
+        self.rng = np.random.default_rng(seed)
+
+    def _predict(self, image):
+        height, width = image.shape[:2]
+        n = self.boxes_per_frame
+        top_left = self.rng.uniform(0, 1, (n, 2)) * [width * 0.9, height * 0.9]
+        size = self.rng.uniform(0.03, 0.1, (n, 2)) * [width, height]
+        return Detections(np.hstack([top_left, top_left + size]), self.rng.uniform(0.3, 1.0, n),
+                          self.rng.integers(0, 2, n), self.names, image.shape[:2])
+
+    def __call__(self, source, **kwargs):
+        images = source if isinstance(source, (list, tuple)) else [source]
+        if self.latency:
+            time.sleep(self.latency * len(images))
+        return [self._predict(image) for image in images]
+
+def _record_model_speed(results):
+    # Backend ultralytics/onnxruntime tự đo tiền xử lý/hậu xử lý bên trong lần gọi model: ghi thêm
+    # thành bước riêng (bước inference là toàn bộ lần gọi model, đo trong infer_batch)
+    for result in results:
+        speed = getattr(result, 'speed', None) or {}
+        for name in ('preprocess', 'postprocess'):
+            if name in speed:
+                METRICS.observe(name, speed[name] / 1000)
+
+def _annotate_and_render(frame, results, jpeg_quality):
+    # draw_boxes tự đo bước annotate; mã hoá JPEG thay cho bước gửi frame lên giao diện
+    annotated, stats = draw_boxes(frame.copy(), results, actual_fps=0.0)
+    with METRICS.timer('render'):
+        cv2.imencode('.jpg', annotated, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+    return stats
+
+def make_synthetic_video(path, frames=150, size=(1280, 720), fps=25, seed=0):
+    # Video tổng hợp: nền nhiễu cố định và các khối chuyển động
+    rng = np.random.default_rng(seed)
+    width, height = size
+    background = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, size)
+    for i in range(frames):
+        frame = background.copy()
+        for j in range(8):
+            x = int((i * (4 + j) + j * 97) % (width - 60))
+            y = int((j * height / 8 + i) % (height - 60))
+            cv2.rectangle(frame, (x, y), (x + 60, y + 60), (40 * j % 255, 200, 255 - 30 * j), -1)
+        writer.write(frame)
+    writer.release()
+    return path
+
+def benchmark_images(model, paths, confidence_threshold, iou_threshold, repeat, jpeg_quality):
+    from app.processing import infer_batch
+
+    frames = 0
+    for _ in range(repeat):
+        for path in paths:
+            with METRICS.timer('decode'):
+                image = cv2.imread(path)
+            if image is None:
+                continue
+            results = infer_batch(model, [image], confidence_threshold, iou_threshold)
+            _record_model_speed(results)
+            _annotate_and_render(image, results[0], jpeg_quality)
+            frames += 1
+    return frames
+
+def benchmark_video(model, path, confidence_threshold, iou_threshold, skip_frames, batch_size, jpeg_quality):
+    # Chạy đúng đường xử lý video thật (processing.iter_video_results: FrameReader chỉ giải mã/thu nhỏ
+    # frame được phân tích, gom batch); các bước được đo bởi bộ đếm METRICS dùng chung
+    from app.processing import iter_video_results
+
+    cap = open_video(path)
+    frames = analysed = 0
+    try:
+        for frame_count, resized_frame, results, _ in iter_video_results(
+                cap, model, confidence_threshold, iou_threshold, skip_frames, batch_size):
+            frames = frame_count
+            if results is None:
+                continue
+            analysed += 1
+            _record_model_speed([results])
+            _annotate_and_render(resized_frame, results, jpeg_quality)
+    finally:
+        cap.release()
+    return frames, analysed
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux trả về KB, macOS trả về byte
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(model, image_paths=(), video_paths=(), confidence_threshold=0.5, iou_threshold=0.4,
+                  skip_frames=3, batch_size=1, repeat=1, jpeg_quality=80):
+    # Số đo lấy từ METRICS (xoá trước khi chạy, bật kể cả khi HELMET_METRICS=0)
+    enabled, METRICS.enabled = METRICS.enabled, True
+    METRICS.reset()
+    start = time.perf_counter()
+    try:
+        image_frames = benchmark_images(model, image_paths, confidence_threshold, iou_threshold,
+                                        repeat, jpeg_quality)
+        image_time = time.perf_counter() - start
+
+        video_frames = video_analysed = 0
+        for path in video_paths:
+            frames, analysed = benchmark_video(model, path, confidence_threshold, iou_threshold,
+                                               skip_frames, batch_size, jpeg_quality)
+            video_frames += frames
+            video_analysed += analysed
+        video_time = time.perf_counter() - start - image_time
+        snapshot = METRICS.snapshot()
+    finally:
+        METRICS.enabled = enabled
+
+    return {
+        'stages': {name: {key: value for key, value in stage.items() if key != 'buckets'}
+                   for name, stage in snapshot['stages'].items()},
+        'throughput': {
+            'images': image_frames,
+            'images_per_sec': round(image_frames / image_time, 2) if image_time > 0 else 0,
+            'video_frames': video_frames,
+            'video_frames_analysed': video_analysed,
+            'video_fps': round(video_frames / video_time, 2) if video_time > 0 else 0,
+            'video_analysed_fps': round(video_analysed / video_time, 2) if video_time > 0 else 0,
+        },
+        'wall_time_s': round(time.perf_counter() - start, 3),
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+def compare_reports(baseline, current):
+    # So sánh trung bình/p95 từng bước với một lần chạy trước (giá trị dương = chậm hơn).
+    # p95 là cận trên của bucket histogram nên chỉ đổi khi vượt sang bucket khác.
+    lines = []
+    for name, stage in current['stages'].items():
+        base = baseline.get('stages', {}).get(name)
+        if not base:
+            continue
+        for key in ('mean_ms', 'p95_ms'):
+            if base.get(key, 0) > 0:
+                change = (stage[key] - base[key]) / base[key] * 100
+                lines.append(f"{name:<12} {key:<7} {base[key]:>9.3f} -> {stage[key]:>9.3f} ms ({change:+.1f}%)")
+    return lines
+
+def _collect_images(directory):
+    if not directory or not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if os.path.splitext(name)[1].lower() in ('.jpg', '.jpeg', '.png')]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark pipeline nhận diện mũ bảo hiểm")
+    parser.add_argument("--model", default="stub", help="stub, ultralytics hoặc onnxruntime")
+    parser.add_argument("--weights", default="weights/bestyolo.onnx", help="Đường dẫn model (khi không dùng stub)")
+    parser.add_argument("--stub-latency", type=float, default=0.0, help="Độ trễ giả lập của stub (giây/frame)")
+    parser.add_argument("--images", default="test_images", help="Thư mục ảnh test")
+    parser.add_argument("--videos", nargs="*", default=[], help="Video có sẵn để benchmark")
+    parser.add_argument("--synthetic-videos", type=int, default=1, help="Số video tổng hợp cần tạo")
+    parser.add_argument("--synthetic-frames", type=int, default=150, help="Số frame mỗi video tổng hợp")
+    parser.add_argument("--synthetic-size", default="1280x720", help="Kích thước video tổng hợp, ví dụ 1920x1080")
+    parser.add_argument("--skip-frames", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3, help="Số lần lặp lại bộ ảnh")
+    parser.add_argument("--conf", type=float, default=0.5)
+    parser.add_argument("--iou", type=float, default=0.4)
+    parser.add_argument("--output", default=None, help="File JSON kết quả (mặc định: reports/benchmark_<commit>.json)")
+    parser.add_argument("--compare", default=None, help="File JSON của lần chạy trước để so sánh")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.model == "stub":
+        model = StubModel(latency=args.stub_latency)
+    else:
+        from app.load_model import build_model
+        model = build_model(args.weights, args.model)
+
+    width, height = (int(v) for v in args.synthetic_size.lower().split('x'))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        videos = list(args.videos) + [
+            make_synthetic_video(os.path.join(tmp_dir, f"synthetic_{i}.avi"), args.synthetic_frames,
+                                 (width, height), seed=i)
+            for i in range(args.synthetic_videos)
+        ]
+        report = run_benchmark(model, _collect_images(args.images), videos, args.conf, args.iou,
+                               args.skip_frames, args.batch_size, args.repeat)
+
+    commit = _git_commit()
+    report.update({
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'platform': {'python': platform.python_version(), 'machine': platform.machine(),
+                     'cpu_count': os.cpu_count(), 'opencv': cv2.__version__},
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+    })
+
+    output = args.output or os.path.join("reports", f"benchmark_{commit or 'local'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for name, stage in report['stages'].items():
+        print(f"{name:<12} TB {stage['mean_ms']:>9.3f} ms  p50 ≤{stage['p50_ms']:>9.3f} ms  "
+              f"p95 ≤{stage['p95_ms']:>9.3f} ms  max {stage['max_ms']:>9.3f} ms  (n={stage['count']})")
+    print(f"throughput   {report['throughput']}")
+    print(f"peak RSS     {report['peak_rss_mb']} MB")
+    print(f"📄 Đã lưu kết quả: {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            for line in compare_reports(json.load(f), report):
+                print(line)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import cv2
+import pandas as pd
+
+from app.decode import open_video
+from app.draw_box import draw_boxes
+from app.frame_scheduler import AdaptiveFrameScheduler
+from app.tracker import IouTracker
+from app.backends import BACKENDS
+from app import metrics
+from app.load_model import LATENCY_BUDGET_MS, MODEL_BACKEND, MODEL_VARIANT, build_default_model, build_model
+from app.clips import ClipRecorder
+from app.processing import analyze_video, summarize_video_stats
+from app.report import build_report_entry
+from app.tiling import RegionDetector
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+VIDEO_EXTENSIONS = {'.mp4', '.mov', '.avi'}
+
+# Mỗi tiến trình con giữ một model riêng, được tạo một lần trong initializer
+_worker_model = None
+
+def _init_worker(model_path, backend, roi=None, tile_size=None, profile=None, variant=MODEL_VARIANT):
+    global _worker_model
+    cv2.setNumThreads(1)  # tránh tranh chấp CPU giữa các tiến trình
+    if profile:
+        # Mỗi video trong tiến trình con ghi một file profiling vào reports/profiles
+        metrics.PROFILE_MODE = profile
+    # Không chỉ định --weights: model theo cấu hình (HELMET_MODEL_VARIANT), như giao diện và API
+    _worker_model = build_model(model_path, backend) if model_path else build_default_model(backend, variant)
+    if roi or tile_size:
+        # Cắt theo vùng quan tâm / chia tile ở độ phân giải gốc
+        _worker_model = RegionDetector(_worker_model, roi, tile_size)
+
+def collect_inputs(paths):
+    # Mở rộng thư mục thành danh sách ảnh/video, giữ nguyên thứ tự đầu vào
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                full_path = os.path.join(path, name)
+                if os.path.isfile(full_path) and _media_type(full_path):
+                    files.append(full_path)
+        elif os.path.isfile(path) and _media_type(path):
+            files.append(path)
+        else:
+            print(f"Bỏ qua {path}: không phải ảnh/video hợp lệ", file=sys.stderr)
+    return files
+
+def _media_type(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in IMAGE_EXTENSIONS:
+        return 'Ảnh'
+    if ext in VIDEO_EXTENSIONS:
+        return 'Video'
+    return None
+
+def output_names(files):
+    # Tên kết quả duy nhất cho mỗi đầu vào: a.mp4 và a.avi, hay cùng tên ở hai thư mục,
+    # không ghi đè lên nhau (file sau được thêm số thứ tự: a, a_2, a_3...)
+    names, taken = [], set()
+    for path in files:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        name, counter = stem, 1
+        while name in taken:
+            counter += 1
+            name = f"{stem}_{counter}"
+        taken.add(name)
+        names.append(name)
+    return names
+
+def _output_path(name, output_dir, ext):
+    return os.path.join(output_dir, f"{name}_detected{ext}")
+
+def process_image_file(path, output_dir, confidence_threshold, iou_threshold, output_name=None):
+    image = cv2.imread(path)
+    if image is None:
+        raise ValueError(f"Không đọc được ảnh {path}")
+
+    results = _worker_model(image, conf=confidence_threshold, iou=iou_threshold, verbose=False)[0]
+    annotated_image, stats = draw_boxes(image, results)
+    cv2.imwrite(_output_path(output_name or output_names([path])[0], output_dir, '.jpg'), annotated_image)
+
+    stats['safety_rate'] = (stats['helmet'] / stats['total']) * 100 if stats['total'] > 0 else 0
+    return stats
+
+def process_video_file(path, output_dir, confidence_threshold, iou_threshold, skip_frames, batch_size,
+                       target_rtf=None, track=False, clips=False, output_name=None):
+    output_name = output_name or output_names([path])[0]
+    cap = open_video(path)
+    if not cap.isOpened():
+        cap.release()
+        raise ValueError(f"Không mở được video {path}")
+
+    scheduler = None
+    if target_rtf:
+        scheduler = AdaptiveFrameScheduler(cap.get(cv2.CAP_PROP_FPS), target_rtf, max_interval=skip_frames * 5)
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+    writer = None
+
+    def write_frame(frame_count, annotated_frame):
+        nonlocal writer
+        if writer is None:
+            height, width = annotated_frame.shape[:2]
+            writer = cv2.VideoWriter(_output_path(output_name, output_dir, '.mp4'),
+                                     cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+        writer.write(annotated_frame)
+
+    # clips=True: chỉ lưu clip ngắn quanh mỗi vi phạm vào <output_dir>/clips, không ghi cả video đã vẽ
+    recorder = (ClipRecorder(os.path.join(output_dir, "clips"), fps, source_name=path, file_prefix=output_name)
+                if clips else None)
+    try:
+        stats = analyze_video(cap, _worker_model, confidence_threshold, iou_threshold, skip_frames,
+                              batch_size, on_frame=None if clips else write_frame, scheduler=scheduler,
+                              tracker=IouTracker() if track else None, source_name=path,
+                              annotate=not clips, recorder=recorder)
+    finally:
+        if writer is not None:
+            writer.release()
+    summary = summarize_video_stats(stats)
+    if recorder is not None:
+        summary['clips'] = stats['clips']['clips']
+    return summary
+
+def process_file(path, output_dir, confidence_threshold, iou_threshold, skip_frames, batch_size,
+                 target_rtf=None, track=False, clips=False, output_name=None):
+    source_type = _media_type(path)
+    if source_type == 'Ảnh':
+        stats = process_image_file(path, output_dir, confidence_threshold, iou_threshold, output_name)
+    else:
+        stats = process_video_file(path, output_dir, confidence_threshold, iou_threshold,
+                                   skip_frames, batch_size, target_rtf, track, clips, output_name)
+
+    entry = build_report_entry(stats, source_type)
+    entry['Tệp'] = path
+    if 'clips' in stats:
+        entry['Clip vi phạm'] = stats['clips']
+    return entry
+
+def _process_file_with_metrics(*args):
+    # Trả kèm số đo của tiến trình con rồi xoá, để tiến trình chính cộng dồn đúng một lần
+    entry = process_file(*args)
+    snapshot = metrics.METRICS.snapshot()
+    metrics.METRICS.reset()
+    return entry, snapshot
+
+def run_batch(files, output_dir, model_path=None, confidence_threshold=0.5, iou_threshold=0.4,
+              skip_frames=3, batch_size=1, workers=None, backend=MODEL_BACKEND, target_rtf=None,
+              track=False, roi=None, tile_size=None, profile=None, clips=False):
+    os.makedirs(output_dir, exist_ok=True)
+    entries = [None] * len(files)
+    names = output_names(files)
+    variant = MODEL_VARIANT
+    if not model_path and variant == "auto":
+        # Chọn biến thể một lần ở tiến trình chính (đo độ trễ nếu chưa có), mọi worker tải cùng biến thể
+        from app.model_variants import choose_variant
+        variant = choose_variant(backend, LATENCY_BUDGET_MS)[0].name
+        print(f"🧠 Biến thể model: {variant}")
+
+    # Dùng "spawn" để mỗi tiến trình tự khởi tạo runtime suy luận của mình
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker,
+                             initargs=(model_path, backend, roi, tile_size, profile, variant)) as executor:
+        futures = {
+            executor.submit(_process_file_with_metrics, path, output_dir, confidence_threshold, iou_threshold,
+                            skip_frames, batch_size, target_rtf, track, clips, names[index]): index
+            for index, path in enumerate(files)
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            index = futures[future]
+            try:
+                entries[index], snapshot = future.result()
+                metrics.METRICS.merge(snapshot)
+                print(f"[{done}/{len(files)}] ✅ {files[index]}")
+            except Exception as e:
+                print(f"[{done}/{len(files)}] ❌ {files[index]}: {e}", file=sys.stderr)
+
+    return [entry for entry in entries if entry is not None]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Nhận diện mũ bảo hiểm hàng loạt cho thư mục ảnh/video (không cần giao diện)")
+    parser.add_argument("inputs", nargs="+", help="Thư mục hoặc danh sách file ảnh/video")
+    parser.add_argument("--output-dir", default="reports", help="Thư mục lưu kết quả (mặc định: reports)")
+    parser.add_argument("--report", default=None, help="Đường dẫn file CSV tổng hợp")
+    parser.add_argument("--weights", default=None,
+                        help="Đường dẫn model (mặc định: theo HELMET_MODEL_VARIANT, không có thì weights/bestyolo.onnx)")
+    parser.add_argument("--backend", default=MODEL_BACKEND, choices=sorted(BACKENDS),
+                        help="Backend suy luận")
+    parser.add_argument("--conf", type=float, default=0.5, help="Ngưỡng tin cậy")
+    parser.add_argument("--iou", type=float, default=0.4, help="Ngưỡng IoU")
+    parser.add_argument("--skip-frames", type=int, default=3, help="Số frame bỏ qua giữa hai lần suy luận")
+    parser.add_argument("--adaptive", type=float, default=None, metavar="TARGET_RTF",
+                        help="Bỏ qua frame thích ứng với hệ số thời gian thực mục tiêu (vd: 1.0)")
+    parser.add_argument("--track", action="store_true",
+                        help="Đếm mỗi người một lần theo track thay vì cộng dồn theo frame")
+    parser.add_argument("--batch-size", type=int, default=1, help="Số frame gửi vào model mỗi lần")
+    parser.add_argument("--roi", default=None,
+                        help="Vùng quan tâm: các đa giác 'x,y;x,y;x,y|...' (tỉ lệ 0-1 hoặc pixel)")
+    parser.add_argument("--tile-size", type=int, default=None,
+                        help="Chia vùng quan tâm ở độ phân giải gốc thành tile (px), vd. 640")
+    parser.add_argument("--workers", type=int, default=None, help="Số tiến trình (mặc định: số CPU)")
+    parser.add_argument("--metrics-out", default=None,
+                        help="Ghi thời gian từng bước và bộ đếm frame: .prom (Prometheus) hoặc .json")
+    parser.add_argument("--profile", default=None, metavar="MODE",
+                        help="Profiling từng video: cprofile, cprofile:N (lấy mẫu mỗi N frame) hoặc tracemalloc")
+    parser.add_argument("--clips", action="store_true",
+                        help="Chỉ lưu clip ngắn và ảnh vùng đầu của mỗi vi phạm (OUTPUT_DIR/clips) "
+                             "thay vì cả video đã vẽ")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    files = collect_inputs(args.inputs)
+    if not files:
+        print("Không tìm thấy ảnh/video nào để xử lý", file=sys.stderr)
+        return 1
+
+    entries = run_batch(files, args.output_dir, args.weights, args.conf, args.iou,
+                        args.skip_frames, args.batch_size, args.workers, args.backend, args.adaptive,
+                        args.track, args.roi, args.tile_size, args.profile, args.clips)
+
+    report_path = args.report or os.path.join(
+        args.output_dir, f"helmet_detection_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+    pd.DataFrame(entries).to_csv(report_path, index=False, encoding='utf-8-sig')
+    print(f"📄 Đã lưu báo cáo: {report_path}")
+
+    if args.metrics_out:
+        with open(args.metrics_out, "w", encoding="utf-8") as f:
+            if args.metrics_out.endswith(".prom"):
+                f.write(metrics.METRICS.prometheus())
+            else:
+                json.dump(metrics.METRICS.snapshot(), f, ensure_ascii=False, indent=2)
+        print(f"⏱️ Đã lưu số đo: {args.metrics_out}")
+
+    return 0 if len(entries) == len(files) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from app.detections import to_numpy
+from app.draw_box import class_ids_named, draw_boxes
+from app.metrics import METRICS
+
+CLIP_DIR = "reports/clips"
+
+class ClipRecorder:
+    # Lưu bằng chứng vi phạm thay cho cả video đã vẽ: giữ vòng đệm các frame gần nhất, khi một vi phạm
+    # được xác nhận thì lấy pre_seconds trước đó + post_seconds sau đó thành một clip ngắn, kèm ảnh cắt
+    # vùng đầu của từng người không đội mũ.
+    # add() chỉ xác nhận vi phạm (và cắt ảnh vùng đầu khi có) rồi chuyển bản sao frame vào hàng đợi
+    # giới hạn (max_pending frame); nén JPEG vào vòng đệm, ghép clip và ghi file chạy trên hai luồng
+    # riêng. Hàng đợi đầy thì frame/clip bị bỏ (đếm vào `frames_dropped`/`dropped`) chứ vòng lặp suy
+    # luận không phải chờ. Frame trong vòng đệm và clip chờ ghi được giữ dưới dạng JPEG (quality) nên
+    # một clip max_seconds ở 640x360 chiếm vài chục MB thay vì vài trăm MB.
+    # Chống trùng: có tracker thì mỗi track chỉ tạo một clip; không có thì vi phạm liên tiếp (cách nhau
+    # không quá cooldown_seconds) là một sự kiện. Vi phạm mới khi clip còn đang ghi phần sau được gộp
+    # vào clip đó (kéo dài tới tối đa max_seconds).
+    def __init__(self, output_dir=CLIP_DIR, fps=25.0, pre_seconds=2.0, post_seconds=3.0, min_hits=2,
+                 cooldown_seconds=5.0, max_seconds=20.0, max_queue=4, thumbnail_size=160, source_name="video",
+                 file_prefix=None, quality=85, max_pending=None):
+        self.output_dir = output_dir
+        self.fps = fps or 25.0
+        self.pre_frames = max(1, int(pre_seconds * self.fps))
+        self.post_frames = max(1, int(post_seconds * self.fps))
+        self.max_frames = max(self.pre_frames + self.post_frames, int(max_seconds * self.fps))
+        self.min_hits = min_hits  # số frame phân tích thấy vi phạm trước khi xác nhận
+        self.cooldown_frames = int(cooldown_seconds * self.fps)
+        self.thumbnail_size = thumbnail_size
+        self.source_name = source_name
+        self.file_prefix = file_prefix or _safe_name(source_name)  # tiền tố tên file clip/ảnh
+        self.quality = quality
+
+        self.buffer = deque(maxlen=self.pre_frames)  # (frame_index, jpeg, results | None)
+        self.events = []  # thông tin các clip đã gửi đi ghi
+        self.dropped = 0
+        self.frames_dropped = 0
+        self._clip = None  # clip đang ghi phần sau vi phạm
+        # track id -> [số lần thấy không đội mũ, frame thấy gần nhất, đã có clip]; track không còn
+        # xuất hiện quá cooldown_frames (tracker đã kết thúc nó) bị xoá để bộ nhớ không tăng theo thời gian
+        self._tracks = {}
+        self._last_prune = 0
+        self._pending_violations = None  # vi phạm của frame bị bỏ, gắn vào frame kế tiếp
+        self._streak = 0
+        self._last_violation = None
+        self._event_open = False
+        self._closed = False
+
+        # Frame thô chờ nén: mặc định tối đa khoảng một giây video
+        self._frames = queue.Queue(max_pending or max(1, int(self.fps)))
+        self._queue = queue.Queue(max_queue)
+        self._encoder = threading.Thread(target=self._encode_loop, name="clip-encoder", daemon=True)
+        self._thread = threading.Thread(target=self._write_loop, name="clip-writer", daemon=True)
+        self._encoder.start()
+        self._thread.start()
+
+    def add(self, frame_index, frame, results=None):
+        # Gọi với mọi frame theo thứ tự (frame đã thu nhỏ); results chỉ có ở frame được phân tích.
+        # Luồng trực tiếp chỉ truyền frame đã phân tích, frame_index = seq của grabber (có khoảng trống)
+        if frame is None or self._closed:
+            return
+        violations = None
+        if results is not None:
+            confirmed = self._confirm(frame_index, results)
+            if confirmed:
+                stem = os.path.join(self.output_dir, f"{self.file_prefix}_{frame_index:07d}")
+                thumbnails = [(f"{stem}_{'id' + str(track_id) if track_id is not None else index}.jpg",
+                               self._crop(frame, box))
+                              for index, (track_id, box) in enumerate(confirmed)]
+                violations = (stem, thumbnails, [track_id for track_id, _ in confirmed if track_id is not None])
+        if self._pending_violations is not None:
+            violations = self._merge_violations(self._pending_violations, violations)
+        # Bản sao: bên gọi có thể vẽ lên frame hoặc dùng lại bộ đệm ngay sau khi add() trả về
+        try:
+            self._frames.put_nowait((frame_index, frame.copy(), results, violations))
+        except queue.Full:
+            self.frames_dropped += 1
+            METRICS.inc('clip_frames_dropped')
+            self._pending_violations = violations
+            return
+        self._pending_violations = None
+
+    @staticmethod
+    def _merge_violations(earlier, later):
+        if later is None:
+            return earlier
+        return earlier[0], earlier[1] + later[1], earlier[2] + later[2]
+
+    def _no_helmet_boxes(self, results):
+        boxes = getattr(results, 'boxes', None)
+        # (box, id track) của người không đội mũ; id = None khi không có tracker
+        ids = getattr(boxes, 'id', None) if boxes is not None else None
+        if boxes is None or len(boxes) == 0:
+            empty_ids = None if ids is None else np.empty(0, int)
+            return np.empty((0, 4)), empty_ids, empty_ids
+        cls_ids = to_numpy(boxes.cls).astype(int).reshape(-1)
+        no_helmet = ~np.isin(cls_ids, class_ids_named(results.names, 'helmet'))
+        xyxy = to_numpy(boxes.xyxy).reshape(-1, 4)[no_helmet]
+        if ids is None:
+            return xyxy, None, None
+        ids = to_numpy(ids).astype(int).reshape(-1)
+        return xyxy, ids[no_helmet], ids
+
+    def _confirm(self, frame_index, results):
+        # Trả về [(track id | None, box)] của các vi phạm vừa được xác nhận ở frame này
+        xyxy, ids, all_ids = self._no_helmet_boxes(results)
+        if ids is not None:
+            for track_id in all_ids.tolist():
+                self._tracks.setdefault(track_id, [0, frame_index, False])[1] = frame_index
+            confirmed = []
+            for box, track_id in zip(xyxy, ids.tolist()):
+                track = self._tracks[track_id]
+                if track[2]:
+                    continue
+                track[0] += 1
+                if track[0] >= self.min_hits:
+                    track[2] = True
+                    confirmed.append((track_id, box))
+            self._prune(frame_index)
+            return confirmed
+
+        if not len(xyxy):
+            self._streak = 0
+            if self._event_open and frame_index - self._last_violation > self.cooldown_frames:
+                self._event_open = False
+            return []
+        self._streak += 1
+        self._last_violation = frame_index
+        if self._event_open or self._streak < self.min_hits:
+            return []
+        self._event_open = True
+        return [(None, box) for box in xyxy]
+
+    def _prune(self, frame_index):
+        # Tracker kết thúc track sau max_age frame không thấy (mặc định ngắn hơn nhiều so với cooldown)
+        if frame_index - self._last_prune < self.cooldown_frames:
+            return
+        self._tracks = {track_id: track for track_id, track in self._tracks.items()
+                        if frame_index - track[1] <= self.cooldown_frames}
+        self._last_prune = frame_index
+
+    def _crop(self, frame, box):
+        # Vùng đầu (box của detector) nới rộng 25% mỗi phía, thu về thumbnail_size
+        height, width = frame.shape[:2]
+        x0, y0, x1, y1 = box
+        pad_x, pad_y = (x1 - x0) * 0.25, (y1 - y0) * 0.25
+        x0, y0 = int(max(0, x0 - pad_x)), int(max(0, y0 - pad_y))
+        x1, y1 = int(min(width, x1 + pad_x)), int(min(height, y1 + pad_y))
+        crop = frame[y0:y1, x0:x1]
+        if crop.size == 0:
+            return None
+        scale = self.thumbnail_size / max(crop.shape[:2])
+        return cv2.resize(crop, (max(1, round(crop.shape[1] * scale)), max(1, round(crop.shape[0] * scale))))
+
+    def _encode_loop(self):
+        # Luồng nén: giữ vòng đệm JPEG và ghép clip, clip xong được chuyển cho luồng ghi
+        while True:
+            item = self._frames.get()
+            if item is None:
+                break
+            frame_index, frame, results, violations = item
+            with METRICS.timer('clip_encode'):
+                jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])[1]
+            entry = (frame_index, jpeg, results)
+            if self._clip is not None:
+                self._clip['frames'].append(entry)
+                self._clip['remaining'] -= 1
+                if self._clip['remaining'] <= 0 or len(self._clip['frames']) >= self.max_frames:
+                    self._submit()
+            if violations is not None:
+                self._trigger(frame_index, entry, *violations)
+            self.buffer.append(entry)
+        if self._clip is not None:
+            self._submit()
+        self._queue.put(None)
+
+    def _trigger(self, frame_index, entry, stem, thumbnails, track_ids):
+        if self._clip is not None:
+            # Gộp vào clip đang ghi: một đoạn video cho các vi phạm chồng thời gian
+            self._clip['thumbnails'] += thumbnails
+            self._clip['event']['track_ids'] += track_ids
+            self._clip['remaining'] = self.post_frames
+            return
+        self._clip = {
+            'frames': list(self.buffer) + [entry],
+            'remaining': self.post_frames,
+            'thumbnails': thumbnails,
+            'event': {'source': self.source_name, 'frame': frame_index,
+                      'time_s': round(frame_index / self.fps, 2), 'track_ids': track_ids,
+                      'clip': stem + ".mp4"},
+        }
+
+    def _submit(self):
+        clip, self._clip = self._clip, None
+        clip['event']['thumbnails'] = [path for path, image in clip['thumbnails'] if image is not None]
+        try:
+            self._queue.put_nowait(clip)
+        except queue.Full:
+            self.dropped += 1
+            METRICS.inc('clips_dropped')
+            return
+        self.events.append(clip['event'])
+
+    def _write_loop(self):
+        while True:
+            clip = self._queue.get()
+            if clip is None:
+                break
+            try:
+                with METRICS.timer('clip'):
+                    self._write(clip)
+                METRICS.inc('clips_written')
+            except Exception as e:
+                clip['event']['error'] = str(e)
+
+    def _write(self, clip):
+        os.makedirs(self.output_dir, exist_ok=True)
+        for path, image in clip['thumbnails']:
+            if image is not None:
+                cv2.imwrite(path, image)
+
+        frames = clip['frames']
+        height, width = cv2.imdecode(frames[0][1], cv2.IMREAD_COLOR).shape[:2]
+        # Frame_index có khoảng trống (luồng trực tiếp bỏ frame): FPS ghi theo khoảng frame_index
+        # để clip giữ đúng thời lượng thật
+        fps = self.fps * len(frames) / max(len(frames), frames[-1][0] - frames[0][0] + 1)
+        writer = cv2.VideoWriter(clip['event']['clip'], cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+        try:
+            last_results = None
+            for _, jpeg, results in frames:
+                frame = cv2.imdecode(jpeg, cv2.IMREAD_COLOR)
+                # Frame không phân tích dùng lại box của lần phân tích gần nhất
+                last_results = results if results is not None else last_results
+                writer.write(frame if last_results is None else draw_boxes(frame, last_results)[0])
+        finally:
+            writer.release()
+        with open(os.path.splitext(clip['event']['clip'])[0] + ".json", "w", encoding="utf-8") as f:
+            json.dump(clip['event'], f, ensure_ascii=False, indent=2)
+
+    def close(self, timeout=None):
+        # Nén và ghi nốt các frame/clip còn dở rồi chờ hai luồng xong; frame đến sau khi đóng bị bỏ qua
+        if self._closed:
+            return
+        self._closed = True
+        self._frames.put(None)
+        self._encoder.join(timeout)
+        self._thread.join(timeout)
+
+    def summary(self):
+        return {'clips': len(self.events), 'dropped': self.dropped, 'frames_dropped': self.frames_dropped,
+                'events': list(self.events)}
+
+def stream_clip_prefix(name):
+    # Luồng trực tiếp: seq đếm lại từ đầu mỗi lần mở nên thêm thời điểm bắt đầu để không ghi đè clip cũ
+    safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in str(name)).strip("_") or "stream"
+    return f"{safe[-40:]}_{time.strftime('%Y%m%d_%H%M%S')}"
+
+def _safe_name(name):
+    stem = os.path.splitext(os.path.basename(str(name)))[0]
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in stem) or "video"
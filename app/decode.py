@@ -0,0 +1,209 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+
+from app.metrics import METRICS
+
+# Bộ giải mã video: "opencv" (mặc định) hoặc "pyav" (giải mã đa luồng, cần `pip install av`)
+VIDEO_DECODER = os.environ.get("HELMET_VIDEO_DECODER", "opencv")
+# Khoảng cách (số frame) tới frame cần phân tích tiếp theo từ đó trở lên thì seek thay vì grab từng frame
+SEEK_THRESHOLD = 50
+# Số bộ đệm ảnh thu nhỏ tối đa FrameReader giữ để dùng lại (đủ cho batch và hàng đợi của pipeline)
+RESIZE_POOL_SIZE = 64
+
+class PyAVCapture:
+    # Giao diện giống cv2.VideoCapture (grab/retrieve/read/get/set) trên PyAV/FFmpeg với giải mã đa luồng.
+    # grab() chỉ giải mã; chuyển sang BGR (tốn kém) chỉ xảy ra khi retrieve().
+    def __init__(self, path, threads=0):
+        import av
+
+        self._av = av
+        self.container = av.open(path)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = "AUTO"
+        self.stream.thread_count = threads  # 0: FFmpeg tự chọn theo số CPU
+        self._frames = self.container.decode(self.stream)
+        self._frame = None
+        self._position = 0
+
+    def isOpened(self):
+        return self.container is not None
+
+    def grab(self):
+        try:
+            self._frame = next(self._frames)
+        except (StopIteration, self._av.error.FFmpegError):
+            self._frame = None
+            return False
+        self._position += 1
+        return True
+
+    def retrieve(self, image=None):
+        if self._frame is None:
+            return False, None
+        return True, self._frame.to_ndarray(format="bgr24")
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return float(self.stream.average_rate or 0)
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(self.stream.frames or 0)
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self._position)
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.stream.codec_context.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.stream.codec_context.height)
+        return 0.0
+
+    def set(self, prop, value):
+        # Chỉ hỗ trợ seek theo số frame (đếm từ 0): nhảy tới keyframe gần nhất phía trước rồi giải mã
+        # (không chuyển màu) tới đúng frame
+        if prop != cv2.CAP_PROP_POS_FRAMES or not self.stream.average_rate or self.stream.time_base is None:
+            return False
+        target = int(value)
+        timestamp = int(target / self.stream.average_rate / self.stream.time_base) + (self.stream.start_time or 0)
+        self.container.seek(timestamp, stream=self.stream, backward=True, any_frame=False)
+        self._frames = self.container.decode(self.stream)
+        self._position = target
+        for frame in self._frames:
+            index = round(float((frame.pts - (self.stream.start_time or 0)) * self.stream.time_base)
+                          * float(self.stream.average_rate))
+            if index >= target:
+                # Trả frame này lại cho lần grab() tiếp theo
+                self._frames = _prepend(frame, self._frames)
+                break
+        return True
+
+    def release(self):
+        if self.container is not None:
+            self.container.close()
+            self.container = None
+
+def _prepend(item, iterator):
+    yield item
+    yield from iterator
+
+def open_video(path, decoder=None):
+    decoder = decoder or VIDEO_DECODER
+    if decoder == "pyav":
+        return PyAVCapture(path)
+    if decoder != "opencv":
+        raise ValueError(f"Bộ giải mã không hỗ trợ: {decoder}")
+    return cv2.VideoCapture(path)
+
+class FrameReader:
+    # Lớp đọc frame cho vòng lặp video: frame không phân tích chỉ được grab() (bỏ bước chuyển màu và
+    # sao chép), khoảng bỏ qua dài thì seek, và chỉ frame cần dùng mới bị thu nhỏ. Frame giải mã
+    # (độ phân giải gốc) được ghi vào cùng một bộ đệm cho mọi lần đọc; ảnh thu nhỏ được ghi vào bộ
+    # đệm lấy từ một pool, chỉ dùng lại bộ đệm không còn ai giữ (frame đang nằm trong batch/hàng đợi
+    # không bao giờ bị ghi đè).
+    def __init__(self, cap, frame_size=(640, 360), seek_threshold=SEEK_THRESHOLD, pool_size=RESIZE_POOL_SIZE):
+        self.cap = cap
+        self.frame_size = frame_size
+        self.seek_threshold = seek_threshold  # 0/None: không seek
+        self.position = 0  # số frame đã đi qua
+        self.decoded = 0
+        self.grabbed = 0
+        self.seeks = 0
+        self.pool_size = pool_size
+        self._buffer = None
+        self._resize_pool = []
+
+    def grab(self):
+        with METRICS.timer('decode'):
+            if not self.cap.grab():
+                return False
+        self.position += 1
+        self.grabbed += 1
+        return True
+
+    def retrieve(self):
+        # Frame hiện tại ở độ phân giải gốc; bộ đệm bị ghi đè ở lần đọc sau nên cần copy nếu giữ lại
+        with METRICS.timer('decode'):
+            ok, frame = self.cap.retrieve(self._buffer)
+        if not ok:
+            return None
+        self._buffer = frame
+        self.decoded += 1
+        return frame
+
+    def resize(self, frame):
+        with METRICS.timer('resize'):
+            return cv2.resize(frame, self.frame_size, dst=self._free_buffer(frame))
+
+    def _free_buffer(self, frame):
+        # Bộ đệm chỉ còn pool tham chiếu tới (tham chiếu của danh sách, biến lặp và đối số getrefcount)
+        # là rảnh; pool đầy mà không có bộ đệm rảnh thì để cv2.resize cấp phát mảng mới
+        shape = (self.frame_size[1], self.frame_size[0]) + frame.shape[2:]
+        for buffer in self._resize_pool:
+            if sys.getrefcount(buffer) <= 3 and buffer.shape == shape and buffer.dtype == frame.dtype:
+                return buffer
+        if len(self._resize_pool) >= self.pool_size:
+            return None
+        buffer = np.empty(shape, frame.dtype)
+        self._resize_pool.append(buffer)
+        return buffer
+
+    def skip_to(self, frame_number):
+        # Nhảy tới ngay trước frame_number (đếm từ 1) nếu khoảng cách đủ lớn và nguồn seek được
+        gap = frame_number - 1 - self.position
+        if not self.seek_threshold or gap < self.seek_threshold:
+            return False
+        total_frames = self.cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        if total_frames <= 0 or frame_number > total_frames:
+            return False  # không biết độ dài (vd. đọc qua FIFO) hoặc đích nằm sau cuối video
+        with METRICS.timer('decode'):
+            if not self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number - 1):
+                return False
+        self.position = frame_number - 1
+        self.seeks += 1
+        return True
+
+    def summary(self):
+        return {'frames': self.position, 'decoded': self.decoded, 'grabbed': self.grabbed, 'seeks': self.seeks}
+
+def iter_frames(reader, scheduler, keep_skipped=False, full_resolution=False):
+    # Trả về (frame_count, resized_frame, sampled, source) cho mọi frame theo thứ tự.
+    # resized_frame = None với frame bị bỏ qua không cần hiển thị (keep_skipped=False), trừ frame đầu
+    # tiên (dùng làm ảnh hiển thị tạm). source = bản sao frame gốc cho model full_resolution.
+    needs_pixels = getattr(scheduler, 'needs_pixels', True)
+    next_analysis = getattr(scheduler, 'next_analysis', None)
+    frame_count = 0
+
+    while True:
+        if not needs_pixels and not keep_skipped and next_analysis is not None and frame_count > 0:
+            target = next_analysis(frame_count)
+            if reader.skip_to(target):
+                for skipped in range(frame_count + 1, target):
+                    scheduler.should_analyze(skipped, None)
+                    yield skipped, None, False, None
+                frame_count = target - 1
+
+        if not reader.grab():
+            break
+        frame_count += 1
+
+        frame = None
+        if needs_pixels:
+            frame = reader.retrieve()
+            if frame is None:
+                break
+        sampled = scheduler.should_analyze(frame_count, frame)
+
+        resized_frame = None
+        if sampled or keep_skipped or frame_count == 1:
+            if frame is None:
+                frame = reader.retrieve()
+                if frame is None:
+                    break
+            resized_frame = reader.resize(frame)
+        source = frame.copy() if sampled and full_resolution else None
+        yield frame_count, resized_frame, sampled, source
@@ -0,0 +1,113 @@
+import numpy as np
+
+def to_numpy(values):
+    # Tensor (torch) hoặc mảng bất kỳ -> np.ndarray
+    if hasattr(values, 'cpu'):
+        values = values.cpu().numpy()
+    return np.asarray(values)
+
+class DetectionBoxes:
+    # Tương thích với các thuộc tính xyxy/conf/cls mà draw_boxes sử dụng
+    def __init__(self, xyxy, conf, cls, ids=None):
+        self.xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+        self.conf = np.asarray(conf, dtype=np.float32).reshape(-1)
+        self.cls = np.asarray(cls, dtype=np.float32).reshape(-1)
+        self.id = None if ids is None else np.asarray(ids, dtype=int).reshape(-1)  # id track (nếu có)
+
+    def __len__(self):
+        return len(self.conf)
+
+    @property
+    def nbytes(self):
+        return self.xyxy.nbytes + self.conf.nbytes + self.cls.nbytes
+
+class Detections:
+    # Kết quả nhận diện tối giản (thay cho ultralytics Results) chỉ gồm mảng NumPy
+    def __init__(self, xyxy, conf, cls, names, orig_shape=None, speed=None, ids=None):
+        self.boxes = DetectionBoxes(xyxy, conf, cls, ids)
+        self.names = names
+        self.orig_shape = orig_shape
+        self.speed = speed or {}
+
+    @classmethod
+    def from_results(cls, results):
+        boxes = results.boxes
+        if boxes is None or len(boxes) == 0:
+            return cls(np.empty((0, 4)), np.empty(0), np.empty(0), results.names,
+                       getattr(results, 'orig_shape', None), getattr(results, 'speed', None))
+        return cls(to_numpy(boxes.xyxy), to_numpy(boxes.conf), to_numpy(boxes.cls), results.names,
+                   getattr(results, 'orig_shape', None), getattr(results, 'speed', None))
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def scaled(self, scale_x, scale_y, offset_x=0, offset_y=0, orig_shape=None):
+        # Đổi toạ độ box: (x * scale + offset), vd. từ tile/ảnh gốc sang frame hiển thị
+        xyxy = self.boxes.xyxy * np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32)
+        xyxy += np.array([offset_x, offset_y, offset_x, offset_y], dtype=np.float32)
+        return Detections(xyxy, self.boxes.conf, self.boxes.cls, self.names,
+                          orig_shape or self.orig_shape, self.speed, self.boxes.id)
+
+    @classmethod
+    def concatenate(cls, detections, names, orig_shape=None):
+        if not detections:
+            return cls(np.empty((0, 4)), np.empty(0), np.empty(0), names, orig_shape)
+        return cls(np.concatenate([d.boxes.xyxy for d in detections]),
+                   np.concatenate([d.boxes.conf for d in detections]),
+                   np.concatenate([d.boxes.cls for d in detections]), names, orig_shape)
+
+    def select(self, indices):
+        ids = None if self.boxes.id is None else self.boxes.id[indices]
+        return Detections(self.boxes.xyxy[indices], self.boxes.conf[indices], self.boxes.cls[indices],
+                          self.names, self.orig_shape, self.speed, ids)
+
+def box_area(xyxy):
+    return np.clip(xyxy[:, 2] - xyxy[:, 0], 0, None) * np.clip(xyxy[:, 3] - xyxy[:, 1], 0, None)
+
+def box_iou(boxes_a, boxes_b):
+    # Ma trận IoU (len(a) x len(b)) tính bằng broadcasting
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    inter = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    union = box_area(boxes_a)[:, None] + box_area(boxes_b)[None, :] - inter
+    return inter / np.maximum(union, 1e-9)
+
+def box_ios(boxes_a, boxes_b):
+    # Ma trận giao / diện tích box nhỏ hơn: box bị cắt ở mép tile nằm gọn trong box đầy đủ
+    # nên có IoS cao dù IoU thấp
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    inter = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    smaller = np.minimum(box_area(boxes_a)[:, None], box_area(boxes_b)[None, :])
+    return inter / np.maximum(smaller, 1e-9)
+
+def nms(xyxy, scores, iou_threshold, metric=box_iou):
+    # Non-maximum suppression: mỗi vòng so box tốt nhất với toàn bộ box còn lại cùng lúc
+    order = np.argsort(-scores, kind='stable')
+    keep = []
+    while order.size > 0:
+        best = order[0]
+        keep.append(best)
+        if order.size == 1:
+            break
+        ious = metric(xyxy[best:best + 1], xyxy[order[1:]])[0]
+        order = order[1:][ious <= iou_threshold]
+    return np.asarray(keep, dtype=int)
+
+def batched_nms(xyxy, scores, classes, iou_threshold, metric=box_iou):
+    # NMS theo từng lớp: dịch box của mỗi lớp ra vùng riêng để các lớp không đè nhau
+    if len(scores) == 0:
+        return np.empty(0, dtype=int)
+    offsets = classes.reshape(-1, 1).astype(np.float32) * (float(xyxy.max()) + 1)
+    return nms(xyxy + offsets, scores, iou_threshold, metric)
+
+def filter_detections(detections, confidence_threshold, iou_threshold, max_det=300):
+    # Lọc theo ngưỡng tin cậy rồi chạy lại NMS, giống hậu xử lý của ultralytics
+    boxes = detections.boxes
+    candidates = np.flatnonzero(boxes.conf > confidence_threshold)
+    keep = batched_nms(boxes.xyxy[candidates], boxes.conf[candidates], boxes.cls[candidates], iou_threshold)
+    return detections.select(candidates[keep[:max_det]])
@@ -1,7 +1,12 @@
+import functools
+
 import cv2
 import streamlit as st
 import numpy as np
 
+from app.detections import to_numpy
+from app.metrics import METRICS
+
 def load_css(file_path="style.css"):
     try:
         with open(file_path) as f:
@@ -9,66 +14,101 @@ def load_css(file_path="style.css"):
     except FileNotFoundError:
         pass
 
-def draw_boxes(image, results, actual_fps=None, font_scale_base=0.5):
-    class_names = results.names
+def boxes_to_arrays(results):
+    # Lấy toàn bộ toạ độ, độ tin cậy và lớp trong một lần chuyển đổi thay vì từng box
     boxes = results.boxes
-    stats = {'total': 0, 'helmet': 0, 'no_helmet': 0, 'confidences': []}
+    if boxes is None or len(boxes) == 0:
+        return np.empty((0, 4), dtype=int), np.empty(0, dtype=float), np.empty(0, dtype=int)
+    xyxy = to_numpy(boxes.xyxy).reshape(-1, 4).astype(int)
+    conf = to_numpy(boxes.conf).reshape(-1).astype(float)
+    cls = to_numpy(boxes.cls).reshape(-1).astype(int)
+    return xyxy, conf, cls
+
+def class_ids_named(class_names, name):
+    return [cls_id for cls_id, label in class_names.items() if label == name]
+
+def detection_stats(results):
+    # Thống kê giống draw_boxes nhưng không vẽ (dùng khi không cần hiển thị frame)
+    _, confs, cls_ids = boxes_to_arrays(results)
+    helmet = int(np.isin(cls_ids, class_ids_named(results.names, 'helmet')).sum())
+    return {
+        'total': int(len(cls_ids)),
+        'helmet': helmet,
+        'no_helmet': int(len(cls_ids) - helmet),
+        'confidences': confs.tolist()
+    }
+
+# Chữ số trong font Hershey rộng bằng nhau: nhãn "#12 helmet 0.87" có cùng kích thước với
+# "#00 helmet 0.00", nên cache theo nhãn đã thay chữ số bằng 0 (chỉ vài khoá cho mỗi lớp)
+_DIGITS_TO_ZERO = str.maketrans("123456789", "000000000")
+
+def _text_size(text, font_face, font_scale, thickness):
+    return _text_shape_size(text.translate(_DIGITS_TO_ZERO), font_face, font_scale, thickness)
+
+@functools.lru_cache(maxsize=256)
+def _text_shape_size(text, font_face, font_scale, thickness):
+    return cv2.getTextSize(text, font_face, font_scale, thickness)[0]
+
+@METRICS.timed('annotate')
+def draw_boxes(image, results, actual_fps=None, font_scale_base=0.5, thickness_base=2):
+    class_names = results.names
+    xyxy, confs, cls_ids = boxes_to_arrays(results)
+
+    # Thống kê tính bằng phép toán trên mảng
+    helmet_mask = np.isin(cls_ids, class_ids_named(class_names, 'helmet'))
+    stats = {
+        'total': int(len(cls_ids)),
+        'helmet': int(helmet_mask.sum()),
+        'no_helmet': int(len(cls_ids) - helmet_mask.sum()),
+        'confidences': confs.tolist()
+    }
 
     frame_height, frame_width, _ = image.shape
     font_scale = font_scale_base * (frame_width / 640)
-    thickness = max(1, int(frame_width / 640 * 2)) 
+    thickness = max(1, int(frame_width / 640 * thickness_base))
 
-    for box in boxes:
-        x1, y1, x2, y2 = map(int, box.xyxy[0])
-        conf = float(box.conf[0])
-        cls_id = int(box.cls[0])
-        label = class_names[cls_id]
+    # Kết quả đã qua tracker có thêm id track để hiển thị
+    track_ids = getattr(results.boxes, 'id', None) if results.boxes is not None else None
+    prefixes = [''] * len(cls_ids) if track_ids is None else [f"#{i} " for i in to_numpy(track_ids).astype(int).tolist()]
 
-        color = (0, 255, 0) if label == 'helmet' else (0, 0, 255)
+    for (x1, y1, x2, y2), conf, cls_id, is_helmet, prefix in zip(xyxy.tolist(), stats['confidences'],
+                                                                cls_ids.tolist(), helmet_mask.tolist(), prefixes):
+        text = f"{prefix}{class_names[cls_id]} {conf:.2f}"
+        color = (0, 255, 0) if is_helmet else (0, 0, 255)
         cv2.rectangle(image, (x1, y1), (x2, y2), color, thickness)
-        
+
         # Cải thiện nền chữ để dễ đọc hơn
-        (text_width, text_height), _ = cv2.getTextSize(f"{label} {conf:.2f}", 
-                                                      cv2.FONT_HERSHEY_SIMPLEX, 
-                                                      font_scale, thickness)
-        cv2.rectangle(image, (x1, y1 - text_height - 10), 
+        text_width, text_height = _text_size(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)
+        cv2.rectangle(image, (x1, y1 - text_height - 10),
                       (x1 + text_width, y1), color, -1)
-        cv2.putText(image, f"{label} {conf:.2f}", (x1, y1 - 5), 
+        cv2.putText(image, text, (x1, y1 - 5),
                     cv2.FONT_HERSHEY_SIMPLEX, font_scale, (255, 255, 255), thickness)
-        
-        # Hiển thị thông tin thống kê lên ảnh
-        stats['total'] += 1
-        stats['helmet'] += int(label == 'helmet')
-        stats['no_helmet'] += int(label != 'helmet')
-        stats['confidences'].append(conf)
-    
+
     # Tạo lớp phủ thống kê
     if actual_fps is not None:
         # Định nghĩa kích thước và vị trí nhỏ hơn cho hộp thống kê
-        overlay_x_end = 180 
-        overlay_y_end = 90  
-        
-        overlay = image.copy()
-        cv2.rectangle(overlay, (0, 0), (overlay_x_end, overlay_y_end), (0, 0, 0), -1)
-        image = cv2.addWeighted(overlay, 0.7, image, 0.3, 0)
-        
+        overlay_x_end = 180
+        overlay_y_end = 90
+
+        # Chỉ làm tối vùng góc trái (tương đương addWeighted với nền đen 70%)
+        roi = image[:overlay_y_end + 1, :overlay_x_end + 1]
+        cv2.convertScaleAbs(roi, dst=roi, alpha=0.3)
+
         # Điều chỉnh kích thước font và độ dày chữ
-        overlay_font_scale = font_scale * 1 
-        overlay_thickness = max(2, int(thickness * 0.8)) 
+        overlay_font_scale = font_scale * 1
+        overlay_thickness = max(2, int(thickness * 0.8))
 
-        cv2.putText(image, f"Helmet: {stats['helmet']}", 
-                    (10, 25), cv2.FONT_HERSHEY_DUPLEX, overlay_font_scale, 
+        cv2.putText(image, f"Helmet: {stats['helmet']}",
+                    (10, 25), cv2.FONT_HERSHEY_DUPLEX, overlay_font_scale,
                     (0, 255, 0), overlay_thickness)
-        
-        cv2.putText(image, f"No Helmet: {stats['no_helmet']}", 
-                    (10, 55), cv2.FONT_HERSHEY_DUPLEX, overlay_font_scale, 
+
+        cv2.putText(image, f"No Helmet: {stats['no_helmet']}",
+                    (10, 55), cv2.FONT_HERSHEY_DUPLEX, overlay_font_scale,
                     (0, 0, 255), overlay_thickness)
-        
-        fps_multiplier = 3
-        displayed_fps = actual_fps * fps_multiplier
 
-        cv2.putText(image, f"FPS: {displayed_fps:.1f}", 
-                    (10, 85), cv2.FONT_HERSHEY_DUPLEX, overlay_font_scale, 
-                    (0, 255, 255), overlay_thickness) 
+        # actual_fps: số frame đã phân tích / thời gian chạy, cùng số liệu với thống kê cuối
+        cv2.putText(image, f"FPS: {actual_fps:.1f}",
+                    (10, 85), cv2.FONT_HERSHEY_DUPLEX, overlay_font_scale,
+                    (0, 255, 255), overlay_thickness)
 
-    return image, stats
\ No newline at end of file
+    return image, stats
@@ -0,0 +1,129 @@
+import math
+from collections import Counter
+
+import cv2
+import numpy as np
+
+from app.detections import to_numpy
+
+def count_class(results, name):
+    # Số box thuộc lớp `name` trong một kết quả nhận diện
+    if results.boxes is None or len(results.boxes) == 0:
+        return 0
+    ids = [cls_id for cls_id, label in results.names.items() if label == name]
+    return int(np.isin(to_numpy(results.boxes.cls).astype(int), ids).sum())
+
+class FixedFrameScheduler:
+    # Hành vi cũ: phân tích mỗi `skip_frames` frame một lần
+    needs_pixels = False  # quyết định chỉ dựa vào số thứ tự frame: frame bỏ qua không cần giải mã
+
+    def __init__(self, skip_frames=3):
+        self.skip_frames = max(1, int(skip_frames))
+        self.analysed = Counter()
+        self.skipped = Counter()
+
+    def should_analyze(self, frame_count, frame):
+        if frame_count % self.skip_frames == 0:
+            self.analysed['interval'] += 1
+            return True
+        self.skipped['interval'] += 1
+        return False
+
+    def next_analysis(self, frame_count):
+        # Số thứ tự frame tiếp theo sẽ được phân tích (cho phép seek qua các frame bỏ qua)
+        return (frame_count // self.skip_frames + 1) * self.skip_frames
+
+    def record_result(self, frame_count, latency, results):
+        pass
+
+    def summary(self):
+        return {
+            'analysed': sum(self.analysed.values()),
+            'skipped': sum(self.skipped.values()),
+            'analysed_reasons': dict(self.analysed),
+            'skipped_reasons': dict(self.skipped),
+        }
+
+class AdaptiveFrameScheduler(FixedFrameScheduler):
+    # Chọn frame cần phân tích dựa trên:
+    # - ngân sách thời gian: target_rtf = thời gian xử lý / thời lượng video (1.0 = thời gian thực),
+    #   kết hợp độ trễ suy luận đo được để suy ra khoảng cách tối thiểu giữa hai frame phân tích
+    # - mức chuyển động so với frame phân tích gần nhất (tính trên ảnh xám thu nhỏ)
+    # - vi phạm no_helmet gần đây: phân tích dày hơn trong `violation_hold` giây
+    needs_pixels = True  # đo chuyển động trên mọi frame
+
+    def __init__(self, video_fps=25, target_rtf=1.0, min_interval=1, max_interval=15,
+                 motion_threshold=4.0, violation_hold=2.0, probe_size=(64, 36), latency_smoothing=0.2):
+        super().__init__()
+        self.video_fps = video_fps if video_fps and video_fps > 0 else 25
+        self.target_rtf = target_rtf
+        self.min_interval = max(1, int(min_interval))
+        self.max_interval = max(self.min_interval, int(max_interval))
+        self.motion_threshold = motion_threshold
+        self.violation_frames = int(violation_hold * self.video_fps)
+        self.probe_size = probe_size
+        self.latency_smoothing = latency_smoothing
+
+        self.latency = None  # trung bình trượt (EMA) độ trễ suy luận, giây
+        self.last_analysed = None
+        self.last_violation = None
+        self.reference = None  # ảnh thu nhỏ của frame phân tích gần nhất
+        self.last_motion = 0.0
+
+    def budget_interval(self):
+        if not self.latency or not self.target_rtf:
+            return self.min_interval
+        interval = math.ceil(self.latency * self.video_fps / self.target_rtf)
+        return min(max(self.min_interval, interval), self.max_interval)
+
+    def _probe(self, frame):
+        # Thu nhỏ trước rồi mới chuyển xám: frame có thể ở độ phân giải gốc
+        small = cv2.resize(frame, self.probe_size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+    def _decide(self, frame_count, frame):
+        # Trả về (có phân tích không, lý do, ảnh thu nhỏ nếu đã tính)
+        if self.last_analysed is None:
+            return True, 'first', None
+
+        gap = frame_count - self.last_analysed
+        if gap >= self.max_interval:
+            return True, 'max_interval', None
+        if gap < self.budget_interval():
+            return False, 'budget', None
+        if self.last_violation is not None and frame_count - self.last_violation <= self.violation_frames:
+            return True, 'violation', None
+
+        probe = self._probe(frame)
+        self.last_motion = float(cv2.absdiff(probe, self.reference).mean())
+        if self.last_motion >= self.motion_threshold:
+            return True, 'motion', probe
+        return False, 'static', probe
+
+    def should_analyze(self, frame_count, frame):
+        analyse, reason, probe = self._decide(frame_count, frame)
+        if analyse:
+            self.analysed[reason] += 1
+            self.last_analysed = frame_count
+            self.reference = probe if probe is not None else self._probe(frame)
+        else:
+            self.skipped[reason] += 1
+        return analyse
+
+    def record_result(self, frame_count, latency, results):
+        if latency is not None:
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self.latency_smoothing * (latency - self.latency)
+        if count_class(results, 'no_helmet') > 0:
+            self.last_violation = max(frame_count, self.last_violation or 0)
+
+    def summary(self):
+        summary = super().summary()
+        summary.update({
+            'target_rtf': self.target_rtf,
+            'avg_latency_ms': round(self.latency * 1000, 2) if self.latency else None,
+            'budget_interval': self.budget_interval(),
+        })
+        return summary
@@ -0,0 +1,90 @@
+import errno
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+CHUNK_SIZE = 1024 * 1024  # 1 MB mỗi lần ghi
+
+# Định dạng giải mã được khi đọc tuần tự (không cần seek tới cuối file như mp4/mov thông thường)
+STREAMABLE_SUFFIXES = {'.avi', '.mkv', '.ts'}
+
+def iter_chunks(source, chunk_size=CHUNK_SIZE):
+    # Đọc nguồn theo từng khối cố định. UploadedFile/BytesIO dùng memoryview để không tạo bản sao.
+    if hasattr(source, 'getbuffer'):
+        with source.getbuffer() as view:
+            for start in range(0, len(view), chunk_size):
+                yield view[start:start + chunk_size]
+        return
+
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+@contextmanager
+def spooled_video(source, suffix=".mp4", chunk_size=CHUNK_SIZE):
+    # Ghi nguồn ra file tạm theo từng khối; file luôn bị xoá khi thoát, kể cả khi xử lý lỗi
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter_chunks(source, chunk_size):
+                f.write(chunk)
+        yield path
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def _pipe_writer(source, path, chunk_size, stop_event):
+    # Chờ bên đọc (cv2.VideoCapture) mở FIFO rồi đẩy dữ liệu vào theo từng khối
+    fd = None
+    while fd is None and not stop_event.is_set():
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as e:
+            if e.errno != errno.ENXIO:  # ENXIO: chưa có bên đọc
+                raise
+            time.sleep(0.01)
+    if fd is None:
+        return
+
+    os.set_blocking(fd, True)
+    try:
+        with os.fdopen(fd, "wb", buffering=0) as pipe:
+            for chunk in iter_chunks(source, chunk_size):
+                if stop_event.is_set():
+                    break
+                pipe.write(chunk)
+    except BrokenPipeError:
+        pass  # bên đọc đã đóng (dừng giữa chừng hoặc video lỗi)
+
+@contextmanager
+def piped_video(source, suffix=".avi", chunk_size=CHUNK_SIZE):
+    # Đẩy dữ liệu qua FIFO: giải mã bắt đầu ngay khi khối đầu tiên được ghi, không cần ghi cả file
+    # ra đĩa. Chỉ dùng cho định dạng đọc tuần tự được và hệ điều hành có os.mkfifo.
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, "upload" + suffix)
+    os.mkfifo(path)
+
+    stop_event = threading.Event()
+    writer = threading.Thread(target=_pipe_writer, name="upload-pipe", daemon=True,
+                              args=(source, path, chunk_size, stop_event))
+    writer.start()
+    try:
+        yield path
+    finally:
+        stop_event.set()
+        writer.join(timeout=5)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def open_upload(source, filename, chunk_size=CHUNK_SIZE):
+    # Chọn cách đưa file tải lên cho bộ giải mã: FIFO nếu được, ngược lại ghi file tạm theo khối
+    suffix = os.path.splitext(filename)[1].lower() or ".mp4"
+    if suffix in STREAMABLE_SUFFIXES and hasattr(os, "mkfifo"):
+        return piped_video(source, suffix, chunk_size)
+    return spooled_video(source, suffix, chunk_size)
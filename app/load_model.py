@@ -1,8 +1,32 @@
+import os
+
 import streamlit as st
-from ultralytics import YOLO
+
+from app.backends import create_backend
+
+MODEL_PATH = "weights/bestyolo.onnx"
+# "ultralytics" (mặc định) hoặc "onnxruntime" (gọi thẳng onnxruntime, ít overhead hơn trên CPU)
+MODEL_BACKEND = os.environ.get("HELMET_MODEL_BACKEND", "ultralytics")
+# Biến thể model (app/model_variants.py): trống = MODEL_PATH, "auto" = biến thể chính xác nhất
+# đạt ngân sách độ trễ trên máy hiện tại, hoặc tên biến thể (vd. "yolo11n-480-int8")
+MODEL_VARIANT = os.environ.get("HELMET_MODEL_VARIANT", "")
+# Ngân sách độ trễ p95 mỗi frame (ms) khi chọn biến thể tự động
+LATENCY_BUDGET_MS = float(os.environ.get("HELMET_LATENCY_BUDGET_MS", "50"))
+
+def build_model(model_path=MODEL_PATH, backend=MODEL_BACKEND, **backend_options):
+    # Tạo model không qua cache của Streamlit (dùng cho CLI, tiến trình con...)
+    return create_backend(backend, model_path, **backend_options)
+
+def build_default_model(backend=MODEL_BACKEND, variant=MODEL_VARIANT, budget_ms=LATENCY_BUDGET_MS):
+    # Model theo cấu hình; biến thể được chọn (kèm độ trễ đo được) nằm ở model.variant
+    if not variant:
+        return build_model(MODEL_PATH, backend)
+    from app.model_variants import build_best_model, build_named_variant
+    if variant == "auto":
+        return build_best_model(backend, budget_ms)
+    return build_named_variant(variant, backend)
 
 @st.cache_resource
-def load_model():
+def load_model(backend=MODEL_BACKEND):
     with st.spinner("🚀 Đang tải mô hình YOLO..."):
-        # Thay đường dẫn model
-        return YOLO("weights/bestyolo.onnx")
+        return build_default_model(backend)
@@ -1,7 +1,6 @@
 import streamlit as st
-import tempfile
 import os
-from ultralytics import YOLO
+import sys
 import cv2
 import numpy as np
 from PIL import Image
@@ -9,6 +8,19 @@ import pandas as pd
 from datetime import datetime
 import time
 
+# Cho phép import package app khi chạy bằng `streamlit run app/main.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import draw_box
+from app.ingest import open_upload
+from app.load_model import MODEL_BACKEND, build_default_model
+from app import processing
+from app.metrics import Profiler
+from app.preview import PREVIEW_FPS, PREVIEW_QUALITY
+from app.processing import process_stream, process_streams
+from app.report import add_report_entry, export_report_csv, generate_report, get_store
+from app.result_cache import DetectionCache, image_key
+from app.tiling import RegionDetector
+
 # CSS
 def load_css():
     st.markdown("""
@@ -26,203 +38,55 @@ st.set_page_config(
 load_css()
 
 # ======================== TRẠNG THÁI BAN ĐẦU ========================
-if 'report_data' not in st.session_state:
-    st.session_state.report_data = []
+if 'reported_images' not in st.session_state:
+    st.session_state.reported_images = set()  # (khoá ảnh, ngưỡng) đã ghi vào lịch sử
 
 # Tải model
 @st.cache_resource
 def load_model():
     with st.spinner("🚀 Đang tải mô hình YOLO..."):
-        return YOLO("weights/bestyolo.onnx")
+        # HELMET_MODEL_VARIANT=auto: đo các biến thể (lần đầu trên máy này) rồi chọn theo ngân sách độ trễ
+        return build_default_model(MODEL_BACKEND)
 
 model = load_model()
 
-# Vẽ bounding box 
-def draw_boxes(image, results, actual_fps=None, font_scale_base=0.5):
-    class_names = results.names
-    boxes = results.boxes
-    stats = {'total': 0, 'helmet': 0, 'no_helmet': 0, 'confidences': []}
-
-    frame_height, frame_width, _ = image.shape
-    font_scale = font_scale_base * (frame_width / 640)*1.2
-    thickness = max(1, int(frame_width / 640 * 2.5)) 
+# Cache kết quả nhận diện ảnh: đổi ngưỡng trên cùng một ảnh không phải chạy lại model
+CACHE_MAX_IMAGES = 64
+CACHE_MAX_BYTES = 32 * 1024 * 1024
 
-    for box in boxes:
-        x1, y1, x2, y2 = map(int, box.xyxy[0])
-        conf = float(box.conf[0])
-        cls_id = int(box.cls[0])
-        label = class_names[cls_id]
-
-        color = (0, 255, 0) if label == 'helmet' else (0, 0, 255)
-        cv2.rectangle(image, (x1, y1), (x2, y2), color, thickness)
-        
-        # Cải thiện nền chữ để dễ đọc hơn
-        (text_width, text_height), _ = cv2.getTextSize(f"{label} {conf:.2f}", 
-                                                      cv2.FONT_HERSHEY_SIMPLEX, 
-                                                      font_scale, thickness)
-        cv2.rectangle(image, (x1, y1 - text_height - 10), 
-                      (x1 + text_width, y1), color, -1)
-        cv2.putText(image, f"{label} {conf:.2f}", (x1, y1 - 5), 
-                    cv2.FONT_HERSHEY_SIMPLEX, font_scale, (255, 255, 255), thickness)
-        
-        # Hiển thị thông tin thống kê lên ảnh
-        stats['total'] += 1
-        stats['helmet'] += int(label == 'helmet')
-        stats['no_helmet'] += int(label != 'helmet')
-        stats['confidences'].append(conf)
-    
-    # Tạo lớp phủ thống kê ở góc trên bên trái
-    if actual_fps is not None:
-        # Kích thước và vị trí hộp thống kê
-        overlay_x_end = 180 # Chiều rộng hộp thống kê
-        overlay_y_end = 90  # Chiều cao hộp thống kê
-        
-        overlay = image.copy()
-        cv2.rectangle(overlay, (0, 0), (overlay_x_end, overlay_y_end), (0, 0, 0), -1)
-        image = cv2.addWeighted(overlay, 0.7, image, 0.3, 0)
-        
-        # Điều chỉnh kích thước font và độ dày cho chữ thống kê
-        overlay_font_scale = font_scale * 1 
-        overlay_thickness = max(2, int(thickness * 0.8)) 
-
-        cv2.putText(image, f"Helmet: {stats['helmet']}", 
-                    (10, 25), cv2.FONT_HERSHEY_DUPLEX, overlay_font_scale, 
-                    (0, 255, 0), overlay_thickness)
-        
-        cv2.putText(image, f"No Helmet: {stats['no_helmet']}", 
-                    (10, 55), cv2.FONT_HERSHEY_DUPLEX, overlay_font_scale, 
-                    (0, 0, 255), overlay_thickness)
-        
-        fps_multiplier = 3
-        displayed_fps = actual_fps * fps_multiplier
+@st.cache_resource
+def get_detection_cache():
+    return DetectionCache(max_entries=CACHE_MAX_IMAGES, max_bytes=CACHE_MAX_BYTES)
 
-        cv2.putText(image, f"FPS: {displayed_fps:.1f}", 
-                    (10, 85), cv2.FONT_HERSHEY_DUPLEX, overlay_font_scale, 
-                    (0, 255, 255), overlay_thickness) 
+detection_cache = get_detection_cache()
 
-    return image, stats
+# Vẽ bounding box 
+def draw_boxes(image, results, actual_fps=None, font_scale_base=0.5):
+    # Dùng chung bản vẽ vector hoá trong app/draw_box.py, chữ và viền to hơn bản mặc định
+    return draw_box.draw_boxes(image, results, actual_fps, font_scale_base * 1.2, thickness_base=2.5)
 
 # Xử lý hình ảnh
-def process_image(image, confidence_threshold, iou_threshold):
+def process_image(image, confidence_threshold, iou_threshold, detector=None):
     with st.spinner("🔍 Đang tiến hành nhận diện..."):
-        # Truyền ngưỡng tin cậy và IoU cho mô hình
-        results = model(image, conf=confidence_threshold, iou=iou_threshold, verbose=False)[0]
+        if detector is not None:
+            # Vùng quan tâm / chia tile: chạy trên ảnh gốc, không qua cache
+            results, key = detector(image, conf=confidence_threshold, iou=iou_threshold)[0], image_key(image)
+        else:
+            # Lấy kết quả thô từ cache (hoặc chạy model nếu ảnh mới) rồi lọc theo ngưỡng tin cậy và IoU
+            results, key = detection_cache.detect(model, image, confidence_threshold, iou_threshold)
         image_bgr = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
         annotated_image, stats = draw_boxes(image_bgr, results)
-        return cv2.cvtColor(annotated_image, cv2.COLOR_BGR2RGB), stats
-
-# Xử lý Video
-def process_video(video_path, confidence_threshold, iou_threshold, skip_frames=5): 
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        st.error("Không mở được video. Vui lòng kiểm tra file.")
-        return None
-
-    stframe = st.empty()
-    progress_bar = st.progress(0)
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    frame_count = 0
-
-    status_text = st.empty()
-    status_text.info(f"Đang xử lý video ({total_frames} frames)...")
-
-    stats = {
-        'total_frames': total_frames,
-        'processed_frames': 0,
-        'helmet_counts': [],
-        'no_helmet_counts': [],
-        'fps_list': [], 
-        'start_time': datetime.now()
-    }
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        frame_count += 1
-        
-        # Bỏ qua các khung hình để tăng hiệu suất hiển thị
-        if frame_count % skip_frames != 0 and frame_count != total_frames:
-            progress_percent = min(frame_count / total_frames, 1.0)
-            progress_bar.progress(progress_percent)
-            status_text.info(f"Đang xử lý... {progress_percent*100:.1f}% hoàn thành")
-            continue
-
-        start = time.time()
-        # Thay đổi kích thước khung hình 
-        resized_frame = cv2.resize(frame, (640, 360)) 
-        
-        # Thực hiện suy luận (inference)
-        results = model(resized_frame, verbose=False, conf=confidence_threshold, iou=iou_threshold)[0]
-        actual_fps = 1.0 / (time.time() - start) # Tính FPS thực tế
-
-        # Vẽ các hộp và hiển thị FPS
-        annotated_frame, frame_stats = draw_boxes(resized_frame.copy(), results, actual_fps=actual_fps)
-
-        stats['helmet_counts'].append(frame_stats['helmet'])
-        stats['no_helmet_counts'].append(frame_stats['no_helmet'])
-        stats['fps_list'].append(actual_fps*3)  # Ghi lại FPS thực tế cho báo cáo
-        stats['processed_frames'] += 1
-
-        # Hiển thị khung hình đã được chú thích
-        stframe.image(annotated_frame, channels="BGR", use_container_width=True)
-        
-        # Cập nhật thanh tiến trình và trạng thái
-        progress_percent = min(frame_count / total_frames, 1.0)
-        progress_bar.progress(progress_percent)
-        status_text.info(f"Đang xử lý... {progress_percent*100:.1f}% hoàn thành")
-
-    cap.release()
-    stats['processing_time'] = datetime.now() - stats['start_time']
-    status_text.success(f"✅ Xử lý hoàn tất! Thời gian: {stats['processing_time'].seconds} giây")
-    
-    # Tính toán thống kê tổng thể
-    total_helmet = sum(stats['helmet_counts'])
-    total_no_helmet = sum(stats['no_helmet_counts'])
-    total_objects = total_helmet + total_no_helmet
-    avg_fps = np.mean(stats['fps_list']) if stats['fps_list'] else 0
-    safety_rate = (total_helmet / total_objects * 100) if total_objects > 0 else 0
-
-    # Hiển thị thống kê video
-    st.markdown("### 📊 Thống kê video")
-    col1, col2, col3, col4, col5, col6 = st.columns(6)
-    
-    with col1:
-        st.metric("🧍 Tổng đối tượng", f"{total_objects}")
-    with col2:
-        st.metric("🟢 Có mũ", f"{total_helmet}")
-    with col3:
-        st.metric("🔴 Không mũ", f"{total_no_helmet}")
-    with col4:
-        st.metric("🔒 Tỷ lệ an toàn", f"{safety_rate:.2f}%")
-    with col5:
-        st.metric("🎞️ Tổng frame", f"{stats['processed_frames']}")
-    with col6:
-        st.metric("⚡ FPS trung bình", f"{avg_fps:.2f}")
-
-    # Lưu lại dữ liệu báo cáo
-    st.session_state.report_data.append({
-        'Thời gian': stats['start_time'],
-        'Loại': 'Video',
-        'Tổng đối tượng': total_objects,
-        'Có mũ': total_helmet,
-        'Không mũ': total_no_helmet,
-        'Tỷ lệ an toàn': f"{safety_rate:.2f}%",
-        'Tổng frame': stats['processed_frames'],
-        'FPS trung bình': f"{avg_fps:.2f}"
-    })
-
-    return stats
-
-# ======================== XUẤT BÁO CÁO ========================
-def generate_report():
-    df = pd.DataFrame(st.session_state.report_data)
-
-    if 'Thời gian' in df.columns:
-        df['Thời gian'] = df['Thời gian'].dt.strftime('%Y-%m-%d %H:%M:%S')
-
-    return df
+        return cv2.cvtColor(annotated_image, cv2.COLOR_BGR2RGB), stats, key
+
+# Xử lý Video: dùng chung vòng lặp của app/processing.py (gom batch, pipeline đa luồng, đọc frame
+# trên luồng riêng, clip vi phạm), chỉ khác hàm vẽ box cỡ chữ lớn hơn
+def process_video(video_path, confidence_threshold, iou_threshold, skip_frames=5, adaptive=False, track=False,
+                  source_name="video", detector=None, preview_fps=PREVIEW_FPS, preview_quality=PREVIEW_QUALITY,
+                  profiler=None, clips=False, batch_size=1, pipelined=False):
+    return processing.process_video(video_path, detector or model, confidence_threshold, iou_threshold, skip_frames,
+                                    batch_size=batch_size, pipelined=pipelined, adaptive=adaptive, track=track,
+                                    source_name=source_name, preview_fps=preview_fps, preview_quality=preview_quality,
+                                    profiler=profiler, clips=clips, draw_fn=draw_boxes)
 
 # ======================== SIDEBAR ========================
 with st.sidebar:
@@ -232,6 +96,47 @@ with st.sidebar:
     st.markdown("### 🔧 Thông số mô hình")
     confidence_threshold = st.slider("Ngưỡng tin cậy", 0.1, 1.0, 0.5, 0.05)
     iou_threshold = st.slider("Ngưỡng IoU", 0.1, 1.0, 0.4, 0.05)
+    adaptive_skip = st.checkbox("⚡ Bỏ qua frame thích ứng", value=False,
+                                help="Phân tích thưa khi cảnh tĩnh, dày hơn khi có chuyển động hoặc vi phạm")
+    track_objects = st.checkbox("🎯 Đếm theo đối tượng (tracking)", value=True,
+                                help="Mỗi người chỉ được đếm một lần dù xuất hiện ở nhiều frame")
+
+    with st.expander("🗺️ Vùng quan tâm & chia tile"):
+        roi_text = st.text_input("Vùng quan tâm", value="",
+                                 help="Đa giác 'x,y;x,y;x,y', nhiều đa giác cách nhau bởi '|'. "
+                                      "Toạ độ 0-1 theo tỉ lệ frame hoặc pixel. Để trống: cả frame")
+        tiled = st.checkbox("Chia tile ở độ phân giải gốc", value=False,
+                            help="Tăng khả năng phát hiện người ở xa trên camera 2K/4K, chậm hơn")
+        tile_size = st.select_slider("Kích thước tile (px)", [320, 480, 640, 960, 1280], value=640,
+                                     disabled=not tiled)
+    with st.expander("⚙️ Xử lý video"):
+        pipelined = st.checkbox("Pipeline đa luồng", value=True,
+                                help="Giải mã, suy luận và vẽ chạy song song trên các luồng riêng")
+        batch_size = st.slider("Số frame mỗi lần suy luận", 1, 16, 4,
+                               help="Gom nhiều frame vào một lần gọi model, tăng thông lượng trên GPU")
+    with st.expander("🖼️ Hiển thị"):
+        no_preview = st.checkbox("Không xem trước (chỉ thống kê)", value=False,
+                                 help="Bỏ vẽ và gửi frame lên trình duyệt, xử lý video dài nhanh hơn")
+        preview_fps = st.slider("FPS xem trước", 1, 30, PREVIEW_FPS, disabled=no_preview,
+                                help="Giới hạn số frame gửi lên trình duyệt mỗi giây, độc lập với tốc độ phân tích")
+        preview_quality = st.slider("Chất lượng JPEG", 30, 95, PREVIEW_QUALITY, 5, disabled=no_preview)
+    if no_preview:
+        preview_fps = 0
+    save_clips = st.checkbox("🎬 Lưu clip vi phạm", value=False,
+                             help="Lưu clip ngắn (2 giây trước, 3 giây sau) và ảnh vùng đầu của mỗi vi phạm "
+                                  "vào reports/clips, mỗi người một clip")
+
+    with st.expander("🔬 Đo hiệu năng"):
+        profile_mode = st.selectbox("Profiling cho lần chạy video tiếp theo", ["Tắt", "cprofile", "tracemalloc"],
+                                    help="cprofile: lấy mẫu 1 frame mỗi N frame; tracemalloc: theo dõi cấp phát bộ nhớ")
+        profile_every = st.number_input("Lấy mẫu mỗi N frame", 1, 1000, 100, disabled=profile_mode != "cprofile")
+        st.caption("Thời gian từng bước luôn được đo (tắt bằng HELMET_METRICS=0)")
+    detector = None
+    if roi_text.strip() or tiled:
+        try:
+            detector = RegionDetector(model, roi_text.strip() or None, tile_size if tiled else None)
+        except ValueError as e:
+            st.error(f"Vùng quan tâm không hợp lệ: {e}")
     
     st.markdown("---")
     st.markdown("### ℹ️ Thông tin")
@@ -240,6 +145,12 @@ with st.sidebar:
     - 🟢: Có đội mũ bảo hiểm 
     - 🔴: Không đội mũ bảo hiểm
     """)
+    variant = getattr(model, 'variant', None)
+    if variant:
+        # Biến thể được chọn theo ngân sách độ trễ (HELMET_MODEL_VARIANT)
+        latency = f", p95 {variant['p95_ms']:.0f} ms" if 'p95_ms' in variant else ""
+        st.caption(f"🧠 Model: {variant['name']} (input {variant['input_size']}px"
+                   + (", INT8" if variant['quantized'] else "") + latency + ")")
 
 # ======================== GIAO DIỆN CHÍNH ========================
 st.markdown(
@@ -250,7 +161,7 @@ st.markdown(
     unsafe_allow_html=True
 )
 
-source = st.radio("Chọn nguồn dữ liệu:", ["📸 Hình ảnh", "🎥 Video"], horizontal=True, index =0)
+source = st.radio("Chọn nguồn dữ liệu:", ["📸 Hình ảnh", "🎥 Video", "📡 Camera trực tiếp"], horizontal=True, index =0)
 
 if source == "📸 Hình ảnh":
     file = st.file_uploader("Tải ảnh lên", type=["jpg", "jpeg", "png"], 
@@ -264,7 +175,7 @@ if source == "📸 Hình ảnh":
                 st.image(image, caption="Ảnh gốc", use_container_width=True)
             
             with col2:
-                result, stats = process_image(np.array(image), confidence_threshold, iou_threshold)
+                result, stats, image_key = process_image(np.array(image), confidence_threshold, iou_threshold, detector)
                 st.image(result, caption="Kết quả phát hiện", use_container_width=True)
         
         st.subheader("📊 Thống kê")
@@ -279,51 +190,90 @@ if source == "📸 Hình ảnh":
             safety_rate = (stats['helmet'] / stats['total']) * 100 if stats['total'] > 0 else 0
             st.metric("🔒 Tỷ lệ an toàn", f"{safety_rate:.1f}%")
 
-        st.session_state.report_data.append({
-            'Thời gian': datetime.now(),
-            'Loại': 'Ảnh',
-            'Tổng đối tượng': stats['total'], 
-            'Có mũ': stats['helmet'], 
-            'Không mũ': stats['no_helmet'], 
-            'Tỷ lệ an toàn': f"{safety_rate:.1f}%"
-        })
+        # Streamlit chạy lại script mỗi lần đổi widget: chỉ ghi lịch sử một lần cho mỗi ảnh + ngưỡng
+        report_key = (image_key, confidence_threshold, iou_threshold)
+        if report_key not in st.session_state.reported_images:
+            st.session_state.reported_images.add(report_key)
+            add_report_entry({
+                'total': stats['total'],
+                'helmet': stats['helmet'],
+                'no_helmet': stats['no_helmet'],
+                'safety_rate': safety_rate
+            }, 'Ảnh', file.name)
 
 elif source == "🎥 Video":
     file = st.file_uploader("Tải video lên", type=["mp4", "mov", "avi"], 
                              help="Chọn video để phân tích theo thời gian thực")
     if file:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as tfile:
-            tfile.write(file.read())
-            path = tfile.name
-
-        stats = process_video(path, confidence_threshold, iou_threshold)
-
-        try: 
-            os.remove(path)
-        except: 
-            pass
-
-# Thống kê tổng quan
-if st.session_state.report_data:
+        # Đưa file cho bộ giải mã theo từng khối (FIFO hoặc file tạm), không nạp toàn bộ vào bộ nhớ lần nữa;
+        # file tạm luôn được dọn kể cả khi xử lý lỗi
+        with open_upload(file, file.name) as path:
+            stats = process_video(path, confidence_threshold, iou_threshold, adaptive=adaptive_skip,
+                                  track=track_objects, source_name=file.name, detector=detector,
+                                  preview_fps=preview_fps, preview_quality=preview_quality,
+                                  profiler=None if profile_mode == "Tắt" else Profiler(profile_mode, profile_every),
+                                  clips=save_clips, batch_size=batch_size, pipelined=pipelined)
+
+elif source == "📡 Camera trực tiếp":
+    stream_input = st.text_area("Địa chỉ camera (mỗi dòng một camera)", value="0",
+                                help="URL RTSP/HTTP, chỉ số webcam (0, 1...) hoặc đường dẫn file video (phát lại đúng FPS)")
+    stream_sources = list(dict.fromkeys(line.strip() for line in stream_input.splitlines() if line.strip()))
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("▶️ Bắt đầu", use_container_width=True):
+            st.session_state.streaming = True
+    with col2:
+        # Bấm dừng làm script chạy lại, vòng lặp luồng đang chạy bị ngắt và grabber được đóng
+        if st.button("⏹️ Dừng", use_container_width=True):
+            st.session_state.streaming = False
+
+    if st.session_state.get('streaming') and len(stream_sources) == 1:
+        process_stream(stream_sources[0], model, confidence_threshold, iou_threshold, track=track_objects,
+                       preview_fps=preview_fps, preview_quality=preview_quality, clips=save_clips)
+        st.session_state.streaming = False
+    elif st.session_state.get('streaming') and stream_sources:
+        # Nhiều camera: gom batch chung một model với các phiên khác, ưu tiên camera có vi phạm
+        process_streams(stream_sources, model, confidence_threshold, iou_threshold, track=track_objects,
+                        preview_fps=preview_fps, preview_quality=preview_quality, clips=save_clips)
+        st.session_state.streaming = False
+
+# Thống kê tổng quan (lưu trong SQLite, còn nguyên sau khi tải lại trang)
+store = get_store()
+result_count = store.count_results()
+if result_count:
     st.markdown("---")
     st.subheader("📊 Lịch sử thống kê")
-    
-    df = generate_report()
+
+    # Chỉ đọc một trang mỗi lần chạy lại script
+    page_size = 25
+    page_count = (result_count + page_size - 1) // page_size
+    page = st.number_input(f"Trang (1-{page_count})", min_value=1, max_value=page_count, value=1, step=1)
+    df = generate_report(page - 1, page_size)
     st.dataframe(df, use_container_width=True)
-    
+
+    since = time.time() - 24 * 3600
+    unit = store.default_unit(since)
+    hourly = store.violations_per_hour(since=since, unit=unit)
+    if hourly:
+        st.markdown("#### 🔴 Vi phạm theo giờ (24 giờ gần nhất)")
+        st.caption({'tracks': "Mỗi người được đếm một lần (tracking)",
+                    'detections': "Số box không đội mũ trên các frame",
+                    'mixed': "Lần chạy có tracking: mỗi người một lần; không tracking: số box trên các frame"}[unit])
+        st.bar_chart(pd.DataFrame(hourly, columns=['Giờ', 'Vi phạm']).set_index('Giờ'))
+
     col1, col2 = st.columns([1, 3])
     with col1:
-        csv = df.to_csv(index=False, encoding='utf-8-sig')
         st.download_button(
             "💾 Tải thống kê",
-            data=csv,
+            data=export_report_csv(store.version()),
             file_name=f"helmet_detection_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
             mime='text/csv'
         )
     
     with col2:
         if st.button("🗑️ Xóa toàn bộ lịch sử", type="primary"):
-            st.session_state.report_data = []
+            store.clear()
+            st.session_state.reported_images = set()
             st.rerun()
 
 st.markdown("""
@@ -0,0 +1,244 @@
+import bisect
+import functools
+import os
+import threading
+import time
+
+# HELMET_METRICS=0 tắt đo (timer thành no-op); HELMET_PROFILE bật profiling cho một lần chạy,
+# vd. "cprofile" (mỗi 100 frame lấy mẫu 1 frame), "cprofile:20" hoặc "tracemalloc"
+METRICS_ENABLED = os.environ.get("HELMET_METRICS", "1") != "0"
+PROFILE_MODE = os.environ.get("HELMET_PROFILE", "")
+PROFILE_DIR = "reports/profiles"
+
+STAGES = ['decode', 'resize', 'inference', 'annotate', 'render', 'report']
+# Cận trên các bucket histogram (giây), dùng chung cho mọi bước
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class _Timer:
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+class Metrics:
+    # Thời gian từng bước (histogram cố định) và bộ đếm, dùng chung cho mọi vòng lặp trong tiến trình.
+    # Khi tắt, timer() trả về một context manager rỗng dùng chung nên gần như không tốn gì.
+    def __init__(self, enabled=METRICS_ENABLED, prefix="helmet"):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.started_at = time.time()
+        self._stages = {}  # tên bước -> [đếm theo bucket..., tổng giây, số lần, lớn nhất]
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def timer(self, stage):
+        return _Timer(self, stage) if self.enabled else _NULL_TIMER
+
+    def timed(self, stage):
+        # Decorator: đo thời gian mỗi lần gọi hàm
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(stage, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def observe(self, stage, seconds):
+        if not self.enabled:
+            return
+        index = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            values = self._stages.get(stage)
+            if values is None:
+                values = self._stages[stage] = [0] * (len(BUCKETS) + 1) + [0.0, 0, 0.0]
+            values[index] += 1
+            values[-3] += seconds
+            values[-2] += 1
+            if seconds > values[-1]:
+                values[-1] = seconds
+
+    def inc(self, name, value=1):
+        if not self.enabled or not value:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+        self.started_at = time.time()
+
+    def snapshot(self):
+        # Ảnh chụp dạng JSON; 'buckets' giữ số đếm thô để gộp giữa các tiến trình (merge)
+        with self._lock:
+            stages = {name: list(values) for name, values in self._stages.items()}
+            counters = dict(self._counters)
+        result = {'enabled': self.enabled, 'uptime_s': round(time.time() - self.started_at, 1),
+                  'counters': counters, 'stages': {}}
+        for name in STAGES + sorted(set(stages) - set(STAGES)):
+            if name not in stages:
+                continue
+            values = stages[name]
+            buckets, total, count, largest = values[:-3], values[-3], values[-2], values[-1]
+            result['stages'][name] = {
+                'count': count,
+                'total_ms': round(total * 1000, 3),
+                'mean_ms': round(total / count * 1000, 3) if count else 0.0,
+                'max_ms': round(largest * 1000, 3),
+                'p50_ms': _bucket_quantile(buckets, count, 0.5, largest),
+                'p95_ms': _bucket_quantile(buckets, count, 0.95, largest),
+                'buckets': buckets,
+            }
+        return result
+
+    def merge(self, snapshot):
+        # Cộng ảnh chụp của tiến trình khác (vd. worker của cli) vào bộ đếm hiện tại
+        with self._lock:
+            for name, value in snapshot.get('counters', {}).items():
+                self._counters[name] = self._counters.get(name, 0) + value
+            for name, stage in snapshot.get('stages', {}).items():
+                values = self._stages.get(name)
+                if values is None:
+                    values = self._stages[name] = [0] * (len(BUCKETS) + 1) + [0.0, 0, 0.0]
+                for index, count in enumerate(stage['buckets']):
+                    values[index] += count
+                values[-3] += stage['total_ms'] / 1000
+                values[-2] += stage['count']
+                values[-1] = max(values[-1], stage['max_ms'] / 1000)
+
+    def prometheus(self, gauges=None):
+        # Định dạng text của Prometheus; gauges: {tên: giá trị} bổ sung (vd. độ sâu hàng đợi của API)
+        snapshot = self.snapshot()
+        prefix = self.prefix
+        lines = [f"# HELP {prefix}_stage_seconds Thời gian từng bước xử lý",
+                 f"# TYPE {prefix}_stage_seconds histogram"]
+        for name, stage in snapshot['stages'].items():
+            cumulative = 0
+            for bound, count in zip(BUCKETS, stage['buckets']):
+                cumulative += count
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {stage["count"]}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {stage["total_ms"] / 1000}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {stage["count"]}')
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+def _bucket_quantile(buckets, count, q, largest):
+    # Ước lượng phân vị theo cận trên của bucket chứa nó (không vượt giá trị lớn nhất đã gặp)
+    if not count:
+        return 0.0
+    target = q * count
+    cumulative = 0
+    for bound, bucket_count in zip(BUCKETS, buckets):
+        cumulative += bucket_count
+        if cumulative >= target:
+            return round(min(bound, largest) * 1000, 3)
+    return round(largest * 1000, 3)
+
+METRICS = Metrics()
+
+class Profiler:
+    # Profiling lấy mẫu cho một lần chạy: tick() được gọi đầu mỗi vòng lặp frame.
+    # - "cprofile": cProfile chỉ bật trong 1/sample_every vòng lặp (gồm cả giải mã frame tiếp theo)
+    # - "tracemalloc": theo dõi cấp phát bộ nhớ suốt lần chạy, báo cáo các dòng cấp phát nhiều nhất
+    # finish() ghi kết quả vào PROFILE_DIR và trả về (đường dẫn, tóm tắt dạng text).
+    def __init__(self, mode="cprofile", sample_every=100, output_dir=PROFILE_DIR, top=15):
+        if mode not in ("cprofile", "tracemalloc"):
+            raise ValueError(f"Chế độ profiling không hỗ trợ: {mode}")
+        self.mode = mode
+        self.sample_every = max(1, int(sample_every))
+        self.output_dir = output_dir
+        self.top = top
+        self.ticks = 0
+        self.sampled = 0
+        self._active = False
+        self._profile = None
+        if mode == "cprofile":
+            import cProfile
+            self._profile = cProfile.Profile()
+        else:
+            import tracemalloc
+            self._tracemalloc = tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+    def tick(self):
+        if self._profile is None:
+            return
+        if self._active:
+            self._profile.disable()
+            self._active = False
+        self.ticks += 1
+        if self.ticks % self.sample_every == 1 or self.sample_every == 1:
+            self.sampled += 1
+            self._profile.enable()
+            self._active = True
+
+    def finish(self, name="run"):
+        import io
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        stem = os.path.join(self.output_dir, f"{_safe_name(name)}_{time.strftime('%Y%m%d_%H%M%S')}")
+        if self._profile is not None:
+            import pstats
+
+            if self._active:
+                self._profile.disable()
+                self._active = False
+            path = stem + ".prof"
+            self._profile.dump_stats(path)
+            text = io.StringIO()
+            text.write(f"{self.sampled}/{self.ticks} frame được lấy mẫu\n")
+            pstats.Stats(self._profile, stream=text).sort_stats("cumulative").print_stats(self.top)
+            return path, text.getvalue()
+
+        snapshot = self._tracemalloc.take_snapshot()
+        current, peak = self._tracemalloc.get_traced_memory()
+        self._tracemalloc.stop()
+        lines = [f"Bộ nhớ hiện tại {current / 2**20:.1f} MB, đỉnh {peak / 2**20:.1f} MB"]
+        lines += [str(stat) for stat in snapshot.statistics("lineno")[:self.top]]
+        path = stem + ".txt"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        return path, "\n".join(lines)
+
+def _safe_name(name):
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in os.path.basename(str(name))) or "run"
+
+def profiler_from_env(mode=None):
+    # "cprofile", "cprofile:20" (lấy mẫu mỗi 20 frame) hoặc "tracemalloc"; trống: không profiling
+    mode = PROFILE_MODE if mode is None else mode
+    if not mode:
+        return None
+    name, _, sample_every = mode.partition(":")
+    return Profiler(name, int(sample_every) if sample_every else 100)
@@ -0,0 +1,225 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import time
+
+import numpy as np
+
+from app.backends import create_backend
+
+# File JSON mô tả các biến thể (danh sách {name, path, accuracy, input_size, quantized});
+# không có thì dùng BASE_MODELS kèm các biến thể sinh tự động
+REGISTRY_PATH = os.environ.get("HELMET_MODEL_REGISTRY", "weights/variants.json")
+# Kết quả đo độ trễ trên máy hiện tại, tính lại khi đổi CPU hoặc file model
+CALIBRATION_PATH = os.environ.get("HELMET_CALIBRATION_PATH", "data/model_calibration.json")
+
+# Các mô hình đã so sánh trong reports/yolo_models_comparison.xlsx, accuracy = mAP@0.5:0.95.
+# Mô hình nào không có file trong weights/ thì bỏ qua.
+BASE_MODELS = [
+    {'name': 'yolo11s', 'path': 'weights/yolo11s.onnx', 'accuracy': 0.66},
+    {'name': 'yolo11n', 'path': 'weights/bestyolo.onnx', 'accuracy': 0.64},
+    {'name': 'yolov8s', 'path': 'weights/yolov8s.onnx', 'accuracy': 0.48},
+    {'name': 'yolov8n', 'path': 'weights/yolov8n.onnx', 'accuracy': 0.45},
+    {'name': 'yolo12n', 'path': 'weights/yolo12n.onnx', 'accuracy': 0.44},
+]
+# Kích thước input thử cho mỗi mô hình (cần model xuất với dynamic=True, trừ 640)
+INPUT_SIZES = (640, 480, 320)
+
+class ModelVariant:
+    # Một cách chạy mô hình: file weights, kích thước input và có lượng tử hoá INT8 hay không.
+    # Thứ tự "chính xác hơn": accuracy của mô hình gốc, rồi input lớn hơn, rồi FP32 trước INT8
+    # (accuracy trong registry JSON có thể ghi số đo thật cho từng biến thể).
+    def __init__(self, name, path, accuracy=0.0, input_size=640, quantized=False):
+        self.name = name
+        self.path = path
+        self.accuracy = accuracy
+        self.input_size = input_size
+        self.quantized = quantized
+
+    @property
+    def rank(self):
+        return (self.accuracy, self.input_size, not self.quantized)
+
+    def model_path(self):
+        return quantize_dynamic(self.path) if self.quantized else self.path
+
+    def build(self, backend, **backend_options):
+        model = create_backend(backend, self.model_path(), input_size=self.input_size, **backend_options)
+        model.variant = self.describe()
+        return model
+
+    def describe(self):
+        return {'name': self.name, 'path': self.path, 'accuracy': self.accuracy,
+                'input_size': self.input_size, 'quantized': self.quantized}
+
+def expand_variants(base_models=BASE_MODELS, input_sizes=INPUT_SIZES, quantize=True):
+    variants = []
+    for base in base_models:
+        if not os.path.exists(base['path']):
+            continue
+        for size in input_sizes:
+            variants.append(ModelVariant(f"{base['name']}-{size}", base['path'], base['accuracy'], size))
+            if quantize:
+                variants.append(ModelVariant(f"{base['name']}-{size}-int8", base['path'], base['accuracy'],
+                                             size, quantized=True))
+    return variants
+
+def load_registry(path=REGISTRY_PATH):
+    if not os.path.exists(path):
+        return expand_variants()
+    with open(path, encoding="utf-8") as f:
+        return [ModelVariant(**entry) for entry in json.load(f)]
+
+def quantize_dynamic(path):
+    # Lượng tử hoá động INT8 (weights INT8, activation lượng tử hoá lúc chạy): không cần dữ liệu
+    # hiệu chuẩn. File <tên>.int8.onnx được tạo một lần cạnh file gốc.
+    output = os.path.splitext(path)[0] + ".int8.onnx"
+    if os.path.exists(output) and os.path.getmtime(output) >= os.path.getmtime(path):
+        return output
+    from onnxruntime.quantization import QuantType, quantize_dynamic as ort_quantize_dynamic
+
+    ort_quantize_dynamic(path, output, weight_type=QuantType.QUInt8)
+    return output
+
+def cpu_signature():
+    # Tên CPU + số lõi: kết quả đo chỉ dùng lại trên cùng loại máy
+    name = platform.processor() or platform.machine()
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    name = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return f"{name} x{os.cpu_count()}"
+
+def _sample_frame(images_dir="test_images", frame_size=(640, 360)):
+    # Ảnh thật trong test_images nếu có (số box ảnh hưởng tới NMS), không thì ảnh tổng hợp
+    import cv2
+
+    for path in sorted(glob.glob(os.path.join(images_dir, "*"))):
+        image = cv2.imread(path)
+        if image is not None:
+            return cv2.resize(image, frame_size)
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 255, (frame_size[1], frame_size[0], 3), dtype=np.uint8)
+
+def measure_latency(model, frame, runs=20, warmup=3, confidence_threshold=0.5, iou_threshold=0.4):
+    # Độ trễ một frame (ms) khi gọi model như vòng lặp video
+    for _ in range(warmup):
+        model(frame, verbose=False, conf=confidence_threshold, iou=iou_threshold)
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        model(frame, verbose=False, conf=confidence_threshold, iou=iou_threshold)
+        samples.append((time.perf_counter() - start) * 1000)
+    p50, p95 = np.percentile(samples, [50, 95])
+    return {'p50_ms': round(float(p50), 3), 'p95_ms': round(float(p95), 3)}
+
+def _load_calibration(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def calibrate(variants, backend, path=CALIBRATION_PATH, runs=20, warmup=3, force=False, frame=None):
+    # Đo độ trễ từng biến thể trên CPU hiện tại; kết quả được lưu theo (CPU, backend, file model)
+    # nên chỉ biến thể mới hoặc file model đã thay đổi mới phải đo lại.
+    # Trả về {tên biến thể: {'p50_ms', 'p95_ms'} hoặc {'error'}}
+    cache = _load_calibration(path)
+    signature = f"{cpu_signature()}|{backend}"
+    machine = cache.setdefault(signature, {})
+    frame = _sample_frame() if frame is None else frame
+
+    latencies = {}
+    for variant in variants:
+        key = f"{variant.name}|{variant.path}|{os.path.getmtime(variant.path):.0f}"
+        if force or key not in machine:
+            try:
+                machine[key] = measure_latency(variant.build(backend), frame, runs, warmup)
+            except Exception as e:
+                # Vd. model kích thước input cố định chạy ở kích thước khác, thiếu onnxruntime
+                machine[key] = {'error': str(e)}
+        latencies[variant.name] = machine[key]
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False, indent=2)
+    return latencies
+
+def select_variant(variants, latencies, budget_ms):
+    # Biến thể chính xác nhất có p95 trong ngân sách; không có thì biến thể nhanh nhất
+    measured = [variant for variant in variants if 'p95_ms' in latencies.get(variant.name, {})]
+    if not measured:
+        raise ValueError("Không đo được biến thể model nào")
+    within_budget = [variant for variant in measured if latencies[variant.name]['p95_ms'] <= budget_ms]
+    if within_budget:
+        return max(within_budget, key=lambda variant: variant.rank), True
+    return min(measured, key=lambda variant: latencies[variant.name]['p95_ms']), False
+
+def choose_variant(backend, budget_ms, registry_path=REGISTRY_PATH, calibration_path=CALIBRATION_PATH):
+    # Đo (hoặc đọc kết quả đo) rồi chọn biến thể; trả về (biến thể, độ trễ đo được, có đạt ngân sách)
+    variants = load_registry(registry_path)
+    if not variants:
+        raise ValueError("Không tìm thấy file model nào cho các biến thể")
+    latencies = calibrate(variants, backend, calibration_path)
+    variant, within_budget = select_variant(variants, latencies, budget_ms)
+    return variant, latencies[variant.name], within_budget
+
+def build_best_model(backend, budget_ms, registry_path=REGISTRY_PATH, calibration_path=CALIBRATION_PATH,
+                     **backend_options):
+    # Tải biến thể được chọn; lựa chọn nằm ở model.variant
+    variant, latency, within_budget = choose_variant(backend, budget_ms, registry_path, calibration_path)
+    model = variant.build(backend, **backend_options)
+    model.variant.update(latency, budget_ms=budget_ms, within_budget=within_budget)
+    return model
+
+def build_named_variant(name, backend, registry_path=REGISTRY_PATH, **backend_options):
+    for variant in load_registry(registry_path):
+        if variant.name == name:
+            return variant.build(backend, **backend_options)
+    raise ValueError(f"Không có biến thể model: {name}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Đo độ trễ các biến thể model và chọn biến thể theo ngân sách")
+    parser.add_argument("--backend", default=None, help="Backend suy luận")
+    parser.add_argument("--budget-ms", type=float, default=None, help="Ngân sách độ trễ p95 mỗi frame (ms)")
+    parser.add_argument("--registry", default=REGISTRY_PATH, help="File JSON danh sách biến thể")
+    parser.add_argument("--runs", type=int, default=20, help="Số lần đo mỗi biến thể")
+    parser.add_argument("--recalibrate", action="store_true", help="Đo lại kể cả khi đã có kết quả")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    from app.load_model import LATENCY_BUDGET_MS, MODEL_BACKEND
+
+    args = parse_args(argv)
+    backend = args.backend or MODEL_BACKEND
+    budget_ms = args.budget_ms if args.budget_ms is not None else LATENCY_BUDGET_MS
+    variants = load_registry(args.registry)
+    if not variants:
+        print("Không tìm thấy file model nào cho các biến thể")
+        return 1
+
+    latencies = calibrate(variants, backend, runs=args.runs, force=args.recalibrate)
+    for variant in sorted(variants, key=lambda variant: variant.rank, reverse=True):
+        latency = latencies[variant.name]
+        if 'error' in latency:
+            print(f"{variant.name:<22} lỗi: {latency['error']}")
+        else:
+            print(f"{variant.name:<22} mAP {variant.accuracy:.2f}  p50 {latency['p50_ms']:>8.2f} ms  "
+                  f"p95 {latency['p95_ms']:>8.2f} ms")
+    try:
+        variant, within_budget = select_variant(variants, latencies, budget_ms)
+    except ValueError as e:
+        print(e)
+        return 1
+    print(f"👉 Chọn {variant.name} (ngân sách {budget_ms:g} ms"
+          + ("" if within_budget else ", không biến thể nào đạt — dùng biến thể nhanh nhất") + ")")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,337 @@
+import argparse
+import threading
+import time
+
+import cv2
+
+from app.clips import ClipRecorder, stream_clip_prefix
+from app.draw_box import draw_boxes
+from app.metrics import METRICS
+from app.processing import infer_batch
+from app.stats import StatsAccumulator
+from app.stream import LatestFrameGrabber, RollingStats, is_file_source, summarize_stream_stats
+from app.tracker import IouTracker
+
+class StreamState:
+    # Trạng thái của một camera trong bộ lập lịch: grabber, tracker, bộ ghi clip, bộ đếm và frame đã vẽ gần nhất
+    def __init__(self, name, grabber, priority=1.0, tracker=None, window=10.0, thresholds=(0.5, 0.4),
+                 recorder=None):
+        self.name = name
+        self.grabber = grabber
+        self.priority = priority
+        self.thresholds = thresholds  # (confidence, iou) của camera này
+        self.tracker = tracker
+        self.recorder = recorder
+        self.rolling = RollingStats(window)
+        self.subscribers = 1
+        self.last_served = 0
+        self.last_violation = 0
+        self.stale = 0  # frame quá cũ khi tới lượt, bị bỏ để giữ độ trễ
+        self.latest = None  # (seq, annotated_frame)
+        self.removed = False  # đã đóng: luồng suy luận bỏ qua kết quả còn lại của camera này
+        self.totals = {'frames': 0, 'aggregate': StatsAccumulator(), 'start_time': time.time()}
+
+    @property
+    def dropped(self):
+        # Frame bị ghi đè trước khi được xử lý + frame quá cũ
+        return self.grabber.dropped + self.stale
+
+    def finish(self):
+        self.totals['processing_time'] = time.time() - self.totals['start_time']
+        self.totals['grabbed'] = self.grabber.grabbed
+        self.totals['dropped'] = self.dropped
+        self.totals['reconnects'] = self.grabber.reconnects
+        if self.tracker is not None:
+            self.totals['tracks'] = self.tracker.summary()
+        if self.recorder is not None:
+            self.recorder.close()
+            self.totals['clips'] = self.recorder.summary()
+        return self.totals
+
+class StreamScheduler:
+    # Một luồng suy luận phục vụ nhiều camera: mỗi vòng chọn tối đa batch_size camera có frame
+    # mới rồi gọi model một lần cho cả batch. Thứ tự ưu tiên = priority x hệ số vi phạm x thời gian
+    # chờ kể từ lần phục vụ trước, nên camera nào cũng tới lượt còn camera vừa có người không
+    # đội mũ được xử lý dày hơn. Khi tổng số frame vượt khả năng, mỗi camera chỉ giữ frame mới
+    # nhất (phần còn lại bị bỏ và đếm vào `dropped`) và frame cũ hơn max_latency bị bỏ qua.
+    # Ngưỡng tin cậy/IoU đặt theo từng camera; camera khác ngưỡng được gọi model theo nhóm riêng.
+    def __init__(self, model, confidence_threshold=0.5, iou_threshold=0.4, batch_size=8,
+                 frame_size=(640, 360), max_latency=1.0, violation_boost=3.0, violation_hold=5.0,
+                 window=10.0, store=None):
+        self.model = model
+        self.confidence_threshold = confidence_threshold
+        self.iou_threshold = iou_threshold
+        self.batch_size = max(1, int(batch_size))
+        self.frame_size = frame_size
+        self.max_latency = max_latency
+        self.violation_boost = violation_boost
+        self.violation_hold = violation_hold  # số giây ưu tiên sau một lần phát hiện no_helmet
+        self.window = window
+        self.store = store
+
+        self.streams = {}
+        self.batches = 0
+        self.error = None
+        self._lock = threading.Lock()
+        # Giữ trong lúc luồng suy luận dùng tracker/bộ ghi clip của các camera trong batch, để
+        # remove_stream() không kết thúc chúng giữa chừng
+        self._process_lock = threading.Lock()
+        self._new_frame = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    # ------------------------- Quản lý camera -------------------------
+    def add_stream(self, name, source=None, priority=1.0, track=False, confidence_threshold=None,
+                   iou_threshold=None, clips=False, **grabber_options):
+        # Thêm camera (hoặc tăng số người xem nếu đã có); trả về tên dùng cho latest()/remove_stream().
+        # Ngưỡng mặc định theo bộ lập lịch; camera đang có người xem nhận ngưỡng của người thêm sau cùng.
+        # clips=True: lưu clip ngắn quanh mỗi vi phạm của camera này vào reports/clips.
+        thresholds = (self.confidence_threshold if confidence_threshold is None else confidence_threshold,
+                      self.iou_threshold if iou_threshold is None else iou_threshold)
+        with self._lock:
+            state = self.streams.get(name)
+            if state is not None:
+                state.subscribers += 1
+                state.priority = max(state.priority, priority)
+                state.thresholds = thresholds
+                if clips and state.recorder is None:
+                    state.recorder = ClipRecorder(fps=state.grabber.fps, source_name=name,
+                                                  file_prefix=stream_clip_prefix(name))
+                return name
+            grabber = LatestFrameGrabber(name if source is None else source, new_frame_event=self._new_frame,
+                                         **grabber_options)
+            recorder = ClipRecorder(source_name=name, file_prefix=stream_clip_prefix(name)) if clips else None
+            self.streams[name] = StreamState(name, grabber, priority, IouTracker() if track else None,
+                                             self.window, thresholds, recorder)
+        grabber.start()
+        self.start()
+        return name
+
+    def remove_stream(self, name):
+        # Giảm số người xem; camera chỉ bị đóng khi không còn ai xem. Trả về tổng kết nếu đã đóng.
+        with self._lock:
+            state = self.streams.get(name)
+            if state is None:
+                return None
+            state.subscribers -= 1
+            if state.subscribers > 0:
+                return None
+            del self.streams[name]
+        state.grabber.stop()
+        # Chờ batch đang xử lý (có thể chứa camera này) xong; các batch sau bỏ qua camera đã đóng
+        with self._process_lock:
+            state.removed = True
+            totals = state.finish()
+        if self.store is not None:
+            if state.tracker is not None:
+                self.store.add_tracks(name, state.tracker.confirmed_tracks(final=True), state.tracker.names,
+                                      totals['start_time'])
+            self.store.flush()
+        return totals
+
+    def set_priority(self, name, priority):
+        with self._lock:
+            if name in self.streams:
+                self.streams[name].priority = priority
+
+    def latest(self, name):
+        # (seq, frame đã vẽ) mới nhất của camera, None nếu chưa có
+        state = self.streams.get(name)
+        return None if state is None else state.latest
+
+    def is_finished(self, name):
+        state = self.streams.get(name)
+        return state is None or state.grabber.finished
+
+    def stats(self):
+        # Bộ đếm theo từng camera: tốc độ xử lý, độ trễ, số frame nhận/xử lý/bỏ
+        now = time.time()
+        with self._lock:
+            states = list(self.streams.values())
+        result = {}
+        for state in states:
+            summary = state.rolling.summary(now)
+            result[state.name] = {
+                'fps': summary['fps'],
+                'latency_ms': summary['latency_ms'],
+                'latency_p95_ms': summary['latency_p95_ms'],
+                'helmet': summary['helmet'],
+                'no_helmet': summary['no_helmet'],
+                'grabbed': state.grabber.grabbed,
+                'analysed': state.totals['frames'],
+                'dropped': state.dropped,
+                'reconnects': state.grabber.reconnects,
+                'connected': state.grabber.connected,
+                'priority': state.priority,
+                'boosted': now - state.last_violation < self.violation_hold,
+            }
+        return result
+
+    # ------------------------- Luồng suy luận -------------------------
+    def start(self):
+        # Khởi động (lại) luồng suy luận, kể cả sau khi luồng dừng vì lỗi model
+        if self._thread is None or not self._thread.is_alive():
+            self.error = None
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="stream-scheduler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        self._new_frame.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            names = list(self.streams)
+        for name in names:
+            with self._lock:
+                if name in self.streams:
+                    self.streams[name].subscribers = 1
+            self.remove_stream(name)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _select(self):
+        # Chọn các camera có frame mới theo điểm ưu tiên; frame quá cũ bị bỏ qua
+        now = time.time()
+        candidates = []
+        with self._lock:
+            states = list(self.streams.values())
+        for state in states:
+            captured_at = state.grabber.peek()
+            if captured_at is None:
+                continue
+            if now - captured_at > self.max_latency:
+                if state.grabber.read(timeout=0) is not None:
+                    state.stale += 1
+                    METRICS.inc('frames_dropped')
+                continue
+            weight = state.priority
+            if now - state.last_violation < self.violation_hold:
+                weight *= self.violation_boost
+            candidates.append((weight * (now - state.last_served + 1e-3), state))
+
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+        batch = []
+        for _, state in candidates[:self.batch_size]:
+            item = state.grabber.read(timeout=0)
+            if item is not None:
+                batch.append((state, item))
+        return batch
+
+    def _run(self):
+        try:
+            while not self._stop_event.is_set():
+                self._new_frame.wait(0.1)
+                self._new_frame.clear()
+                batch = self._select()
+                if batch:
+                    self._process(batch)
+                    # Còn frame chờ trong lúc suy luận thì xét tiếp ngay
+                    self._new_frame.set()
+        except Exception as e:
+            self.error = e
+
+    def _process(self, batch):
+        with METRICS.timer('resize'):
+            frames = [cv2.resize(frame, self.frame_size) for _, (_, _, frame) in batch]
+        # Một lần gọi model cho mỗi bộ ngưỡng trong batch (thường chỉ một)
+        groups = {}
+        for index, (state, _) in enumerate(batch):
+            groups.setdefault(state.thresholds, []).append(index)
+        results_list = [None] * len(batch)
+        for (confidence_threshold, iou_threshold), indices in groups.items():
+            group_results = infer_batch(self.model, [frames[index] for index in indices],
+                                        confidence_threshold, iou_threshold)
+            for index, results in zip(indices, group_results):
+                results_list[index] = results
+        self.batches += 1
+
+        with self._process_lock:
+            for (state, (seq, captured_at, _)), frame, results in zip(batch, frames, results_list):
+                if state.removed:
+                    continue
+                if state.tracker is not None:
+                    results = state.tracker.update(seq, results, captured_at)
+                # Ghi clip trước khi vẽ: draw_boxes vẽ thẳng lên frame
+                if state.recorder is not None:
+                    state.recorder.add(seq, frame, results)
+                annotated_frame, frame_stats = draw_boxes(
+                    frame, results, state.totals['frames'] / max(time.time() - state.totals['start_time'], 1e-6))
+                if self.store is not None:
+                    self.store.add_frame_detections(state.name, seq, results, captured_at)
+                    if state.tracker is not None and state.tracker.ended:
+                        self.store.add_tracks(state.name, state.tracker.confirmed_tracks(), state.tracker.names,
+                                              state.totals['start_time'])
+
+                now = time.time()
+                state.last_served = now
+                if frame_stats['no_helmet'] > 0:
+                    state.last_violation = now
+                latency = now - captured_at
+                state.rolling.add(latency, frame_stats, results, now)
+                state.totals['frames'] += 1
+                METRICS.inc('frames_processed')
+                state.totals['aggregate'].add(frame_stats, latency, captured_at - state.totals['start_time'])
+                state.latest = (seq, annotated_frame)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Nhận diện mũ bảo hiểm trên nhiều camera dùng chung một model")
+    parser.add_argument("sources", nargs="+", help="URL luồng, chỉ số webcam hoặc file video (phát lại đúng FPS)")
+    parser.add_argument("--weights", default=None, help="Đường dẫn model (mặc định: theo HELMET_MODEL_VARIANT)")
+    parser.add_argument("--backend", default=None, help="Backend suy luận")
+    parser.add_argument("--stub", action="store_true", help="Dùng model giả của benchmark (không cần weights)")
+    parser.add_argument("--conf", type=float, default=0.5, help="Ngưỡng tin cậy")
+    parser.add_argument("--iou", type=float, default=0.4, help="Ngưỡng IoU")
+    parser.add_argument("--batch-size", type=int, default=8, help="Số camera tối đa trong một lần gọi model")
+    parser.add_argument("--track", action="store_true", help="Đếm mỗi người một lần theo track")
+    parser.add_argument("--duration", type=float, default=None, help="Dừng sau số giây này")
+    parser.add_argument("--clips", action="store_true", help="Lưu clip ngắn quanh mỗi vi phạm vào reports/clips")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.stub:
+        from app.benchmark import StubModel
+        model = StubModel(latency=0.03)
+    else:
+        from app.load_model import MODEL_BACKEND, build_default_model, build_model
+        backend = args.backend or MODEL_BACKEND
+        model = build_model(args.weights, backend) if args.weights else build_default_model(backend)
+
+    scheduler = StreamScheduler(model, args.conf, args.iou, args.batch_size)
+    for index, source in enumerate(args.sources):
+        # Cùng một file có thể được dùng làm nhiều camera giả lập
+        name = f"{index}:{source}"
+        scheduler.add_stream(name, source, track=args.track, clips=args.clips,
+                             max_reconnects=0 if is_file_source(source) else None)
+
+    start = time.time()
+    try:
+        while args.duration is None or time.time() - start < args.duration:
+            time.sleep(1.0)
+            if scheduler.error is not None:
+                raise scheduler.error
+            stats = scheduler.stats()
+            for name, stream_stats in stats.items():
+                print(f"{name}: fps={stream_stats['fps']:.1f} latency={stream_stats['latency_ms']:.0f}ms "
+                      f"analysed={stream_stats['analysed']} dropped={stream_stats['dropped']}"
+                      + (" [ưu tiên]" if stream_stats['boosted'] else ""), flush=True)
+            print(f"batches={scheduler.batches}", flush=True)
+            if all(scheduler.is_finished(name) for name in stats):
+                break
+    except KeyboardInterrupt:
+        pass
+
+    for name in list(scheduler.streams):
+        print(name, summarize_stream_stats(scheduler.remove_stream(name)))
+    scheduler.stop()
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
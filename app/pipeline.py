@@ -0,0 +1,99 @@
+import queue
+import threading
+
+from app.decode import FrameReader, iter_frames
+from app.frame_scheduler import FixedFrameScheduler
+from app.processing import FrameBatcher
+
+_END = object()
+
+def _put(q, item, stop_event):
+    # Đưa phần tử vào hàng đợi có giới hạn; chờ khi hàng đợi đầy (backpressure)
+    # nhưng vẫn thoát được ngay khi có yêu cầu dừng
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _decode_worker(cap, decode_queue, stop_event, scheduler, frame_size, full_resolution, keep_skipped):
+    reader = FrameReader(cap, frame_size)
+    try:
+        for item in iter_frames(reader, scheduler, keep_skipped, full_resolution):
+            if stop_event.is_set() or not _put(decode_queue, item, stop_event):
+                return
+    except Exception as e:
+        _put(decode_queue, e, stop_event)
+        return
+    _put(decode_queue, _END, stop_event)
+
+def _inference_worker(model, decode_queue, result_queue, stop_event, scheduler,
+                      confidence_threshold, iou_threshold, batch_size, max_wait):
+    batcher = FrameBatcher(batch_size, max_wait)
+
+    def flush():
+        for item in batcher.flush(model, confidence_threshold, iou_threshold, scheduler):
+            if not _put(result_queue, item, stop_event):
+                return False
+        return True
+
+    try:
+        while not stop_event.is_set():
+            try:
+                # Khi đang có batch dở dang thì chờ ngắn để max_wait vẫn có hiệu lực
+                item = decode_queue.get(timeout=0.05 if batcher.sampled else 0.5)
+            except queue.Empty:
+                if batcher.is_ready() and not flush():
+                    return
+                continue
+
+            if item is _END:
+                if flush():
+                    _put(result_queue, _END, stop_event)
+                return
+            if isinstance(item, Exception):
+                _put(result_queue, item, stop_event)
+                return
+
+            batcher.add(*item)
+            if batcher.is_ready() and not flush():
+                return
+    except Exception as e:
+        _put(result_queue, e, stop_event)
+
+def iter_pipelined_results(cap, model, confidence_threshold, iou_threshold, skip_frames=3,
+                           batch_size=1, max_wait=0.5, frame_size=(640, 360), queue_size=16,
+                           scheduler=None, keep_skipped=False):
+    # Giống iter_video_results nhưng giải mã và suy luận chạy trên các luồng riêng,
+    # nối với nhau bằng hàng đợi có giới hạn. Bước vẽ/hiển thị do bên gọi đảm nhận.
+    scheduler = scheduler or FixedFrameScheduler(skip_frames)
+    decode_queue = queue.Queue(maxsize=queue_size)
+    result_queue = queue.Queue(maxsize=queue_size)
+    stop_event = threading.Event()
+
+    workers = [
+        threading.Thread(target=_decode_worker, name="video-decode", daemon=True,
+                         args=(cap, decode_queue, stop_event, scheduler, frame_size,
+                               getattr(model, 'full_resolution', False), keep_skipped)),
+        threading.Thread(target=_inference_worker, name="video-inference", daemon=True,
+                         args=(model, decode_queue, result_queue, stop_event, scheduler,
+                               confidence_threshold, iou_threshold, batch_size, max_wait)),
+    ]
+    for worker in workers:
+        worker.start()
+
+    try:
+        while True:
+            item = result_queue.get()
+            if item is _END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Dừng các luồng khi video kết thúc, có lỗi hoặc người dùng dừng giữa chừng
+        stop_event.set()
+        for worker in workers:
+            worker.join()
@@ -0,0 +1,81 @@
+import time
+
+import cv2
+
+from app.metrics import METRICS
+
+PREVIEW_FPS = 8
+PREVIEW_QUALITY = 70
+PREVIEW_WIDTH = 640
+
+class PreviewRenderer:
+    # Đưa frame và tiến độ lên giao diện Streamlit với tần suất giới hạn, tách khỏi tốc độ phân tích:
+    # - frame được thu nhỏ về `width` và nén JPEG (`quality`) trước khi gửi qua websocket,
+    #   tối đa `max_fps` lần mỗi giây; max_fps = 0 tắt xem trước
+    # - thanh tiến độ và dòng trạng thái được gộp, cập nhật tối đa mỗi `status_interval` giây
+    def __init__(self, frame_placeholder=None, progress_bar=None, status_text=None, max_fps=PREVIEW_FPS,
+                 quality=PREVIEW_QUALITY, width=PREVIEW_WIDTH, status_interval=0.5):
+        self.frame_placeholder = frame_placeholder
+        self.progress_bar = progress_bar
+        self.status_text = status_text
+        self.max_fps = max_fps
+        self.quality = int(quality)
+        self.width = width
+        self.status_interval = status_interval
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self._last_frame_time = 0
+        self._last_frame = None
+        self._last_status_time = 0
+
+    @property
+    def enabled(self):
+        return self.frame_placeholder is not None and self.max_fps > 0
+
+    def encode(self, frame):
+        height, width = frame.shape[:2]
+        if self.width and width > self.width:
+            frame = cv2.resize(frame, (self.width, round(height * self.width / width)), interpolation=cv2.INTER_AREA)
+        ok, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        return buffer.tobytes() if ok else None
+
+    def due(self):
+        # Đã tới lượt gửi frame mới chưa (để bên gọi bỏ qua cả bước vẽ nếu chưa)
+        return self.enabled and time.time() - self._last_frame_time >= 1.0 / self.max_fps
+
+    def show(self, frame, caption=None, force=False):
+        # Frame bị bỏ qua lặp lại đúng mảng đã gửi trước đó: không gửi lại, giữ lượt cho frame mới
+        if frame is None or frame is self._last_frame or not self.enabled or not (force or self.due()):
+            return False
+        with METRICS.timer('render'):
+            data = self.encode(frame)
+            if data is None:
+                return False
+            # Ảnh đã nén được gửi nguyên vẹn, Streamlit không phải mã hoá lại mảng BGR thô
+            self.frame_placeholder.image(data, caption=caption, use_container_width=True)
+        self._last_frame_time = time.time()
+        self._last_frame = frame
+        self.frames_sent += 1
+        self.bytes_sent += len(data)
+        return True
+
+    def status(self, message, progress=None, force=False):
+        now = time.time()
+        if not force and now - self._last_status_time < self.status_interval:
+            return False
+        if self.progress_bar is not None and progress is not None:
+            self.progress_bar.progress(min(max(progress, 0.0), 1.0))
+        if self.status_text is not None and message:
+            self.status_text.info(message)
+        self._last_status_time = now
+        return True
+
+    def update(self, frame_count, total_frames=0, frame=None):
+        # Gọi với mọi frame: frame chỉ được gửi khi tới lượt, tiến độ được gộp theo status_interval.
+        # Trả về True khi tiến độ vừa được cập nhật (bên gọi cập nhật các thống kê khác cùng nhịp)
+        self.show(frame)
+        if total_frames > 0:
+            progress = min(frame_count / total_frames, 1.0)
+            return self.status(f"Đang xử lý... {progress * 100:.1f}% hoàn thành", progress)
+        # Video đọc qua FIFO có thể không biết trước tổng số frame
+        return self.status(f"Đang xử lý... {frame_count} frame")
@@ -1,104 +1,482 @@
 import cv2
-import numpy as np
 from datetime import datetime
+import os
 import time
 import streamlit as st
 
-from app.draw_box import draw_boxes
-from app.report import add_report_entry
+from app.clips import ClipRecorder
+from app.decode import FrameReader, iter_frames, open_video
+from app.detections import Detections
+from app.draw_box import detection_stats, draw_boxes
+from app.frame_scheduler import AdaptiveFrameScheduler, FixedFrameScheduler
+from app.metrics import METRICS, profiler_from_env
+from app.preview import PREVIEW_FPS, PREVIEW_QUALITY, PreviewRenderer
+from app.tiling import RegionDetector
+from app.tracker import IouTracker
+from app.report import add_report_entry, get_store
+from app.stats import StatsAccumulator
 
-def process_video(video_path, model, confidence_threshold, iou_threshold, skip_frames=3):
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        st.error("Không mở được video. Vui lòng kiểm tra file.")
-        return None
+def infer_batch(model, frames, confidence_threshold, iou_threshold):
+    # Gửi nhiều frame vào model trong một lần gọi, kết quả trả về đúng thứ tự
+    if not frames:
+        return []
+    with METRICS.timer('inference'):
+        if len(frames) == 1:
+            return [model(frames[0], verbose=False, conf=confidence_threshold, iou=iou_threshold)[0]]
+        return list(model(frames, verbose=False, conf=confidence_threshold, iou=iou_threshold))
 
-    stframe = st.empty()
-    progress_bar = st.progress(0)
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    frame_count = 0
+class FrameBatcher:
+    # Gom các frame cần suy luận thành batch; frame bị bỏ qua được giữ lại
+    # để trả về đúng thứ tự sau khi batch chạy xong
+    def __init__(self, batch_size=1, max_wait=0.5):
+        self.batch_size = max(1, int(batch_size))
+        self.max_wait = max_wait
+        self.items = []
+        self.sampled = 0
+        self.first_sample_time = None
 
-    status_text = st.empty()
-    status_text.info(f"Đang xử lý video ({total_frames} frames)...")
+    def add(self, frame_count, frame, sampled, source=None):
+        # source: frame gốc đưa vào model thay cho `frame` (box được quy đổi về kích thước `frame`)
+        self.items.append((frame_count, frame, sampled, source))
+        if sampled:
+            if self.sampled == 0:
+                self.first_sample_time = time.time()
+            self.sampled += 1
+
+    def is_ready(self):
+        if not self.items:
+            return False
+        if self.sampled == 0 or self.sampled >= self.batch_size:
+            return True
+        return self.max_wait is not None and time.time() - self.first_sample_time >= self.max_wait
 
+    def flush(self, model, confidence_threshold, iou_threshold, scheduler=None):
+        items, self.items = self.items, []
+        self.sampled = 0
+        self.first_sample_time = None
+
+        frames = [frame if source is None else source for _, frame, sampled, source in items if sampled]
+        start = time.time()
+        results = iter(infer_batch(model, frames, confidence_threshold, iou_threshold))
+        # Chia đều thời gian của batch cho từng frame để tính FPS
+        infer_time = (time.time() - start) / len(frames) if frames else 0
+
+        output = []
+        for frame_count, frame, sampled, source in items:
+            if sampled:
+                result = next(results)
+                if source is not None:
+                    result = scale_to_frame(result, source.shape, frame.shape)
+                if scheduler is not None:
+                    # Phản hồi độ trễ và vi phạm cho bộ lập lịch chọn frame
+                    scheduler.record_result(frame_count, infer_time, result)
+                output.append((frame_count, frame, result, infer_time))
+            else:
+                output.append((frame_count, frame, None, None))
+        return output
+
+def scale_to_frame(results, source_shape, frame_shape):
+    # Quy đổi box từ toạ độ ảnh gốc sang frame hiển thị đã thu nhỏ
+    scale_x = frame_shape[1] / source_shape[1]
+    scale_y = frame_shape[0] / source_shape[0]
+    return Detections.from_results(results).scaled(scale_x, scale_y, orig_shape=frame_shape[:2])
+
+def iter_video_results(cap, model, confidence_threshold, iou_threshold, skip_frames=3,
+                       batch_size=1, max_wait=0.5, frame_size=(640, 360), scheduler=None,
+                       keep_skipped=False):
+    # Trả về (frame_count, resized_frame, results, infer_time) theo thứ tự frame,
+    # results = None với frame bị bỏ qua. Frame bỏ qua chỉ được giải mã/thu nhỏ khi keep_skipped=True
+    # (ngược lại resized_frame = None, trừ frame đầu tiên).
+    # Model có thuộc tính full_resolution (vd. RegionDetector) nhận frame gốc thay vì frame đã thu nhỏ
+    scheduler = scheduler or FixedFrameScheduler(skip_frames)
+    batcher = FrameBatcher(batch_size, max_wait)
+    reader = FrameReader(cap, frame_size)
+
+    for frame_count, resized_frame, sampled, source in iter_frames(
+            reader, scheduler, keep_skipped, getattr(model, 'full_resolution', False)):
+        batcher.add(frame_count, resized_frame, sampled, source)
+
+        if batcher.is_ready():
+            yield from batcher.flush(model, confidence_threshold, iou_threshold, scheduler)
+
+    yield from batcher.flush(model, confidence_threshold, iou_threshold, scheduler)
+
+def analyze_video(cap, model, confidence_threshold, iou_threshold, skip_frames=3,
+                  batch_size=1, max_wait=0.5, pipelined=False, queue_size=16, on_frame=None,
+                  scheduler=None, tracker=None, store=None, source_name="video", annotate=True,
+                  aggregate=None, profiler=None, recorder=None, draw_fn=draw_boxes):
+    # Vòng lặp xử lý video không phụ thuộc giao diện; on_frame(frame_count, annotated_frame)
+    # được gọi với mỗi frame để hiển thị hoặc ghi ra file.
+    # Khi có tracker: mỗi người chỉ được đếm một lần và frame bị bỏ qua được vẽ box dự đoán.
+    # Khi có store (ViolationStore): ghi box từng frame và từng track vào kho lưu trữ.
+    # annotate: True/False hoặc hàm trả về True khi frame sẽ được hiển thị (vd. PreviewRenderer.due);
+    # frame không vẽ được truyền cho on_frame dưới dạng None, thống kê vẫn được tính đầy đủ.
+    # aggregate: StatsAccumulator (tuỳ chọn) do bên gọi giữ để đọc thống kê trong khi đang xử lý;
+    # thống kê được cộng dồn với bộ nhớ không đổi theo độ dài video.
+    # profiler: app.metrics.Profiler cho lần chạy này (mặc định theo HELMET_PROFILE, thường là tắt).
+    # recorder: app.clips.ClipRecorder nhận mọi frame để cắt clip ngắn quanh mỗi vi phạm.
+    # draw_fn(image, results, actual_fps): hàm vẽ box (mặc định app.draw_box.draw_boxes),
+    # vd. giao diện dùng cỡ chữ lớn hơn.
+    scheduler = scheduler or FixedFrameScheduler(skip_frames)
+    profiler = profiler or profiler_from_env()
     stats = {
-        'total_frames': total_frames,
+        'total_frames': int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
         'processed_frames': 0,
-        'helmet_counts': [],
-        'no_helmet_counts': [],
-        'fps_list': [],
+        'aggregate': aggregate if aggregate is not None else StatsAccumulator(),
+        'model_variant': getattr(model, 'variant', None),  # biến thể model được chọn (nếu có)
         'start_time': datetime.now()
     }
 
-    last_display_time = 0
     annotated_frame = None  # lưu frame đã annotate gần nhất
+    # Chỉ giữ ảnh frame bị bỏ qua khi tracker có thể vẽ box dự đoán lên đó hoặc khi cần ghi clip
+    keep_skipped = (tracker is not None and annotate is not False) or recorder is not None
+    start_ts = time.time()
+    video_fps = cap.get(cv2.CAP_PROP_FPS) or 25
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
+    if pipelined:
+        # Import tại đây để tránh vòng lặp import (pipeline dùng FrameBatcher)
+        from app.pipeline import iter_pipelined_results
+        frame_results = iter_pipelined_results(cap, model, confidence_threshold, iou_threshold,
+                                               skip_frames, batch_size, max_wait, queue_size=queue_size,
+                                               scheduler=scheduler, keep_skipped=keep_skipped)
+    else:
+        frame_results = iter_video_results(cap, model, confidence_threshold, iou_threshold,
+                                           skip_frames, batch_size, max_wait, scheduler=scheduler,
+                                           keep_skipped=keep_skipped)
 
-        frame_count += 1
-        resized_frame = cv2.resize(frame, (640, 360))
+    try:
+        for frame_count, resized_frame, results, infer_time in frame_results:
+            if profiler is not None:
+                profiler.tick()
+            draw = annotate() if callable(annotate) else annotate
+            METRICS.inc('frames_processed' if results is not None else 'frames_skipped')
+            # FPS chạy = số frame đã phân tích / thời gian thực, cùng cách tính với summarize_video_stats
+            actual_fps = stats['processed_frames'] / max(time.time() - start_ts, 1e-6)
+            if results is not None:
+                draw_start_time = time.time()
+                if tracker is not None:
+                    results = tracker.update(frame_count, results, start_ts + frame_count / video_fps)
+                if draw:
+                    annotated_frame, frame_stats = draw_fn(resized_frame.copy(), results, actual_fps)
+                else:
+                    annotated_frame, frame_stats = None, detection_stats(results)
+                if store is not None:
+                    store.add_frame_detections(source_name, frame_count, results, start_ts + frame_count / video_fps)
+                    if tracker is not None and tracker.ended:
+                        store.add_tracks(source_name, tracker.confirmed_tracks(), tracker.names, start_ts)
 
-        if frame_count % skip_frames == 0:
-            loop_start_time = time.time()
+                loop_time = infer_time + (time.time() - draw_start_time)
+                stats['aggregate'].add(frame_stats, loop_time, frame_count / video_fps)
+                stats['processed_frames'] += 1
+            elif not draw:
+                annotated_frame = None
+            elif tracker is not None and tracker.tracks:
+                annotated_frame, _ = draw_fn(resized_frame.copy(), tracker.predict(frame_count), actual_fps)
+            elif annotated_frame is None:
+                annotated_frame = resized_frame  # fallback khi chưa có kết quả nào
 
-            # Gọi YOLO model
-            results = model(resized_frame, verbose=False, conf=confidence_threshold, iou=iou_threshold)[0]
-            annotated_frame, frame_stats = draw_boxes(resized_frame.copy(), results)
+            if recorder is not None:
+                recorder.add(frame_count, resized_frame, results)
+            if on_frame is not None:
+                on_frame(frame_count, annotated_frame)
+    finally:
+        # Đóng generator để các luồng của pipeline dừng hẳn trước khi giải phóng video
+        frame_results.close()
+        cap.release()
+        if recorder is not None:
+            recorder.close()
 
-            loop_time = time.time() - loop_start_time
-            actual_fps = 1.0 / loop_time if loop_time > 0 else 0
+    stats['processing_time'] = datetime.now() - stats['start_time']
+    if recorder is not None:
+        stats['clips'] = recorder.summary()
+    stats['frame_selection'] = scheduler.summary()
+    if profiler is not None:
+        stats['profile'] = profiler.finish(source_name)
+    if tracker is not None:
+        stats['tracks'] = tracker.summary()
+    if store is not None:
+        if tracker is not None:
+            store.add_tracks(source_name, tracker.confirmed_tracks(final=True), tracker.names, start_ts)
+        store.flush()
+    return stats
 
-            stats['helmet_counts'].append(frame_stats['helmet'])
-            stats['no_helmet_counts'].append(frame_stats['no_helmet'])
-            stats['fps_list'].append(actual_fps)
-            stats['processed_frames'] += 1
-        else:
-            if annotated_frame is None:
-                annotated_frame = resized_frame  # fallback khi chưa có kết quả nào
+def summarize_video_stats(stats):
+    # Tổng hợp thống kê theo định dạng của add_report_entry.
+    # Có tracker thì dùng số đối tượng duy nhất thay vì cộng dồn theo frame.
+    aggregate = stats['aggregate']
+    if 'tracks' in stats:
+        total_helmet = stats['tracks']['helmet']
+        total_no_helmet = stats['tracks']['no_helmet']
+    else:
+        total_helmet = aggregate.helmet
+        total_no_helmet = aggregate.no_helmet
+    total_objects = total_helmet + total_no_helmet
+    # FPS = số frame đã phân tích / thời gian thực của cả lần chạy (gồm giải mã, vẽ, hiển thị)
+    elapsed = stats['processing_time'].total_seconds()
 
-        # Hiển thị đều đặn mỗi 0.03s (~30fps hiển thị)
-        if time.time() - last_display_time > 0.03:
-            stframe.image(annotated_frame, channels="BGR", use_container_width=True)
-            progress_bar.progress(min(frame_count / total_frames, 1.0))
-            status_text.info(f"Đang xử lý... {min(frame_count / total_frames, 1.0)*100:.1f}% hoàn thành")
-            last_display_time = time.time()
+    return {
+        'total': total_objects,
+        'helmet': total_helmet,
+        'no_helmet': total_no_helmet,
+        'safety_rate': (total_helmet / total_objects * 100) if total_objects > 0 else 0,
+        'violation_rate': aggregate.violation_rate,
+        'fps': stats['processed_frames'] / elapsed if elapsed > 0 else 0,
+        'frames': stats['processed_frames']
+    }
 
-    cap.release()
-    stats['processing_time'] = datetime.now() - stats['start_time']
+def process_video(video_path, model, confidence_threshold, iou_threshold, skip_frames=3,
+                  batch_size=1, max_wait=0.5, pipelined=False, queue_size=16,
+                  adaptive=False, target_rtf=1.0, track=False, source_name="video", roi=None, tile_size=None,
+                  preview_fps=PREVIEW_FPS, preview_quality=PREVIEW_QUALITY, profiler=None, clips=False,
+                  draw_fn=draw_boxes):
+    cap = open_video(video_path)
+    if not cap.isOpened():
+        st.error("Không mở được video. Vui lòng kiểm tra file.")
+        return None
+
+    # adaptive=True: chọn frame theo ngân sách thời gian và mức chuyển động thay vì cố định skip_frames
+    scheduler = None
+    if adaptive:
+        scheduler = AdaptiveFrameScheduler(cap.get(cv2.CAP_PROP_FPS), target_rtf, max_interval=skip_frames * 5)
+    # track=True: đếm mỗi người một lần theo track thay vì cộng dồn theo frame
+    tracker = IouTracker() if track else None
+    # roi / tile_size: cắt vùng quan tâm và chia tile ở độ phân giải gốc trước khi suy luận
+    if roi or tile_size:
+        model = RegionDetector(model, roi, tile_size)
+    # clips=True: lưu clip ngắn quanh mỗi vi phạm vào reports/clips
+    recorder = ClipRecorder(fps=cap.get(cv2.CAP_PROP_FPS), source_name=source_name) if clips else None
+
+    # preview_fps = 0: chế độ không xem trước, bỏ hẳn bước vẽ box và chỉ tính thống kê
+    stframe = st.empty() if preview_fps > 0 else None
+    progress_bar = st.progress(0)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    status_text = st.empty()
+    status_text.info(f"Đang xử lý video ({total_frames} frames)...")
+
+    live_metrics = st.empty()
+
+    preview = PreviewRenderer(stframe, progress_bar, status_text, preview_fps, preview_quality)
+    aggregate = StatsAccumulator()
+
+    def show_frame(frame_count, annotated_frame):
+        if preview.update(frame_count, total_frames, annotated_frame) and aggregate.frames:
+            # Thống kê tạm thời, cùng nhịp với thanh tiến độ
+            with live_metrics.container():
+                cols = st.columns(4)
+                cols[0].metric("🔒 Tỷ lệ an toàn", f"{aggregate.safety_rate:.1f}%")
+                cols[1].metric("🚨 Frame vi phạm", f"{aggregate.violation_rate:.1f}%")
+                cols[2].metric("🎞️ Đã phân tích", aggregate.frames)
+                cols[3].metric("⏱️ Độ trễ p95", f"{aggregate.latency_quantile(0.95) * 1000:.0f} ms")
+
+    # Chỉ vẽ frame sẽ thực sự được gửi lên giao diện
+    stats = analyze_video(cap, model, confidence_threshold, iou_threshold, skip_frames,
+                          batch_size, max_wait, pipelined, queue_size, on_frame=show_frame,
+                          scheduler=scheduler, tracker=tracker, store=get_store(), source_name=source_name,
+                          annotate=preview.due if preview.enabled else False, aggregate=aggregate,
+                          profiler=profiler, recorder=recorder, draw_fn=draw_fn)
+    live_metrics.empty()
+    progress_bar.progress(1.0)
     status_text.success(f"✅ Xử lý hoàn tất! Thời gian: {stats['processing_time'].seconds} giây")
 
-    total_helmet = sum(stats['helmet_counts'])
-    total_no_helmet = sum(stats['no_helmet_counts'])
-    total_objects = total_helmet + total_no_helmet
-    avg_fps = np.mean(stats['fps_list']) if stats['fps_list'] else 0
-    safety_rate = (total_helmet / total_objects * 100) if total_objects > 0 else 0
+    summary = summarize_video_stats(stats)
 
     st.markdown("### 📊 Thống kê video")
     col1, col2, col3, col4, col5, col6 = st.columns(6)
 
     with col1:
-        st.metric("🧍 Tổng đối tượng", f"{total_objects}")
+        st.metric("🧍 Tổng đối tượng", f"{summary['total']}")
     with col2:
-        st.metric("🟢 Có mũ", f"{total_helmet}")
+        st.metric("🟢 Có mũ", f"{summary['helmet']}")
     with col3:
-        st.metric("🔴 Không mũ", f"{total_no_helmet}")
+        st.metric("🔴 Không mũ", f"{summary['no_helmet']}")
     with col4:
-        st.metric("🔒 Tỷ lệ an toàn", f"{safety_rate:.2f}%")
+        st.metric("🔒 Tỷ lệ an toàn", f"{summary['safety_rate']:.2f}%")
     with col5:
-        st.metric("🎞️ Tổng frame", f"{stats['processed_frames']}")
+        st.metric("🎞️ Tổng frame", f"{summary['frames']}")
     with col6:
-        st.metric("⚡ FPS trung bình", f"{avg_fps:.2f}")
+        st.metric("⚡ FPS trung bình", f"{summary['fps']:.2f}")
 
-    add_report_entry({
-        'total': total_objects,
-        'helmet': total_helmet,
-        'no_helmet': total_no_helmet,
-        'safety_rate': safety_rate,
-        'fps': avg_fps,
-        'frames': stats['processed_frames']
-    }, 'Video')
+    selection = stats['frame_selection']
+    reasons = ", ".join(f"{reason}: {count}" for reason, count in selection['analysed_reasons'].items())
+    st.caption(f"Đã phân tích {selection['analysed']}/{selection['analysed'] + selection['skipped']} frame"
+               + (f" ({reasons})" if reasons else "")
+               + f" — {summary['violation_rate']:.1f}% frame có vi phạm"
+               + (f" — model {stats['model_variant']['name']}" if stats['model_variant'] else ""))
+    show_violation_timeline(aggregate)
+    show_violation_clips(stats.get('clips'))
+    show_pipeline_metrics(stats.get('profile'))
+
+    add_report_entry(summary, 'Video', source_name)
 
     return stats
+
+def show_violation_timeline(aggregate):
+    # Biểu đồ số frame có vi phạm theo khoảng thời gian của video (số ô cố định)
+    import pandas as pd
+
+    histogram = aggregate.histogram()
+    if len(histogram) < 2:
+        return
+    seconds = aggregate.bucket_seconds
+    st.markdown(f"#### 🚨 Frame vi phạm theo thời gian (mỗi cột {seconds:g} giây)")
+    st.bar_chart(pd.DataFrame(
+        [{'Thời điểm': f"{int(start // 60):02d}:{int(start % 60):02d}", 'Frame vi phạm': violation_frames}
+         for start, _, _, _, violation_frames in histogram]
+    ).set_index('Thời điểm'))
+
+def show_violation_clips(clips):
+    # Ảnh vùng đầu của từng vi phạm, mỗi ảnh ghi thời điểm và file clip tương ứng
+    if not clips:
+        return
+    st.markdown(f"#### 🎬 Clip vi phạm ({clips['clips']})")
+    if clips['dropped']:
+        st.warning(f"Bỏ {clips['dropped']} clip do hàng đợi ghi bị đầy")
+    thumbnails = [(path, event) for event in clips['events'] if 'error' not in event
+                  for path in event['thumbnails']]
+    if not thumbnails:
+        return
+    cols = st.columns(min(len(thumbnails), 6))
+    for index, (path, event) in enumerate(thumbnails):
+        cols[index % len(cols)].image(
+            path, caption=f"{int(event['time_s'] // 60):02d}:{event['time_s'] % 60:04.1f} — "
+                          f"{os.path.basename(event['clip'])}")
+
+def show_pipeline_metrics(profile=None):
+    # Thời gian từng bước và bộ đếm frame (cộng dồn từ khi khởi động), kèm kết quả profiling nếu có
+    import pandas as pd
+
+    snapshot = METRICS.snapshot()
+    if not snapshot['stages'] and profile is None:
+        return
+    with st.expander("⏱️ Thời gian từng bước (từ khi khởi động)"):
+        if snapshot['stages']:
+            st.dataframe(pd.DataFrame([
+                {'Bước': name, 'Số lần': stage['count'], 'TB (ms)': stage['mean_ms'],
+                 'p50 (ms)': stage['p50_ms'], 'p95 (ms)': stage['p95_ms'], 'Tổng (s)': stage['total_ms'] / 1000}
+                for name, stage in snapshot['stages'].items()
+            ]), use_container_width=True)
+        counters = snapshot['counters']
+        st.caption(f"Frame đã xử lý {counters.get('frames_processed', 0)}, bỏ qua {counters.get('frames_skipped', 0)}, "
+                   f"bị bỏ do quá tải {counters.get('frames_dropped', 0)}")
+        if profile is not None:
+            path, summary = profile
+            st.markdown(f"**Profiling** — đã lưu `{path}`")
+            st.code(summary)
+
+def process_stream(source, model, confidence_threshold, iou_threshold, track=False, window=10.0,
+                   preview_fps=PREVIEW_FPS, preview_quality=PREVIEW_QUALITY, clips=False, max_reconnects=10):
+    # Luồng trực tiếp (RTSP/HTTP/webcam, hoặc file phát lại đúng FPS): chạy tới khi người dùng bấm dừng
+    # hoặc đã thử kết nối lại quá max_reconnects lần (file chỉ phát một lần)
+    from app.clips import stream_clip_prefix
+    from app.stream import LatestFrameGrabber, analyze_stream, is_file_source, summarize_stream_stats
+
+    tracker = IouTracker() if track else None
+    source_name = str(source)
+    recorder = ClipRecorder(source_name=source_name, file_prefix=stream_clip_prefix(source_name)) if clips else None
+
+    stframe = st.empty()
+    status_text = st.empty()
+    status_text.info(f"Đang kết nối tới {source_name}...")
+    metrics = st.empty()
+
+    preview = PreviewRenderer(stframe, max_fps=preview_fps, quality=preview_quality)
+
+    def show_frame(seq, annotated_frame):
+        preview.show(annotated_frame)
+
+    def show_stats(summary):
+        if summary['connected']:
+            status_text.info(f"🔴 Đang phát trực tiếp — bỏ {summary['dropped']} frame cũ, "
+                             f"kết nối lại {summary['reconnects']} lần")
+        elif summary['reconnects'] == 0:
+            status_text.info(f"Đang kết nối tới {source_name}...")
+        else:
+            limit = f"/{summary['max_reconnects']}" if summary['max_reconnects'] is not None else ""
+            status_text.warning(f"Mất kết nối, đang thử lại ({summary['reconnects']}{limit})...")
+        if not summary['frames']:
+            return
+        with metrics.container():
+            cols = st.columns(5)
+            cols[0].metric("⚡ FPS", f"{summary['fps']:.1f}")
+            cols[1].metric("⏱️ Độ trễ", f"{summary['latency_ms']:.0f} ms")
+            cols[2].metric("⏱️ Độ trễ p95", f"{summary['latency_p95_ms']:.0f} ms")
+            cols[3].metric("🟢 Có mũ", summary['helmet'])
+            cols[4].metric("🔴 Không mũ", summary['no_helmet'])
+            st.caption(f"Thống kê trong {window:.0f} giây gần nhất")
+
+    file_source = is_file_source(source)
+    totals = {}
+    try:
+        with LatestFrameGrabber(source, max_reconnects=0 if file_source else max_reconnects) as grabber:
+            analyze_stream(grabber, model, confidence_threshold, iou_threshold, tracker=tracker,
+                           window=window, on_frame=show_frame, on_stats=show_stats,
+                           store=get_store(), source_name=source_name, totals=totals, recorder=recorder)
+    finally:
+        # Bấm "Dừng" làm Streamlit chạy lại script giữa chừng: vẫn dừng grabber và ghi lịch sử
+        if totals.get('frames'):
+            add_report_entry(summarize_stream_stats(totals), 'Camera', source_name)
+
+    if not totals['frames']:
+        status_text.error(f"Không nhận được frame nào từ {source_name} (thử lại {totals['reconnects']} lần). "
+                          "Vui lòng kiểm tra địa chỉ camera.")
+    elif not file_source:
+        status_text.error(f"Mất kết nối tới {source_name} sau {totals['reconnects']} lần thử lại, "
+                          f"đã dừng luồng sau {totals['processing_time']:.0f} giây")
+        show_violation_clips(totals.get('clips'))
+    else:
+        status_text.success(f"✅ Đã dừng luồng sau {totals['processing_time']:.0f} giây")
+        show_violation_clips(totals.get('clips'))
+    return totals
+
+@st.cache_resource
+def get_stream_scheduler(_model):
+    # Một bộ lập lịch cho mọi phiên: camera của các phiên được gom batch chung, ngưỡng đặt theo camera
+    from app.multistream import StreamScheduler
+    return StreamScheduler(_model, store=get_store()).start()
+
+def process_streams(sources, model, confidence_threshold, iou_threshold, track=False, columns=3,
+                    preview_fps=PREVIEW_FPS, preview_quality=PREVIEW_QUALITY, clips=False):
+    # Nhiều camera cùng lúc qua bộ lập lịch dùng chung; chạy tới khi người dùng bấm dừng
+    import pandas as pd
+    from app.stream import summarize_stream_stats
+
+    scheduler = get_stream_scheduler(model)
+    names = [scheduler.add_stream(source, track=track, confidence_threshold=confidence_threshold,
+                                  iou_threshold=iou_threshold, clips=clips) for source in sources]
+    # Luồng suy luận có thể đã dừng vì lỗi ở lần chạy trước: khởi động lại và xoá lỗi cũ
+    scheduler.start()
+
+    grid = st.columns(min(len(names), columns))
+    # Mỗi camera có giới hạn FPS xem trước riêng; ảnh được thu nhỏ theo số cột của lưới
+    previews = [PreviewRenderer(grid[index % len(grid)].empty(), max_fps=preview_fps, quality=preview_quality,
+                                width=max(320, 1280 // len(grid)))
+                for index in range(len(names))]
+    table = st.empty()
+    shown = {}
+    last_stats_time = 0
+    try:
+        while not all(scheduler.is_finished(name) for name in names):
+            if scheduler.error is not None:
+                raise scheduler.error
+            for name, preview in zip(names, previews):
+                latest = scheduler.latest(name)
+                if latest is not None and shown.get(name) != latest[0] and preview.show(latest[1], caption=name):
+                    shown[name] = latest[0]
+            if time.time() - last_stats_time >= 1.0:
+                stats = scheduler.stats()
+                table.dataframe(pd.DataFrame([
+                    {'Camera': name, 'FPS': round(stats[name]['fps'], 1),
+                     'Độ trễ (ms)': round(stats[name]['latency_ms']), 'Đã xử lý': stats[name]['analysed'],
+                     'Bỏ qua': stats[name]['dropped'], 'Có mũ': stats[name]['helmet'],
+                     'Không mũ': stats[name]['no_helmet'], 'Ưu tiên': '🔴' if stats[name]['boosted'] else ''}
+                    for name in names if name in stats
+                ]), use_container_width=True)
+                last_stats_time = time.time()
+            time.sleep(0.03)
+    finally:
+        # Camera chỉ bị đóng khi không còn phiên nào xem
+        for name in names:
+            totals = scheduler.remove_stream(name)
+            if totals is not None and totals['frames']:
+                add_report_entry(summarize_stream_stats(totals), 'Camera', name)
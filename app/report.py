@@ -1,12 +1,16 @@
+import csv
+import io
 import pandas as pd
 import streamlit as st
 from datetime import datetime
 
-def add_report_entry(stats, source_type):
-    if 'report_data' not in st.session_state:
-        st.session_state.report_data = []
+from app.violation_store import DB_PATH, ViolationStore
 
-    entry = {
+REPORT_COLUMNS = ['Thời gian', 'Nguồn', 'Tổng đối tượng', 'Có mũ', 'Không mũ',
+                  'Tỷ lệ an toàn (%)', 'FPS', 'Số frame']
+
+def build_report_entry(stats, source_type):
+    return {
         'Thời gian': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         'Nguồn': source_type,
         'Tổng đối tượng': stats.get('total', 0),
@@ -16,9 +20,39 @@ def add_report_entry(stats, source_type):
         'FPS': round(stats.get('fps', 0), 2) if 'fps' in stats else None,
         'Số frame': stats.get('frames', None)
     }
-    st.session_state.report_data.append(entry)
 
-def generate_report():
-    if 'report_data' not in st.session_state or not st.session_state.report_data:
-        return pd.DataFrame()
-    return pd.DataFrame(st.session_state.report_data)
+@st.cache_resource
+def get_store(path=DB_PATH):
+    # Một kết nối dùng chung cho mọi phiên; dữ liệu được lưu lại sau khi phiên kết thúc
+    return ViolationStore(path)
+
+def add_report_entry(stats, source_type, source_name=None):
+    get_store().add_result(stats, source_type, source_name)
+
+def _row_to_entry(row):
+    # Dòng trong kho -> cùng định dạng cột với build_report_entry
+    return {
+        'Thời gian': datetime.fromtimestamp(row['created_at']).strftime("%Y-%m-%d %H:%M:%S"),
+        'Nguồn': row['source_type'],
+        'Tổng đối tượng': row['total'],
+        'Có mũ': row['helmet'],
+        'Không mũ': row['no_helmet'],
+        'Tỷ lệ an toàn (%)': round(row['safety_rate'], 2),
+        'FPS': round(row['fps'], 2) if row['fps'] is not None else None,
+        'Số frame': row['frames']
+    }
+
+def generate_report(page=0, page_size=50):
+    # Chỉ đọc một trang lịch sử thay vì dựng DataFrame từ toàn bộ dữ liệu
+    rows = get_store().page_results(page, page_size)
+    return pd.DataFrame([_row_to_entry(row) for row in rows], columns=REPORT_COLUMNS)
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def export_report_csv(version):
+    # `version` đổi mỗi khi kho có dữ liệu mới nên CSV chỉ được tạo lại khi cần
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=REPORT_COLUMNS)
+    writer.writeheader()
+    for row in get_store().iter_results():
+        writer.writerow(_row_to_entry(row))
+    return buffer.getvalue().encode('utf-8-sig')
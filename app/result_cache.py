@@ -0,0 +1,83 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from app.detections import Detections, filter_detections
+
+# Ngưỡng dùng khi chạy model để lấy kết quả "thô": giữ mọi box từ mức tin cậy
+# thấp nhất của thanh trượt và không loại box nào ở bước NMS
+RAW_CONFIDENCE = 0.1
+RAW_IOU = 1.0
+RAW_MAX_DET = 1000
+
+def image_key(image):
+    # Khoá cache theo nội dung ảnh (kèm kích thước và kiểu dữ liệu)
+    image = np.ascontiguousarray(image)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{image.shape}{image.dtype}".encode())
+    digest.update(memoryview(image).cast('B'))
+    return digest.hexdigest()
+
+class DetectionCache:
+    # Cache LRU có giới hạn số phần tử và dung lượng, lưu kết quả nhận diện thô của từng ảnh
+    def __init__(self, max_entries=64, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()  # cache_resource dùng chung giữa các phiên
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def get(self, key):
+        with self._lock:
+            detections = self._entries.get(key)
+            if detections is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return detections
+
+    def put(self, key, detections):
+        size = detections.boxes.nbytes
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key).boxes.nbytes
+            if size > self.max_bytes:
+                return
+            self._entries[key] = detections
+            self._bytes += size
+            # Loại phần tử ít dùng nhất cho tới khi nằm trong giới hạn
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.boxes.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def detect(self, model, image, confidence_threshold, iou_threshold):
+        # Trả về (kết quả đã lọc, khoá ảnh). Đổi ngưỡng chỉ lọc lại + NMS trên kết quả đã lưu,
+        # không chạy lại model
+        key = image_key(image)
+        if confidence_threshold < RAW_CONFIDENCE:
+            results = model(image, conf=confidence_threshold, iou=iou_threshold, verbose=False)[0]
+            return Detections.from_results(results), key
+
+        raw = self.get(key)
+        if raw is None:
+            results = model(image, conf=RAW_CONFIDENCE, iou=RAW_IOU, max_det=RAW_MAX_DET, verbose=False)[0]
+            raw = Detections.from_results(results)
+            self.put(key, raw)
+        return filter_detections(raw, confidence_threshold, iou_threshold), key
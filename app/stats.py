@@ -0,0 +1,147 @@
+import numpy as np
+
+class StreamingQuantile:
+    # Ước lượng phân vị p theo thuật toán P² (Jain & Chlamtac): chỉ giữ 5 điểm đánh dấu nên bộ nhớ
+    # không đổi dù số mẫu là bao nhiêu
+    def __init__(self, p):
+        self.p = p
+        self.count = 0
+        self.heights = []
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, value):
+        self.count += 1
+        q = self.heights
+        if len(q) < 5:
+            q.append(value)
+            q.sort()
+            return
+
+        if value < q[0]:
+            q[0] = value
+            k = 0
+        elif value >= q[4]:
+            q[4] = value
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= value < q[i + 1])
+
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Dịch 3 điểm giữa về vị trí mong muốn, nội suy parabol (hoặc tuyến tính nếu parabol vượt biên)
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def value(self):
+        if not self.heights:
+            return 0.0
+        if self.count < 5:
+            return float(np.percentile(self.heights, self.p * 100))
+        return float(self.heights[2])
+
+class StatsAccumulator:
+    # Thống kê video/luồng cập nhật dần với bộ nhớ không đổi: tổng số người, tỉ lệ an toàn và tỉ lệ
+    # frame vi phạm, trung bình/phân vị độ trễ, và biểu đồ theo khoảng thời gian có số ô cố định
+    # (hết ô thì gộp từng cặp ô liền nhau và tăng gấp đôi độ rộng mỗi ô).
+    # Đọc được bất cứ lúc nào trong khi đang xử lý.
+    BUCKET_FIELDS = ('frames', 'helmet', 'no_helmet', 'violation_frames')
+
+    def __init__(self, bucket_seconds=10.0, max_buckets=120, quantiles=(0.5, 0.95)):
+        self.frames = 0
+        self.helmet = 0
+        self.no_helmet = 0
+        self.violation_frames = 0  # frame có ít nhất một người không đội mũ
+        self.latency_count = 0
+        self.latency_mean = 0.0
+        self.latency_max = 0.0
+        self.fps_mean = 0.0
+        self.quantiles = {q: StreamingQuantile(q) for q in quantiles}
+        self.bucket_seconds = bucket_seconds
+        self.buckets = np.zeros((max_buckets + max_buckets % 2, len(self.BUCKET_FIELDS)), dtype=np.int64)
+
+    def add(self, frame_stats, latency=None, timestamp=0.0, fps=None):
+        # frame_stats: kết quả draw_boxes/detection_stats; timestamp: giây kể từ đầu video/luồng;
+        # fps mặc định là 1 / latency
+        helmet, no_helmet = frame_stats['helmet'], frame_stats['no_helmet']
+        self.frames += 1
+        self.helmet += helmet
+        self.no_helmet += no_helmet
+        self.violation_frames += no_helmet > 0
+
+        if latency is not None:
+            self.latency_count += 1
+            self.latency_mean += (latency - self.latency_mean) / self.latency_count
+            self.latency_max = max(self.latency_max, latency)
+            for estimator in self.quantiles.values():
+                estimator.add(latency)
+            if fps is None:
+                fps = 1.0 / latency if latency > 0 else 0.0
+        if fps is not None:
+            self.fps_mean += (fps - self.fps_mean) / self.frames
+
+        index = int(max(timestamp, 0) // self.bucket_seconds)
+        while index >= len(self.buckets):
+            self._compact()
+            index = int(max(timestamp, 0) // self.bucket_seconds)
+        self.buckets[index] += (1, helmet, no_helmet, no_helmet > 0)
+
+    def _compact(self):
+        half = len(self.buckets) // 2
+        self.buckets[:half] = self.buckets.reshape(half, 2, -1).sum(axis=1)
+        self.buckets[half:] = 0
+        self.bucket_seconds *= 2
+
+    @property
+    def total(self):
+        return self.helmet + self.no_helmet
+
+    @property
+    def safety_rate(self):
+        return self.helmet / self.total * 100 if self.total > 0 else 0
+
+    @property
+    def violation_rate(self):
+        # % frame đã phân tích có người không đội mũ
+        return self.violation_frames / self.frames * 100 if self.frames > 0 else 0
+
+    def latency_quantile(self, q):
+        return self.quantiles[q].value()
+
+    def summary(self):
+        summary = {
+            'total': self.total,
+            'helmet': self.helmet,
+            'no_helmet': self.no_helmet,
+            'safety_rate': self.safety_rate,
+            'violation_rate': self.violation_rate,
+            'fps': self.fps_mean,
+            'frames': self.frames,
+            'latency_ms': self.latency_mean * 1000,
+            'latency_max_ms': self.latency_max * 1000,
+        }
+        for q, estimator in self.quantiles.items():
+            summary[f'latency_p{round(q * 100)}_ms'] = estimator.value() * 1000
+        return summary
+
+    def histogram(self):
+        # Danh sách ô (giây bắt đầu, frames, helmet, no_helmet, violation_frames) tới ô cuối có dữ liệu
+        used = np.flatnonzero(self.buckets[:, 0])
+        if not len(used):
+            return []
+        return [(index * self.bucket_seconds, *map(int, self.buckets[index]))
+                for index in range(used[-1] + 1)]
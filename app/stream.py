@@ -0,0 +1,359 @@
+import argparse
+import os
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from app.draw_box import draw_boxes
+from app.metrics import METRICS
+from app.processing import infer_batch
+from app.stats import StatsAccumulator
+
+def parse_source(source):
+    # "0", "1"... -> chỉ số webcam; còn lại là URL (rtsp://, http://) hoặc đường dẫn file
+    if isinstance(source, str) and source.strip().isdigit():
+        return int(source)
+    return source
+
+def is_file_source(source):
+    return isinstance(source, str) and os.path.isfile(source)
+
+class LatestFrameGrabber:
+    # Luồng đọc camera liên tục và chỉ giữ frame mới nhất: frame chưa kịp xử lý bị ghi đè
+    # (đếm vào `dropped`) nên độ trễ không tăng dần như khi xếp hàng đợi.
+    # Mất kết nối/hết file thì tự mở lại sau reconnect_delay (tăng dần tới max_reconnect_delay).
+    # realtime=True phát file theo đúng FPS gốc để giả lập camera (mặc định bật khi nguồn là file).
+    # new_frame_event: Event dùng chung để báo có frame mới (vd. cho bộ lập lịch nhiều luồng).
+    def __init__(self, source, realtime=None, reconnect_delay=0.5, max_reconnect_delay=10.0,
+                 max_reconnects=None, new_frame_event=None):
+        self.source = parse_source(source)
+        self.realtime = is_file_source(self.source) if realtime is None else realtime
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.max_reconnects = max_reconnects  # None: thử lại mãi
+        self.new_frame_event = new_frame_event
+
+        self.fps = 0
+        self.grabbed = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self.connected = False
+        self.finished = False
+
+        self._cond = threading.Condition()
+        self._frame = None
+        self._timestamp = 0
+        self._seq = 0
+        self._consumed = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stream-grabber", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _open(self):
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            cap.release()
+            return None
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # giảm bộ đệm của backend (nếu được hỗ trợ)
+        return cap
+
+    def _wait_reconnect(self, delay):
+        if self.max_reconnects is not None and self.reconnects >= self.max_reconnects:
+            return False
+        self.reconnects += 1
+        return not self._stop_event.wait(delay)
+
+    def _run(self):
+        delay = self.reconnect_delay
+        try:
+            while not self._stop_event.is_set():
+                cap = self._open()
+                if cap is None:
+                    if not self._wait_reconnect(delay):
+                        return
+                    delay = min(delay * 2, self.max_reconnect_delay)
+                    continue
+
+                self.connected = True
+                delay = self.reconnect_delay
+                self.fps = cap.get(cv2.CAP_PROP_FPS) or 25
+                interval = 1.0 / self.fps if self.realtime else 0
+                next_time = time.monotonic()
+                try:
+                    while not self._stop_event.is_set():
+                        ret, frame = cap.read()
+                        if not ret:
+                            break
+                        if interval:
+                            # Phát lại file đúng tốc độ gốc; bị chậm thì bắt nhịp lại thay vì chạy bù
+                            next_time = max(next_time + interval, time.monotonic() - interval)
+                            self._stop_event.wait(max(0, next_time - time.monotonic()))
+                        with self._cond:
+                            if self._seq > self._consumed:
+                                self.dropped += 1
+                                METRICS.inc('frames_dropped')
+                            self._frame = frame
+                            self._timestamp = time.time()
+                            self._seq += 1
+                            self.grabbed += 1
+                            self._cond.notify_all()
+                        if self.new_frame_event is not None:
+                            self.new_frame_event.set()
+                finally:
+                    cap.release()
+                    self.connected = False
+
+                if not self._stop_event.is_set() and not self._wait_reconnect(delay):
+                    return
+        finally:
+            with self._cond:
+                self.finished = True
+                self._cond.notify_all()
+            if self.new_frame_event is not None:
+                self.new_frame_event.set()
+
+    def peek(self):
+        # Thời điểm nhận của frame mới nhất chưa đọc (không lấy frame), None nếu chưa có
+        with self._cond:
+            return self._timestamp if self._seq > self._consumed else None
+
+    def read(self, timeout=1.0):
+        # Trả về (seq, thời điểm nhận, frame) mới nhất chưa đọc, hoặc None khi hết thời gian chờ
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > self._consumed or self.finished
+                                or self._stop_event.is_set(), timeout)
+            if self._seq <= self._consumed:
+                return None
+            self._consumed = self._seq
+            return self._seq, self._timestamp, self._frame
+
+class RollingStats:
+    # Thống kê trên cửa sổ trượt `window` giây: FPS xử lý, độ trễ đầu-cuối, số người có/không mũ
+    def __init__(self, window=10.0):
+        self.window = window
+        self.samples = deque()  # (thời điểm, độ trễ, helmet, no_helmet, id có mũ, id không mũ)
+
+    def add(self, latency, frame_stats, results=None, timestamp=None):
+        timestamp = timestamp or time.time()
+        helmet_ids, no_helmet_ids = (), ()
+        boxes = getattr(results, 'boxes', None)
+        if boxes is not None and getattr(boxes, 'id', None) is not None and len(boxes):
+            ids = np.asarray(boxes.id).reshape(-1)
+            cls_ids = np.asarray(boxes.cls).astype(int).reshape(-1)
+            is_helmet = np.array([results.names.get(c) == 'helmet' for c in cls_ids], dtype=bool)
+            helmet_ids, no_helmet_ids = ids[is_helmet].tolist(), ids[~is_helmet].tolist()
+        self.samples.append((timestamp, latency, frame_stats['helmet'], frame_stats['no_helmet'],
+                             helmet_ids, no_helmet_ids))
+        self._expire(timestamp)
+
+    def _expire(self, now):
+        while self.samples and now - self.samples[0][0] > self.window:
+            self.samples.popleft()
+
+    def summary(self, now=None):
+        self._expire(now or time.time())
+        if not self.samples:
+            return {'frames': 0, 'fps': 0.0, 'latency_ms': 0.0, 'latency_p95_ms': 0.0,
+                    'helmet': 0, 'no_helmet': 0}
+
+        times, latencies, helmet, no_helmet, helmet_ids, no_helmet_ids = zip(*self.samples)
+        span = times[-1] - times[0]
+        latencies = np.asarray(latencies) * 1000
+        if any(helmet_ids) or any(no_helmet_ids):
+            # Có tracking: số người duy nhất trong cửa sổ
+            helmet_count = len(set().union(*map(set, helmet_ids)))
+            no_helmet_count = len(set().union(*map(set, no_helmet_ids)))
+        else:
+            # Không tracking: số người trung bình trên mỗi frame
+            helmet_count = round(float(np.mean(helmet)))
+            no_helmet_count = round(float(np.mean(no_helmet)))
+        return {
+            'frames': len(self.samples),
+            'fps': (len(self.samples) - 1) / span if span > 0 else 0.0,
+            'latency_ms': float(latencies.mean()),
+            'latency_p95_ms': float(np.percentile(latencies, 95)),
+            'helmet': helmet_count,
+            'no_helmet': no_helmet_count,
+        }
+
+def analyze_stream(grabber, model, confidence_threshold, iou_threshold, frame_size=(640, 360),
+                   tracker=None, window=10.0, on_frame=None, on_stats=None, stats_interval=1.0,
+                   stop_event=None, duration=None, store=None, source_name="stream", totals=None,
+                   recorder=None):
+    # Vòng lặp xử lý luồng trực tiếp không phụ thuộc giao diện. Mỗi vòng lấy frame mới nhất
+    # nên tốc độ suy luận tự khớp với khả năng của máy. on_frame(seq, annotated_frame) và
+    # on_stats(summary) dùng để hiển thị; dừng khi stop_event được set, hết `duration` giây
+    # hoặc grabber không kết nối lại được. `totals` (nếu truyền vào) được cập nhật dần nên bên gọi
+    # vẫn có kết quả khi vòng lặp bị ngắt giữa chừng (vd. Streamlit chạy lại script).
+    # recorder: app.clips.ClipRecorder nhận các frame đã phân tích để cắt clip quanh mỗi vi phạm.
+    rolling = RollingStats(window)
+    totals = {} if totals is None else totals
+    totals.update(frames=0, aggregate=StatsAccumulator(), start_time=time.time())
+
+    try:
+        _stream_loop(grabber, model, confidence_threshold, iou_threshold, frame_size, tracker, rolling,
+                     totals, on_frame, on_stats, stats_interval, stop_event, duration, store, source_name,
+                     recorder)
+    finally:
+        totals['processing_time'] = time.time() - totals['start_time']
+        totals['grabbed'] = grabber.grabbed
+        totals['dropped'] = grabber.dropped
+        totals['reconnects'] = grabber.reconnects
+        totals['rolling'] = rolling.summary()
+        if tracker is not None:
+            totals['tracks'] = tracker.summary()
+        if store is not None:
+            if tracker is not None:
+                store.add_tracks(source_name, tracker.confirmed_tracks(final=True), tracker.names,
+                                 totals['start_time'])
+            store.flush()
+        if recorder is not None:
+            recorder.close()
+            totals['clips'] = recorder.summary()
+    return totals
+
+def _stream_loop(grabber, model, confidence_threshold, iou_threshold, frame_size, tracker, rolling,
+                 totals, on_frame, on_stats, stats_interval, stop_event, duration, store, source_name,
+                 recorder):
+    last_stats_time = 0
+    while not (stop_event is not None and stop_event.is_set()):
+        if duration is not None and time.time() - totals['start_time'] >= duration:
+            break
+        item = grabber.read(timeout=0.5)
+        if item is None:
+            if grabber.finished:
+                break
+            # Chưa kết nối được / đang kết nối lại: vẫn báo trạng thái để giao diện không đứng im
+            if on_stats is not None and time.time() - last_stats_time >= stats_interval:
+                on_stats(_status_summary(grabber, rolling))
+                last_stats_time = time.time()
+            continue
+
+        seq, captured_at, frame = item
+        with METRICS.timer('resize'):
+            resized_frame = cv2.resize(frame, frame_size)
+        results = infer_batch(model, [resized_frame], confidence_threshold, iou_threshold)[0]
+        if tracker is not None:
+            results = tracker.update(seq, results, captured_at)
+        if recorder is not None:
+            recorder.add(seq, resized_frame, results)
+        annotated_frame, frame_stats = draw_boxes(resized_frame.copy(), results,
+                                                  totals['frames'] / max(time.time() - totals['start_time'], 1e-6))
+        if store is not None:
+            store.add_frame_detections(source_name, seq, results, captured_at)
+            if tracker is not None and tracker.ended:
+                store.add_tracks(source_name, tracker.confirmed_tracks(), tracker.names, totals['start_time'])
+
+        # Độ trễ đầu-cuối: từ lúc frame được nhận tới lúc vẽ xong
+        latency = time.time() - captured_at
+        rolling.add(latency, frame_stats, results)
+        totals['frames'] += 1
+        METRICS.inc('frames_processed')
+        totals['aggregate'].add(frame_stats, latency, captured_at - totals['start_time'])
+
+        if on_frame is not None:
+            on_frame(seq, annotated_frame)
+        if on_stats is not None and time.time() - last_stats_time >= stats_interval:
+            on_stats(_status_summary(grabber, rolling))
+            last_stats_time = time.time()
+
+def _status_summary(grabber, rolling):
+    summary = rolling.summary()
+    summary.update(dropped=grabber.dropped, reconnects=grabber.reconnects, connected=grabber.connected,
+                   max_reconnects=grabber.max_reconnects)
+    return summary
+
+def summarize_stream_stats(totals):
+    # Cùng khoá với summarize_video_stats để ghi chung vào lịch sử
+    aggregate = totals['aggregate']
+    if 'tracks' in totals:
+        helmet, no_helmet = totals['tracks']['helmet'], totals['tracks']['no_helmet']
+    else:
+        helmet, no_helmet = aggregate.helmet, aggregate.no_helmet
+    total = helmet + no_helmet
+    elapsed = totals['processing_time']
+    return {
+        'total': total,
+        'helmet': helmet,
+        'no_helmet': no_helmet,
+        'safety_rate': (helmet / total * 100) if total > 0 else 0,
+        'violation_rate': aggregate.violation_rate,
+        'fps': totals['frames'] / elapsed if elapsed > 0 else 0,
+        'frames': totals['frames'],
+        'latency_p95_ms': aggregate.latency_quantile(0.95) * 1000,
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Nhận diện mũ bảo hiểm trên luồng camera (RTSP/HTTP/webcam)")
+    parser.add_argument("source", help="URL luồng, chỉ số webcam (0, 1...) hoặc file video (phát lại đúng FPS)")
+    parser.add_argument("--weights", default=None, help="Đường dẫn model (mặc định: theo HELMET_MODEL_VARIANT)")
+    parser.add_argument("--backend", default=None, help="Backend suy luận")
+    parser.add_argument("--stub", action="store_true", help="Dùng model giả của benchmark (không cần weights)")
+    parser.add_argument("--conf", type=float, default=0.5, help="Ngưỡng tin cậy")
+    parser.add_argument("--iou", type=float, default=0.4, help="Ngưỡng IoU")
+    parser.add_argument("--track", action="store_true", help="Đếm mỗi người một lần theo track")
+    parser.add_argument("--window", type=float, default=10.0, help="Độ dài cửa sổ thống kê (giây)")
+    parser.add_argument("--duration", type=float, default=None, help="Dừng sau số giây này")
+    parser.add_argument("--max-reconnects", type=int, default=None, help="Số lần kết nối lại tối đa")
+    parser.add_argument("--clips", action="store_true", help="Lưu clip ngắn quanh mỗi vi phạm vào reports/clips")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    from app.clips import ClipRecorder, stream_clip_prefix
+    from app.tracker import IouTracker
+
+    args = parse_args(argv)
+    if args.stub:
+        from app.benchmark import StubModel
+        model = StubModel(latency=0.03)
+    else:
+        from app.load_model import MODEL_BACKEND, build_default_model, build_model
+        backend = args.backend or MODEL_BACKEND
+        model = build_model(args.weights, backend) if args.weights else build_default_model(backend)
+
+    def print_stats(summary):
+        print(f"fps={summary['fps']:.1f} latency={summary['latency_ms']:.0f}ms "
+              f"(p95 {summary['latency_p95_ms']:.0f}ms) helmet={summary['helmet']} "
+              f"no_helmet={summary['no_helmet']} dropped={summary['dropped']} "
+              f"reconnects={summary['reconnects']}", flush=True)
+
+    # File cục bộ không có "luồng" nào để chờ: mặc định chỉ phát một lần
+    max_reconnects = args.max_reconnects
+    if max_reconnects is None and is_file_source(args.source):
+        max_reconnects = 0
+    grabber = LatestFrameGrabber(args.source, max_reconnects=max_reconnects)
+    recorder = None
+    if args.clips:
+        recorder = ClipRecorder(source_name=args.source, file_prefix=stream_clip_prefix(args.source))
+    try:
+        with grabber:
+            totals = analyze_stream(grabber, model, args.conf, args.iou,
+                                    tracker=IouTracker() if args.track else None, window=args.window,
+                                    on_stats=print_stats, duration=args.duration, recorder=recorder)
+    except KeyboardInterrupt:
+        return 0
+    print(summarize_stream_stats(totals))
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,142 @@
+import cv2
+import numpy as np
+
+from app.detections import Detections, batched_nms, box_ios, filter_detections
+
+def parse_polygons(text):
+    # "x,y;x,y;x,y | x,y;..." -> danh sách đa giác. Toạ độ <= 1 được hiểu là tỉ lệ theo kích thước frame,
+    # còn lại là pixel của frame gốc.
+    polygons = []
+    for part in text.split("|"):
+        points = [tuple(float(value) for value in point.split(",")) for point in part.split(";") if point.strip()]
+        if not points:
+            continue
+        if len(points) < 3 or any(len(point) != 2 for point in points):
+            raise ValueError(f"Đa giác không hợp lệ: {part.strip()}")
+        polygons.append(points)
+    return polygons
+
+class RegionOfInterest:
+    # Vùng quan tâm gồm một hay nhiều đa giác: cắt frame theo khung bao quanh các đa giác và tô đen
+    # phần nằm ngoài, để model không tốn thời gian cho trời, nhà cửa...
+    def __init__(self, polygons):
+        if isinstance(polygons, str):
+            polygons = parse_polygons(polygons)
+        self.polygons = [np.asarray(polygon, dtype=np.float32) for polygon in polygons]
+        self._cache = {}  # (h, w) -> (mask đã cắt, khung bao)
+
+    def _points(self, shape):
+        height, width = shape[:2]
+        for polygon in self.polygons:
+            if polygon.max() <= 1:
+                polygon = polygon * [width, height]
+            yield np.round(polygon).astype(np.int32)
+
+    def region(self, shape):
+        # (mask của phần được giữ trong khung bao, (x0, y0, x1, y1)); tính một lần cho mỗi kích thước frame
+        key = tuple(shape[:2])
+        if key not in self._cache:
+            mask = np.zeros(key, dtype=np.uint8)
+            cv2.fillPoly(mask, list(self._points(shape)), 255)
+            ys, xs = np.nonzero(mask.any(axis=1))[0], np.nonzero(mask.any(axis=0))[0]
+            if len(xs) == 0:
+                raise ValueError("Vùng quan tâm nằm ngoài frame")
+            x0, y0, x1, y1 = int(xs[0]), int(ys[0]), int(xs[-1]) + 1, int(ys[-1]) + 1
+            roi_mask = mask[y0:y1, x0:x1]
+            self._cache[key] = (None if roi_mask.all() else roi_mask, (x0, y0, x1, y1))
+        return self._cache[key]
+
+    def crop(self, frame):
+        # Trả về (ảnh đã cắt và che, (x0, y0)) — ảnh chỉ được sao chép khi cần che
+        mask, (x0, y0, x1, y1) = self.region(frame.shape)
+        cropped = frame[y0:y1, x0:x1]
+        if mask is not None:
+            cropped = cv2.bitwise_and(cropped, cropped, mask=mask)
+        return cropped, (x0, y0)
+
+    def contains(self, xyxy, shape):
+        # Box có tâm nằm trong vùng quan tâm (toạ độ frame gốc)
+        mask, (x0, y0, x1, y1) = self.region(shape)
+        centers = np.stack([(xyxy[:, 0] + xyxy[:, 2]) / 2, (xyxy[:, 1] + xyxy[:, 3]) / 2], axis=1).astype(int)
+        inside = (centers[:, 0] >= x0) & (centers[:, 0] < x1) & (centers[:, 1] >= y0) & (centers[:, 1] < y1)
+        if mask is not None and inside.any():
+            inside[inside] = mask[centers[inside, 1] - y0, centers[inside, 0] - x0] > 0
+        return inside
+
+def tile_grid(width, height, tile_size=640, overlap=0.2):
+    # Toạ độ (x0, y0, x1, y1) của các tile vuông chồng lên nhau phủ kín ảnh; tile cuối được dịch
+    # vào trong để không vượt ra ngoài ảnh
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        stride = max(1, int(tile_size * (1 - overlap)))
+        positions = list(range(0, length - tile_size, stride))
+        return positions + [length - tile_size]
+
+    return [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+            for y in starts(height) for x in starts(width)]
+
+class RegionDetector:
+    # Bọc model: cắt theo vùng quan tâm rồi (tuỳ chọn) chia vùng đó ở độ phân giải gốc thành các
+    # tile tile_size px chồng lên nhau, chạy các tile theo batch, đưa box về toạ độ frame và gộp
+    # các box trùng giữa các tile bằng NMS theo IoS. full_frame_pass thêm một lượt trên cả vùng
+    # (thu nhỏ) để không bỏ sót đối tượng lớn bị chia cắt.
+    # Có cùng giao diện với model (model(frame, conf=..., iou=...)) nên dùng được cho mọi vòng lặp.
+    full_resolution = True  # các vòng lặp video đưa frame gốc thay vì frame đã thu nhỏ
+
+    def __init__(self, model, roi=None, tile_size=None, overlap=0.2, max_batch=8, full_frame_pass=True,
+                 merge_threshold=0.6):
+        self.model = model
+        self.roi = RegionOfInterest(roi) if isinstance(roi, (str, list)) else roi
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.max_batch = max(1, int(max_batch))
+        self.full_frame_pass = full_frame_pass
+        self.merge_threshold = merge_threshold
+        self.tiles = 0  # tổng số tile đã chạy (để theo dõi chi phí)
+
+    @property
+    def names(self):
+        return self.model.names
+
+    @property
+    def variant(self):
+        return getattr(self.model, 'variant', None)
+
+    def _predict(self, images, **kwargs):
+        detections = []
+        for start in range(0, len(images), self.max_batch):
+            chunk = images[start:start + self.max_batch]
+            source = chunk[0] if len(chunk) == 1 else chunk
+            detections.extend(Detections.from_results(result) for result in self.model(source, **kwargs))
+        self.tiles += len(images)
+        return detections
+
+    def detect(self, frame, conf=0.25, iou=0.7, **kwargs):
+        kwargs.update(conf=conf, iou=iou, verbose=False)
+        region, (offset_x, offset_y) = self.roi.crop(frame) if self.roi is not None else (frame, (0, 0))
+        height, width = region.shape[:2]
+
+        if self.tile_size is None or (width <= self.tile_size and height <= self.tile_size):
+            boxes = [(0, 0, width, height)]
+        else:
+            boxes = tile_grid(width, height, self.tile_size, self.overlap)
+            if self.full_frame_pass:
+                boxes.append((0, 0, width, height))
+        tiles = [region[y0:y1, x0:x1] for x0, y0, x1, y1 in boxes]
+
+        detections = [d.scaled(1, 1, x0 + offset_x, y0 + offset_y)
+                      for d, (x0, y0, _, _) in zip(self._predict(tiles, **kwargs), boxes)]
+        merged = Detections.concatenate(detections, self.names, frame.shape[:2])
+        if len(merged) and self.roi is not None:
+            merged = merged.select(np.flatnonzero(self.roi.contains(merged.boxes.xyxy, frame.shape)))
+        if len(boxes) > 1 and len(merged):
+            # Gộp box trùng giữa các tile rồi NMS thường theo ngưỡng của người dùng
+            keep = batched_nms(merged.boxes.xyxy, merged.boxes.conf, merged.boxes.cls,
+                               self.merge_threshold, metric=box_ios)
+            merged = filter_detections(merged.select(keep), conf, iou, kwargs.get('max_det', 300))
+        return merged
+
+    def __call__(self, source, conf=0.25, iou=0.7, **kwargs):
+        images = source if isinstance(source, (list, tuple)) else [source]
+        return [self.detect(image, conf, iou, **kwargs) for image in images]
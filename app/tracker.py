@@ -0,0 +1,170 @@
+from collections import defaultdict, deque
+
+import numpy as np
+
+from app.detections import Detections, box_iou, to_numpy
+
+class Track:
+    def __init__(self, track_id, box, cls_id, conf, frame_count, timestamp=None):
+        self.id = track_id
+        self.box = box
+        self.velocity = np.zeros(4, dtype=np.float32)  # px/frame cho từng toạ độ
+        self.conf = conf
+        self.first_frame = frame_count
+        self.first_seen = timestamp  # thời điểm (epoch) lần đầu thấy, nếu bên gọi cung cấp
+        self.last_frame = frame_count
+        self.hits = 0
+        self.class_scores = defaultdict(float)
+        self._vote(cls_id, conf)
+
+    def _vote(self, cls_id, conf):
+        self.class_scores[cls_id] += conf
+        self.hits += 1
+
+    @property
+    def cls_id(self):
+        # Lớp của track = lớp có tổng độ tin cậy lớn nhất qua các lần thấy
+        return max(self.class_scores, key=self.class_scores.get)
+
+    def predict(self, frame_count):
+        return self.box + self.velocity * (frame_count - self.last_frame)
+
+    def update(self, box, cls_id, conf, frame_count, smoothing=0.5):
+        elapsed = frame_count - self.last_frame
+        if elapsed > 0:
+            velocity = (box - self.box) / elapsed
+            self.velocity = smoothing * velocity + (1 - smoothing) * self.velocity
+        self.box = box
+        self.conf = conf
+        self.last_frame = frame_count
+        self._vote(cls_id, conf)
+
+class IouTracker:
+    # Tracker kiểu SORT rút gọn chỉ dùng NumPy: dự đoán vị trí bằng vận tốc không đổi, ghép
+    # detection với track theo IoU (dự phòng bằng khoảng cách tâm khi frame thưa), đếm mỗi
+    # người một lần theo track thay vì cộng dồn theo từng frame.
+    # Track đã kết thúc không được giữ lại (luồng trực tiếp chạy không giới hạn): chỉ cộng vào bộ
+    # đếm theo lớp, và nằm trong `ended` cho tới khi bên gọi lấy ra bằng confirmed_tracks() để ghi
+    # vào kho lưu trữ (không ai lấy thì chỉ giữ max_ended track gần nhất).
+    def __init__(self, iou_threshold=0.3, max_age=30, min_hits=2, max_center_distance=0.75, max_ended=1000):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age  # số frame tối đa track được giữ khi không thấy lại
+        self.min_hits = min_hits  # số lần thấy tối thiểu để track được tính
+        self.max_center_distance = max_center_distance  # theo đường chéo box
+        self.tracks = []
+        self.ended = deque(maxlen=max_ended)  # track đã xác nhận, kết thúc từ lần lấy trước
+        self.counts = defaultdict(int)  # tên lớp -> số track đã xác nhận và đã kết thúc
+        self.names = {}
+        self._next_id = 1
+
+    def _match(self, predicted, boxes):
+        # Ghép tham lam theo điểm giảm dần; điểm theo tâm luôn thấp hơn mọi cặp đạt ngưỡng IoU
+        if len(predicted) == 0 or len(boxes) == 0:
+            return []
+
+        scores = box_iou(predicted, boxes)
+        track_centers = (predicted[:, :2] + predicted[:, 2:]) / 2
+        box_centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+        diagonals = np.hypot(predicted[:, 2] - predicted[:, 0], predicted[:, 3] - predicted[:, 1])
+        distance = np.linalg.norm(track_centers[:, None] - box_centers[None], axis=2) / np.maximum(diagonals[:, None], 1)
+        center_scores = self.iou_threshold * (1 - distance / self.max_center_distance) * 0.99
+        scores = np.where(scores >= self.iou_threshold, scores, np.maximum(center_scores, 0))
+
+        # Ghép theo vòng: cặp vừa là điểm cao nhất của hàng vừa của cột luôn được chọn bởi ghép tham
+        # lam, nên mỗi vòng ghép hết các cặp này bằng phép toán trên mảng rồi loại hàng/cột đã dùng
+        # (thường 1-3 vòng) thay vì duyệt từng cặp bằng Python
+        matches = []
+        track_indices = np.arange(len(predicted))
+        while True:
+            best_box = scores.argmax(axis=1)
+            best_track = scores.argmax(axis=0)
+            mutual = (best_track[best_box] == track_indices) & (scores[track_indices, best_box] > 0)
+            if not mutual.any():
+                break
+            tracks, boxes_matched = track_indices[mutual], best_box[mutual]
+            matches.extend(zip(tracks.tolist(), boxes_matched.tolist()))
+            scores[tracks, :] = 0
+            scores[:, boxes_matched] = 0
+        return matches
+
+    def update(self, frame_count, results, timestamp=None):
+        # Cập nhật tracker với kết quả của một frame đã phân tích, trả về Detections kèm id track.
+        # timestamp: thời điểm của frame, lưu vào track mới để thống kê theo giờ
+        self.names = results.names
+        if results.boxes is None or len(results.boxes) == 0:
+            xyxy, confs, cls_ids = np.empty((0, 4), np.float32), np.empty(0), np.empty(0, int)
+        else:
+            xyxy = to_numpy(results.boxes.xyxy).astype(np.float32).reshape(-1, 4)
+            confs = to_numpy(results.boxes.conf).astype(float).reshape(-1)
+            cls_ids = to_numpy(results.boxes.cls).astype(int).reshape(-1)
+
+        predicted = np.array([track.predict(frame_count) for track in self.tracks], dtype=np.float32).reshape(-1, 4)
+        ids = np.zeros(len(xyxy), dtype=int)
+
+        matched = set()
+        for t, d in self._match(predicted, xyxy):
+            track = self.tracks[t]
+            track.update(xyxy[d], cls_ids[d], confs[d], frame_count)
+            ids[d] = track.id
+            matched.add(d)
+
+        for d in range(len(xyxy)):
+            if d not in matched:
+                track = Track(self._next_id, xyxy[d], cls_ids[d], confs[d], frame_count, timestamp)
+                self._next_id += 1
+                self.tracks.append(track)
+                ids[d] = track.id
+
+        # Track không còn được thấy quá max_age frame thì kết thúc
+        alive = []
+        for track in self.tracks:
+            if frame_count - track.last_frame <= self.max_age:
+                alive.append(track)
+            else:
+                self._end(track)
+        self.tracks = alive
+
+        return Detections(xyxy, confs, cls_ids, self.names, getattr(results, 'orig_shape', None),
+                          getattr(results, 'speed', None), ids=ids)
+
+    def predict(self, frame_count):
+        # Vị trí dự đoán của các track đang hoạt động cho frame không được phân tích
+        tracks = [track for track in self.tracks if track.hits >= self.min_hits or track.last_frame == frame_count]
+        if not tracks:
+            return Detections(np.empty((0, 4)), np.empty(0), np.empty(0), self.names, ids=np.empty(0, int))
+        return Detections(np.array([track.predict(frame_count) for track in tracks]),
+                          [track.conf for track in tracks], [track.cls_id for track in tracks],
+                          self.names, ids=[track.id for track in tracks])
+
+    def _class_name(self, track):
+        return self.names.get(track.cls_id, str(track.cls_id))
+
+    def _end(self, track):
+        # Track chưa đủ min_hits lần thấy bị bỏ luôn
+        if track.hits >= self.min_hits:
+            self.counts[self._class_name(track)] += 1
+            self.ended.append(track)
+
+    def confirmed_tracks(self, final=False):
+        # Lấy ra các track đã xác nhận kết thúc từ lần gọi trước (để ghi vào kho lưu trữ).
+        # final=True khi hết video/luồng: kết thúc luôn các track đang hoạt động.
+        if final:
+            for track in self.tracks:
+                self._end(track)
+            self.tracks = []
+        tracks = list(self.ended)
+        self.ended.clear()
+        return tracks
+
+    def summary(self):
+        # Số đối tượng duy nhất theo lớp (chỉ tính track đã xác nhận), gồm cả track đang hoạt động
+        counts = defaultdict(int, self.counts)
+        for track in self.tracks:
+            if track.hits >= self.min_hits:
+                counts[self._class_name(track)] += 1
+        total = sum(counts.values())
+        return {
+            'tracks': total,
+            'helmet': counts['helmet'],
+            'no_helmet': total - counts['helmet'],
+        }
@@ -0,0 +1,238 @@
+import os
+import sqlite3
+import threading
+import time
+
+from app.detections import to_numpy
+from app.metrics import METRICS
+
+DB_PATH = os.environ.get("HELMET_DB_PATH", "data/violations.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    source_type TEXT NOT NULL,
+    source_name TEXT,
+    total INTEGER NOT NULL,
+    helmet INTEGER NOT NULL,
+    no_helmet INTEGER NOT NULL,
+    safety_rate REAL NOT NULL,
+    fps REAL,
+    frames INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_results_created ON results (created_at);
+CREATE INDEX IF NOT EXISTS idx_results_source ON results (source_type, created_at);
+
+CREATE TABLE IF NOT EXISTS detections (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    source TEXT NOT NULL,
+    frame INTEGER NOT NULL,
+    track_id INTEGER,
+    class_name TEXT NOT NULL,
+    conf REAL NOT NULL,
+    x1 REAL, y1 REAL, x2 REAL, y2 REAL
+);
+CREATE INDEX IF NOT EXISTS idx_detections_ts ON detections (ts);
+CREATE INDEX IF NOT EXISTS idx_detections_source ON detections (source, ts);
+CREATE INDEX IF NOT EXISTS idx_detections_class ON detections (class_name, ts);
+
+CREATE TABLE IF NOT EXISTS tracks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    source TEXT NOT NULL,
+    track_id INTEGER NOT NULL,
+    class_name TEXT NOT NULL,
+    first_frame INTEGER NOT NULL,
+    last_frame INTEGER NOT NULL,
+    hits INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tracks_ts ON tracks (ts);
+CREATE INDEX IF NOT EXISTS idx_tracks_source ON tracks (source, ts);
+CREATE INDEX IF NOT EXISTS idx_tracks_class ON tracks (class_name, ts);
+"""
+
+RESULT_FIELDS = ['id', 'created_at', 'source_type', 'source_name', 'total', 'helmet', 'no_helmet',
+                 'safety_rate', 'fps', 'frames']
+
+class ViolationStore:
+    # Kho lưu kết quả nhận diện trên SQLite: chỉ ghi thêm, ghi theo lô, có chỉ mục theo
+    # thời gian/nguồn/lớp để truy vấn phân trang và thống kê mà không cần nạp hết vào pandas
+    def __init__(self, path=DB_PATH, batch_size=500):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.batch_size = batch_size
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._pending_detections = []
+        self._pending_tracks = []
+
+    # ---------------------------- Ghi ----------------------------
+    @METRICS.timed('report')
+    def add_result(self, stats, source_type, source_name=None, created_at=None):
+        row = (created_at or time.time(), source_type, source_name, int(stats.get('total', 0)),
+               int(stats.get('helmet', 0)), int(stats.get('no_helmet', 0)),
+               float(stats.get('safety_rate', 0)),
+               float(stats['fps']) if stats.get('fps') is not None else None, stats.get('frames'))
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO results (created_at, source_type, source_name, total, helmet, no_helmet, "
+                "safety_rate, fps, frames) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+            return cursor.lastrowid
+
+    @METRICS.timed('report')
+    def add_frame_detections(self, source, frame_index, results, timestamp=None):
+        # Thêm các box của một frame vào hàng chờ; ghi xuống DB khi đủ batch_size dòng
+        boxes = results.boxes
+        if boxes is None or len(boxes) == 0:
+            return
+        timestamp = timestamp or time.time()
+        xyxy = to_numpy(boxes.xyxy).reshape(-1, 4).tolist()
+        confs = to_numpy(boxes.conf).reshape(-1).tolist()
+        cls_ids = to_numpy(boxes.cls).reshape(-1).astype(int).tolist()
+        track_ids = getattr(boxes, 'id', None)
+        track_ids = [None] * len(confs) if track_ids is None else to_numpy(track_ids).astype(int).tolist()
+
+        rows = [(timestamp, source, frame_index, track_id, results.names[cls_id], conf, *box)
+                for box, conf, cls_id, track_id in zip(xyxy, confs, cls_ids, track_ids)]
+        with self._lock:
+            self._pending_detections.extend(rows)
+            if len(self._pending_detections) >= self.batch_size:
+                self._flush_locked()
+
+    @METRICS.timed('report')
+    def add_tracks(self, source, tracks, names, timestamp=None):
+        # Mỗi track lưu thời điểm được thấy lần đầu; timestamp chỉ dùng cho track không có thông tin này
+        timestamp = timestamp or time.time()
+        rows = [(track.first_seen if track.first_seen is not None else timestamp, source, int(track.id),
+                 names.get(track.cls_id, str(track.cls_id)), int(track.first_frame), int(track.last_frame),
+                 int(track.hits)) for track in tracks]
+        with self._lock:
+            self._pending_tracks.extend(rows)
+            if len(self._pending_tracks) >= self.batch_size:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        with self._conn:
+            if self._pending_detections:
+                self._conn.executemany(
+                    "INSERT INTO detections (ts, source, frame, track_id, class_name, conf, x1, y1, x2, y2) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self._pending_detections)
+            if self._pending_tracks:
+                self._conn.executemany(
+                    "INSERT INTO tracks (ts, source, track_id, class_name, first_frame, last_frame, hits) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", self._pending_tracks)
+        self._pending_detections = []
+        self._pending_tracks = []
+
+    @METRICS.timed('report')
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._pending_detections = []
+            self._pending_tracks = []
+            for table in ('results', 'detections', 'tracks'):
+                self._conn.execute(f"DELETE FROM {table}")
+
+    # ---------------------------- Đọc ----------------------------
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _where(source_type=None, since=None, until=None, time_column='created_at', source_column='source_type'):
+        clauses, params = [], []
+        if source_type is not None:
+            clauses.append(f"{source_column} = ?")
+            params.append(source_type)
+        if since is not None:
+            clauses.append(f"{time_column} >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append(f"{time_column} < ?")
+            params.append(until)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def version(self):
+        # Thay đổi mỗi khi có kết quả mới/xoá lịch sử; dùng làm khoá cache
+        return tuple(self._query("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM results")[0])
+
+    def count_results(self, source_type=None):
+        where, params = self._where(source_type)
+        return self._query(f"SELECT COUNT(*) FROM results{where}", params)[0][0]
+
+    def page_results(self, page=0, page_size=50, source_type=None):
+        # Một trang kết quả, mới nhất trước (dùng chỉ mục created_at)
+        where, params = self._where(source_type)
+        rows = self._query(f"SELECT {', '.join(RESULT_FIELDS)} FROM results{where} "
+                           f"ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?",
+                           params + [page_size, page * page_size])
+        return [dict(zip(RESULT_FIELDS, row)) for row in rows]
+
+    def iter_results(self, source_type=None, chunk_size=1000):
+        # Duyệt toàn bộ kết quả theo từng khối (xuất CSV) mà không giữ hết trong bộ nhớ
+        last_id = 0
+        while True:
+            where, params = self._where(source_type)
+            where = where + (" AND" if where else " WHERE") + " id > ?"
+            rows = self._query(f"SELECT {', '.join(RESULT_FIELDS)} FROM results{where} ORDER BY id LIMIT ?",
+                               params + [last_id, chunk_size])
+            if not rows:
+                return
+            for row in rows:
+                yield dict(zip(RESULT_FIELDS, row))
+            last_id = rows[-1][0]
+
+    # Mỗi lần chạy hoặc có tracker (box có track_id, người được lưu trong bảng tracks) hoặc không.
+    # Đơn vị 'mixed' cộng track (mỗi người một lần) với box của các lần chạy không tracking, nên
+    # khoảng thời gian có cả hai loại (vd. bật tracking giữa chừng) không bỏ sót phần nào.
+    _UNIT_TABLES = {
+        'tracks': [('tracks', '')],
+        'detections': [('detections', '')],
+        'mixed': [('tracks', ''), ('detections', ' AND track_id IS NULL')],
+    }
+
+    def default_unit(self, since=None, until=None, source=None):
+        # Đơn vị mà violations_per_hour/class_totals dùng khi unit=None, để hiển thị cho người xem:
+        # 'tracks' nếu chỉ có dữ liệu tracking, 'detections' nếu không có, 'mixed' nếu có cả hai
+        where, params = self._where(source, since, until, time_column='ts', source_column='source')
+        untracked_where = where + (" AND" if where else " WHERE") + " track_id IS NULL"
+        tracked = bool(self._query(f"SELECT 1 FROM tracks{where} LIMIT 1", params))
+        untracked = bool(self._query(f"SELECT 1 FROM detections{untracked_where} LIMIT 1", params))
+        if tracked and untracked:
+            return 'mixed'
+        return 'tracks' if tracked else 'detections'
+
+    def _count_by(self, key, unit, since, until, source, violations_only):
+        # Đếm theo biểu thức `key` trên các bảng của đơn vị (UNION ALL) rồi cộng lại
+        where, params = self._where(source, since, until, time_column='ts', source_column='source')
+        if violations_only:
+            where = where + (" AND" if where else " WHERE") + " class_name != 'helmet'"
+        parts = [f"SELECT {key} AS key, COUNT(*) AS n FROM {table}"
+                 + (where + extra if where else extra.replace(" AND", " WHERE", 1)) + " GROUP BY key"
+                 for table, extra in self._UNIT_TABLES[unit]]
+        rows = self._query(f"SELECT key, SUM(n) FROM ({' UNION ALL '.join(parts)}) GROUP BY key ORDER BY key",
+                           params * len(parts))
+        return [(key, count) for key, count in rows]
+
+    def violations_per_hour(self, since=None, until=None, source=None, unit=None):
+        # Số vi phạm (mọi lớp khác helmet, như draw_boxes) theo giờ, tính ngay trong SQLite.
+        # unit='tracks': mỗi người một lần; unit='detections': mỗi box trên từng frame;
+        # None/'mixed': track của lần chạy có tracking + box của lần chạy không tracking
+        return self._count_by("strftime('%Y-%m-%d %H:00', ts, 'unixepoch', 'localtime')", unit or 'mixed',
+                              since, until, source, violations_only=True)
+
+    def class_totals(self, since=None, until=None, source=None, unit=None):
+        return dict(self._count_by("class_name", unit or 'mixed', since, until, source, violations_only=False))
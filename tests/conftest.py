@@ -0,0 +1,41 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+# Cho phép import package app khi chạy `pytest` từ thư mục gốc của repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.detections import Detections
+
+NAMES = {0: 'helmet', 1: 'no_helmet'}
+
+class CountingModel:
+    # Model giả: mỗi frame một box no_helmet, ghi lại kích thước từng lần gọi để kiểm tra gom batch
+    def __init__(self, fail_on_call=None):
+        self.calls = []
+        self.fail_on_call = fail_on_call
+
+    def __call__(self, source, conf=0.25, iou=0.7, verbose=False):
+        frames = source if isinstance(source, list) else [source]
+        self.calls.append(len(frames))
+        if self.fail_on_call is not None and len(self.calls) >= self.fail_on_call:
+            raise RuntimeError("model lỗi")
+        return [Detections(np.array([[10, 10, 50, 60]], np.float32), [0.9], [1], NAMES, frame.shape[:2])
+                for frame in frames]
+
+@pytest.fixture
+def model():
+    return CountingModel()
+
+@pytest.fixture
+def video_path(tmp_path):
+    # Video 30 frame, mỗi frame tô một màu khác nhau để kiểm tra thứ tự frame
+    path = str(tmp_path / "video.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 25, (320, 240))
+    for index in range(30):
+        writer.write(np.full((240, 320, 3), index * 8, np.uint8))
+    writer.release()
+    return path
@@ -0,0 +1,36 @@
+import numpy as np
+
+from app.decode import open_video
+from app.processing import FrameBatcher, iter_video_results
+
+def test_batcher_waits_for_full_batch():
+    batcher = FrameBatcher(batch_size=3, max_wait=None)
+    for frame_count in (1, 2):
+        batcher.add(frame_count, np.zeros((36, 64, 3), np.uint8), True)
+    assert not batcher.is_ready()
+    batcher.add(3, np.zeros((36, 64, 3), np.uint8), True)
+    assert batcher.is_ready()
+
+def test_flush_runs_one_batch_and_keeps_frame_order(model):
+    batcher = FrameBatcher(batch_size=4, max_wait=None)
+    for frame_count in range(1, 7):
+        # Frame lẻ được phân tích, frame chẵn bị bỏ qua
+        batcher.add(frame_count, np.full((36, 64, 3), frame_count, np.uint8), frame_count % 2 == 1)
+    output = batcher.flush(model, 0.5, 0.4)
+    assert model.calls == [3]
+    assert [frame_count for frame_count, *_ in output] == list(range(1, 7))
+    assert [results is not None for _, _, results, _ in output] == [True, False] * 3
+    assert batcher.items == [] and batcher.sampled == 0
+
+def test_only_skipped_frames_are_ready_immediately():
+    batcher = FrameBatcher(batch_size=8, max_wait=None)
+    batcher.add(1, None, False)
+    assert batcher.is_ready()
+
+def test_end_of_stream_flushes_partial_batch(model, video_path):
+    # 30 frame, phân tích 1/3 frame, batch 4: batch cuối chỉ có 2 frame nhưng vẫn phải được chạy
+    output = list(iter_video_results(open_video(video_path), model, 0.5, 0.4, skip_frames=3,
+                                     batch_size=4, max_wait=None))
+    assert [frame_count for frame_count, *_ in output] == list(range(1, 31))
+    assert sum(results is not None for _, _, results, _ in output) == 10
+    assert model.calls == [4, 4, 2]
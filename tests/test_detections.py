@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from app.detections import batched_nms, box_ios, box_iou, nms
+
+def test_box_iou_matrix():
+    boxes_a = np.array([[0, 0, 10, 10], [100, 100, 110, 110]], np.float32)
+    boxes_b = np.array([[0, 0, 10, 10], [5, 0, 15, 10], [50, 50, 60, 60]], np.float32)
+    iou = box_iou(boxes_a, boxes_b)
+    assert iou.shape == (2, 3)
+    assert iou[0, 0] == pytest.approx(1.0)
+    assert iou[0, 1] == pytest.approx(50 / 150)
+    assert iou[0, 2] == 0
+    assert not iou[1].any()
+
+def test_box_iou_empty():
+    assert box_iou(np.empty((0, 4)), np.array([[0, 0, 1, 1]])).shape == (0, 1)
+
+def test_box_ios_contained_box():
+    # Box bị cắt ở mép tile nằm gọn trong box đầy đủ: IoS = 1 dù IoU thấp
+    full = np.array([[0, 0, 100, 100]], np.float32)
+    clipped = np.array([[0, 0, 30, 100]], np.float32)
+    assert box_ios(full, clipped)[0, 0] == pytest.approx(1.0)
+    assert box_iou(full, clipped)[0, 0] == pytest.approx(0.3)
+
+def test_nms_keeps_best_of_overlapping_boxes():
+    xyxy = np.array([[0, 0, 10, 10], [1, 0, 11, 10], [50, 50, 60, 60]], np.float32)
+    scores = np.array([0.6, 0.9, 0.5])
+    assert nms(xyxy, scores, 0.5).tolist() == [1, 2]
+    # Ngưỡng cao hơn IoU của hai box chồng nhau: giữ cả ba, theo thứ tự điểm
+    assert nms(xyxy, scores, 0.9).tolist() == [1, 0, 2]
+
+def test_batched_nms_is_per_class():
+    xyxy = np.array([[0, 0, 10, 10], [0, 0, 10, 10], [0, 0, 10, 10]], np.float32)
+    scores = np.array([0.9, 0.8, 0.7])
+    classes = np.array([0, 1, 0])
+    assert sorted(batched_nms(xyxy, scores, classes, 0.5).tolist()) == [0, 1]
+    assert batched_nms(np.empty((0, 4)), np.empty(0), np.empty(0), 0.5).size == 0
@@ -0,0 +1,43 @@
+import threading
+
+import pytest
+
+from app.decode import open_video
+from app.pipeline import iter_pipelined_results
+from tests.conftest import CountingModel
+
+def pipeline_threads():
+    return [thread for thread in threading.enumerate() if thread.name in ("video-decode", "video-inference")]
+
+def test_pipeline_matches_serial_order(model, video_path):
+    output = list(iter_pipelined_results(open_video(video_path), model, 0.5, 0.4, skip_frames=3,
+                                         batch_size=4, queue_size=2))
+    assert [frame_count for frame_count, *_ in output] == list(range(1, 31))
+    assert sum(model.calls) == 10
+    assert pipeline_threads() == []
+
+def test_model_error_reaches_caller_and_stops_threads(video_path):
+    model = CountingModel(fail_on_call=2)
+    with pytest.raises(RuntimeError, match="model lỗi"):
+        for _ in iter_pipelined_results(open_video(video_path), model, 0.5, 0.4, skip_frames=1, queue_size=2):
+            pass
+    assert pipeline_threads() == []
+
+def test_decode_error_reaches_caller(model):
+    class BrokenCapture:
+        def grab(self):
+            raise OSError("mất file")
+
+        def get(self, prop):
+            return 0.0
+
+    with pytest.raises(OSError, match="mất file"):
+        list(iter_pipelined_results(BrokenCapture(), model, 0.5, 0.4))
+    assert pipeline_threads() == []
+
+def test_closing_early_stops_threads(model, video_path):
+    # Người dùng dừng giữa chừng: hàng đợi nhỏ làm các luồng đang chờ đưa frame vào thì vẫn phải thoát
+    results = iter_pipelined_results(open_video(video_path), model, 0.5, 0.4, skip_frames=1, queue_size=1)
+    next(results)
+    results.close()
+    assert pipeline_threads() == []
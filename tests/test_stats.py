@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from app.stats import StatsAccumulator, StreamingQuantile
+
+@pytest.mark.parametrize('distribution', ['uniform', 'normal', 'exponential'])
+@pytest.mark.parametrize('p', [0.5, 0.95])
+def test_p2_quantile_close_to_exact(distribution, p):
+    rng = np.random.default_rng(0)
+    samples = getattr(rng, distribution)(size=10000)
+    estimator = StreamingQuantile(p)
+    for value in samples:
+        estimator.add(value)
+    # Sai số so với phân vị chính xác, tính theo độ rộng khoảng giữa p1 và p99 để so được giữa các phân phối
+    spread = np.percentile(samples, 99) - np.percentile(samples, 1)
+    assert abs(estimator.value() - np.percentile(samples, p * 100)) < 0.02 * spread
+
+def test_few_samples_use_exact_percentile():
+    estimator = StreamingQuantile(0.5)
+    assert estimator.value() == 0.0
+    for value in (3.0, 1.0, 2.0):
+        estimator.add(value)
+    assert estimator.value() == 2.0
+
+def test_sorted_input_stays_accurate():
+    # Độ trễ tăng dần (ví dụ máy nóng lên) là trường hợp xấu cho các điểm đánh dấu
+    estimator = StreamingQuantile(0.95)
+    for value in range(1, 1001):
+        estimator.add(float(value))
+    assert estimator.value() == pytest.approx(950, abs=10)
+
+def test_accumulator_reports_latency_quantiles():
+    stats = StatsAccumulator()
+    for index in range(200):
+        stats.add({'helmet': 1, 'no_helmet': 0}, latency=0.01 if index % 10 else 0.1, timestamp=index / 25)
+    summary = stats.summary()
+    assert summary['latency_p50_ms'] == pytest.approx(10, abs=0.5)
+    assert summary['latency_max_ms'] == pytest.approx(100)
+    assert stats.latency_quantile(0.5) == pytest.approx(summary['latency_p50_ms'] / 1000)
@@ -0,0 +1,65 @@
+import numpy as np
+
+from app.detections import Detections
+from app.tracker import IouTracker
+
+NAMES = {0: 'helmet', 1: 'no_helmet'}
+
+def frame(*boxes):
+    # boxes: (x1, y1, x2, y2, class_id)
+    boxes = np.array(boxes, np.float32).reshape(-1, 5)
+    return Detections(boxes[:, :4], np.full(len(boxes), 0.9), boxes[:, 4].astype(int), NAMES)
+
+def test_ids_stay_stable_while_objects_move():
+    tracker = IouTracker()
+    ids = []
+    for step in range(10):
+        results = tracker.update(step + 1, frame((10 + step * 3, 10, 60 + step * 3, 80, 1),
+                                                 (300 - step * 3, 50, 350 - step * 3, 120, 0)))
+        ids.append(results.boxes.id.tolist())
+    assert all(frame_ids == ids[0] for frame_ids in ids)
+    assert len(set(ids[0])) == 2
+
+def test_sparse_frames_match_by_center_distance():
+    # Frame phân tích thưa: box đã dịch xa (IoU = 0) nhưng tâm vẫn gần, vẫn là cùng một người
+    tracker = IouTracker()
+    first = tracker.update(1, frame((0, 0, 40, 80, 1))).boxes.id[0]
+    second = tracker.update(6, frame((42, 0, 82, 80, 1))).boxes.id[0]
+    assert first == second
+
+def test_track_retires_after_max_age_and_is_counted_once():
+    tracker = IouTracker(max_age=5)
+    for frame_count in range(1, 4):
+        tracker.update(frame_count, frame((10, 10, 60, 80, 1)))
+    assert tracker.summary() == {'tracks': 1, 'helmet': 0, 'no_helmet': 1}
+
+    tracker.update(20, frame())
+    assert tracker.tracks == []
+    ended = tracker.confirmed_tracks()
+    assert [track.hits for track in ended] == [3]
+    assert tracker.counts['no_helmet'] == 1
+    # Track đã lấy ra không được trả lại lần nữa, nhưng vẫn nằm trong bộ đếm
+    assert tracker.confirmed_tracks() == []
+    assert tracker.summary()['tracks'] == 1
+
+def test_single_sighting_is_not_counted():
+    tracker = IouTracker(max_age=2, min_hits=2)
+    tracker.update(1, frame((10, 10, 60, 80, 1)))
+    tracker.update(10, frame())
+    assert tracker.confirmed_tracks(final=True) == []
+    assert tracker.summary()['tracks'] == 0
+
+def test_final_flush_ends_active_tracks():
+    tracker = IouTracker()
+    tracker.update(1, frame((10, 10, 60, 80, 0)), timestamp=1000.0)
+    tracker.update(2, frame((11, 10, 61, 80, 0)))
+    tracks = tracker.confirmed_tracks(final=True)
+    assert len(tracks) == 1 and tracks[0].first_seen == 1000.0
+    assert tracker.tracks == [] and tracker.counts['helmet'] == 1
+
+def test_ended_tracks_are_bounded():
+    tracker = IouTracker(max_age=0, min_hits=1, max_ended=5)
+    for frame_count in range(1, 40, 2):
+        tracker.update(frame_count, frame((frame_count * 20, 0, frame_count * 20 + 10, 10, 1)))
+    assert len(tracker.ended) == 5
+    assert tracker.counts['no_helmet'] == 19